@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Broks messages decoding
+
+The broks messages are unserialized and normalized by worker threads, without
+the data lock. The decoded messages are handed off to the data thread in the
+order they were received, through a bounded queue: when the data thread is late,
+the messages reader waits and the broker queue grows.
+"""
+
+import time
+import Queue
+import threading
+import traceback
+
+from shinken.log import logger
+
+from metrics import Histogram
+
+
+class DecodedMessage(object):
+    """ A broks message, decoded by a worker """
+    __slots__ = ('message', 'result', 'done')
+
+    def __init__(self, message):
+        self.message = message
+        self.result = []
+        self.done = threading.Event()
+
+
+class BroksDecoder(object):
+    """ A pool of threads decoding the broks messages
+
+    :param decode: function called with a message (a list of broks), returning the list of
+    the decoded broks
+    :param workers: number of decoding threads
+    :param queue_size: maximum number of messages received and not yet managed
+    """
+
+    def __init__(self, decode, workers=1, queue_size=16):
+        self.decode = decode
+        self.workers = max(1, workers)
+        # Messages to decode, in any order
+        self.tasks = Queue.Queue()
+        # Messages to manage, in the received order
+        self.decoded = Queue.Queue(max(1, queue_size))
+        self.threads = []
+
+        # Time spent waiting for a free place in the queue, and decoding a message, in seconds
+        self.put_wait = Histogram()
+        self.decode_time = Histogram()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work, name='broks-decoder-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, message):
+        """ Queue a message to decode, wait if too many messages are not yet managed """
+        slot = DecodedMessage(message)
+        start = time.time()
+        self.decoded.put(slot)
+        self.put_wait.observe(time.time() - start)
+        self.tasks.put(slot)
+
+    def get(self):
+        """ The next decoded message, in the received order """
+        slot = self.decoded.get()
+        slot.done.wait()
+        return slot.result
+
+    def work(self):
+        while True:
+            slot = self.tasks.get()
+            start = time.time()
+            try:
+                slot.result = self.decode(slot.message)
+            except Exception as exp:
+                logger.error("[WebUI] broks decoding exception: %s", str(exp))
+                logger.error("[WebUI] Back trace: %s", traceback.format_exc())
+            finally:
+                slot.message = None
+                slot.done.set()
+            self.decode_time.observe(time.time() - start)
+
+    def get_stats(self):
+        return {
+            'workers': self.workers,
+            'queue_size': self.decoded.maxsize,
+            'queued': self.decoded.qsize(),
+            'decoding': self.tasks.qsize(),
+            'put_wait': self.put_wait.get_stats(),
+            'decode': self.decode_time.get_stats()
+        }
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Broks stream recording and replay
+
+The recorder writes the broks received by the WebUI, as they were received (not
+yet unserialized), in a gzip compressed file. Each record is the pickled tuple
+(reception time, brok), prefixed with its length.
+
+The file may be replayed into a standalone Regenerator and WebUIDataManager, to
+benchmark the broks management without a running Shinken:
+
+    python brok_stream.py /var/lib/shinken/webui_broks.gz --pace 1
+
+The recording should start with the WebUI, so it contains the initial broks sent
+by the schedulers.
+"""
+
+import sys
+import time
+import gzip
+import struct
+import resource
+import argparse
+import threading
+import cPickle
+
+from shinken.log import logger
+
+# Records length prefix: unsigned 32 bits, network order
+LENGTH = struct.Struct('!I')
+
+
+class BrokRecorder(object):
+    """ Write the received broks in a file, until the file reaches max_size bytes
+
+    :param max_size: maximum size of the uncompressed records, 0 for no limit
+    """
+
+    def __init__(self, path, max_size=0):
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        self.count = 0
+        self.lock = threading.Lock()
+        self.file = gzip.open(path, 'wb')
+        logger.info("[WebUI] Recording the broks in %s", path)
+
+    def record(self, message):
+        """ Record the broks of a message. They must not be prepared yet """
+        now = time.time()
+        with self.lock:
+            if self.file is None:
+                return
+            for brok in message:
+                record = cPickle.dumps((now, brok), cPickle.HIGHEST_PROTOCOL)
+                self.file.write(LENGTH.pack(len(record)))
+                self.file.write(record)
+                self.size += LENGTH.size + len(record)
+                self.count += 1
+            if self.max_size and self.size >= self.max_size:
+                logger.warning("[WebUI] The broks record %s is full, %d broks were recorded",
+                               self.path, self.count)
+                self.file.close()
+                self.file = None
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_broks(path):
+    """ Iterate over the (reception time, brok) records of a file """
+    with gzip.open(path, 'rb') as f:
+        while True:
+            header = f.read(LENGTH.size)
+            if len(header) < LENGTH.size:
+                # End of file, or the last record is truncated
+                return
+            (length,) = LENGTH.unpack(header)
+            record = f.read(length)
+            if len(record) < length:
+                return
+            yield cPickle.loads(record)
+
+
+def replay(path, pace=0, compact=True, searches=()):
+    """ Manage the broks of a file with a Regenerator, and measure the broks management
+
+    :param pace: replay speed relative to the recorded pace, 0 to replay at full speed
+    :param searches: search strings run on the data once all the broks are managed
+    :returns: the replay report, a dictionary
+    """
+    from regenerator import Regenerator
+    from datamanager import WebUIDataManager
+
+    rg = Regenerator()
+    rg.set_compact_elements(compact)
+    datamgr = WebUIDataManager(rg)
+
+    types = {}
+    first = None
+    start = time.time()
+    for received, brok in read_broks(path):
+        if pace:
+            if first is None:
+                first = received
+            delay = (received - first) / pace - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        brok_start = time.time()
+        brok.prepare()
+        rg.manage_brok(brok)
+        duration = time.time() - brok_start
+
+        counters = types.setdefault(brok.type, {'count': 0, 'time': 0.0})
+        counters['count'] += 1
+        counters['time'] += duration
+    duration = time.time() - start
+
+    for counters in types.values():
+        counters['rate'] = counters['count'] / counters['time'] if counters['time'] else None
+
+    search_times = {}
+    for search in searches:
+        search_start = time.time()
+        found = len(datamgr.search_hosts_and_services(search, None))
+        search_times[search] = {'found': found, 'time': time.time() - search_start}
+
+    return {
+        'duration': duration,
+        'broks': sum(counters['count'] for counters in types.values()),
+        'types': types,
+        'linking': types.get('initial_broks_done', {}).get('time', 0.0),
+        'hosts': len(rg.hosts),
+        'services': len(rg.services),
+        'searches': search_times,
+        # Kilobytes on Linux
+        'peak_memory': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'memory': rg.memory
+    }
+
+
+def print_report(report, out=sys.stdout):
+    out.write("Managed %d broks in %.2fs, %d hosts and %d services\n"
+              % (report['broks'], report['duration'], report['hosts'], report['services']))
+    out.write("Linking: %.2fs, peak memory: %d MB\n"
+              % (report['linking'], report['peak_memory'] / 1048576))
+    out.write("%-40s %10s %10s %12s\n" % ('Brok type', 'Count', 'Time (s)', 'Broks/s'))
+    for brok_type, counters in sorted(report['types'].items(), key=lambda item: -item[1]['time']):
+        out.write("%-40s %10d %10.3f %12s\n"
+                  % (brok_type, counters['count'], counters['time'],
+                     '%.0f' % counters['rate'] if counters['rate'] else '-'))
+    for search, result in sorted(report['searches'].items()):
+        out.write("Search '%s': %d elements in %.3fs\n" % (search, result['found'], result['time']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a WebUI broks record")
+    parser.add_argument('path', help="broks record file")
+    parser.add_argument('--pace', type=float, default=0,
+                        help="replay speed relative to the recorded pace, 0 for full speed (default)")
+    parser.add_argument('--no-compact', action='store_true',
+                        help="do not use the compact hosts and services")
+    parser.add_argument('--search', action='append', default=[],
+                        help="search string run once the broks are managed, may be repeated")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = replay(args.path, pace=args.pace, compact=not args.no_compact, searches=args.search)
+    if args.json:
+        import json
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compact hosts and services
+
+The hosts and services broks carry all the configuration and running properties
+of the elements, most of them are never used by the WebUI. The compact elements
+only keep the live state fields and the other attributes used by the WebUI, the
+values of the other attributes are not stored. The attributes that are not kept
+fall back to the Shinken properties default values when they are read.
+"""
+
+import sys
+import copy
+import resource
+
+# Live state fields, always kept
+HOT_FIELDS = (
+    'state', 'state_id', 'state_type', 'last_check', 'last_chk', 'last_state_change',
+    'output', 'long_output', 'perf_data', 'problem_has_been_acknowledged',
+    'in_scheduled_downtime', 'is_flapping', 'is_problem', 'is_impact', 'business_impact'
+)
+
+# Attributes used by the Regenerator to identify and link the elements
+STRUCTURAL_FIELDS = (
+    'id', 'uuid', 'instance_id', 'register', 'name', 'host_name', 'service_description',
+    'display_name', 'host', 'services', 'hostgroups', 'servicegroups', 'contacts',
+    'contact_groups', 'parents', 'childs', 'parent_dependencies', 'child_dependencies',
+    'source_problems', 'impacts', 'downtimes', 'comments', 'check_command', 'event_handler',
+    'check_period', 'notification_period', 'maintenance_period', 'realm', 'realm_name',
+    'tags', 'customs'
+)
+
+# Configuration and running attributes displayed by the WebUI
+DEFAULT_KEPT_ATTRIBUTES = (
+    'action_url', 'active_checks_enabled', 'address', 'alias', 'attempt', 'check_freshness',
+    'check_interval', 'current_notification_number', 'custom_views', 'event_handler_enabled',
+    'execution_time', 'flap_detection_enabled', 'flap_detection_options', 'freshness_threshold',
+    'high_flap_threshold', 'last_notification', 'latency', 'location', 'low_flap_threshold',
+    'max_check_attempts', 'next_chk', 'notes', 'notes_url', 'notification_interval',
+    'notification_options', 'notifications_enabled', 'passive_checks_enabled', 'port',
+    'process_perf_data', 'reachable', 'retry_interval', 'stalking_options'
+)
+
+# Low cardinality attributes whose values are shared by all the elements
+DEFAULT_INTERNED_ATTRIBUTES = (
+    'state', 'state_type', 'last_state', 'last_state_type', 'last_hard_state', 'host_name',
+    'service_description', 'display_name', 'realm', 'realm_name', 'check_type'
+)
+
+# Plugins outputs, identical outputs may be shared by the elements
+DEDUPLICATED_ATTRIBUTES = ('output', 'long_output')
+
+# Attributes initialized when a compact element is created
+INITIALIZED_FIELDS = frozenset(HOT_FIELDS + STRUCTURAL_FIELDS)
+
+
+def all_slots(cls):
+    """ The slots of a class and its base classes """
+    for klass in cls.__mro__:
+        for name in klass.__dict__.get('__slots__', ()):
+            yield name
+
+
+class CompactElement(object):
+    """ Mixin for the hosts and services classes
+
+    Only the running properties of the hot and structural fields are initialized, the
+    other ones are returned from the properties default values when they are read. A
+    mutable default value is copied and set when it is read, so it may be updated in place.
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        # Only called when the attribute is not set
+        if name.startswith('__'):
+            raise AttributeError(name)
+        cls = self.__class__
+        for properties in (cls.running_properties, cls.properties):
+            prop = properties.get(name, None)
+            if prop is not None and prop.has_default:
+                if isinstance(prop.default, (list, dict, set)):
+                    value = copy.copy(prop.default)
+                    setattr(self, name, value)
+                    return value
+                return prop.default
+        raise AttributeError("'%s' object has no attribute '%s'" % (cls.__name__, name))
+
+    def init_running_properties(self):
+        for prop, entry in self.__class__.running_properties.items():
+            if prop in INITIALIZED_FIELDS:
+                setattr(self, prop, copy.copy(entry.default))
+
+    def __getstate__(self):
+        slots = {}
+        for name in all_slots(self.__class__):
+            if name.startswith('__'):
+                continue
+            try:
+                slots[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        return getattr(self, '__dict__', {}), slots
+
+    def __setstate__(self, state):
+        attributes, slots = state
+        for name, value in attributes.items():
+            setattr(self, name, value)
+        for name, value in slots.items():
+            setattr(self, name, value)
+
+
+def element_size(elt):
+    """ Approximate size of an element record, in bytes, without the referenced objects """
+    size = sys.getsizeof(elt)
+    attributes = getattr(elt, '__dict__', None)
+    if attributes is not None:
+        size += sys.getsizeof(attributes)
+    return size
+
+
+def get_rss():
+    """ Resident memory of the process, in bytes """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, IndexError, ValueError):
+        # Peak usage in kilobytes on Linux, the current usage is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ValuesTable(object):
+    """ Share the identical string values
+
+    The brok values equal to a value already in the table are replaced by the table
+    value, so all the elements reference the same string. A bounded table is cleared
+    when it is full, the values it shared are still shared.
+    """
+
+    def __init__(self, max_size=0):
+        self.max_size = max_size
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, value):
+        return value in self.values
+
+    def share(self, value):
+        if not isinstance(value, basestring):
+            return value
+        try:
+            shared = self.values[value]
+        except KeyError:
+            if self.max_size and len(self.values) >= self.max_size:
+                self.values.clear()
+            self.values[value] = value
+            self.misses += 1
+            return value
+        self.hits += 1
+        return shared
+
+    def get_stats(self):
+        return {
+            'size': self.max_size,
+            'count': len(self.values),
+            'hits': self.hits,
+            'misses': self.misses
+        }
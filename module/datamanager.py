@@ -25,9 +25,10 @@
 # along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import re
 import itertools
+import functools
 import time
+import threading
 from shinken.log import logger
 
 from shinken.misc.datamanager import DataManager
@@ -44,15 +45,115 @@ from shinken.objects.timeperiod import Timeperiod, Timeperiods
 from shinken.objects.command import Command, Commands
 from shinken.misc.sorter import worse_first, last_state_change_earlier
 
+from search_query import SearchQueryCompiler, LRUCache, is_time_dependent
+from elements_index import ElementsIndex
+
+
+def request_memoized(method):
+    """ Keep the results of a getter until the end of the current request, see begin_request.
+        The calls with unhashable arguments are not memoized. """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def memoized(self, *args, **kwargs):
+        memo = getattr(self.request_memo, 'results', None)
+        if memo is None:
+            return method(self, *args, **kwargs)
+
+        key = (name, args, tuple(sorted(kwargs.items())))
+        try:
+            found = memo.get(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+
+        stats = self.request_memo.stats.setdefault(name, {'calls': 0, 'hits': 0, 'saved': 0.0})
+        stats['calls'] += 1
+        if found is not None and self.request_memo.version == self.data_version:
+            result, duration = found
+            stats['hits'] += 1
+            stats['saved'] += duration
+        else:
+            if self.request_memo.version != self.data_version:
+                memo.clear()
+                self.request_memo.version = self.data_version
+            start = time.time()
+            result = method(self, *args, **kwargs)
+            memo[key] = (result, time.time() - start)
+
+        # The callers may update the returned lists
+        return list(result) if isinstance(result, list) else result
+
+    return memoized
+
 
 class WebUIDataManager(DataManager):
 
-    def __init__(self, rg=None, problems_business_impact=0, important_problems_business_impact=0, disable_inner_problems_computation=0):
+    def __init__(self, rg=None, problems_business_impact=0, important_problems_business_impact=0, disable_inner_problems_computation=0,
+                 search_plans_cache_size=256, search_results_cache_size=128):
         super(WebUIDataManager, self).__init__()
         self.rg = rg
         self.problems_business_impact = problems_business_impact
         self.important_problems_business_impact = important_problems_business_impact
         self.disable_inner_problems_computation = disable_inner_problems_computation
+        # Compiled search strings
+        self.search_compiler = SearchQueryCompiler(search_plans_cache_size)
+        # Search results for the current Regenerator data version
+        self.search_results = LRUCache(search_results_cache_size)
+        self.search_results_version = None
+        self.search_results_lock = threading.Lock()
+        # Index view read by the current thread
+        self.reading = threading.local()
+        # Getters results of the request served by the current thread
+        self.request_memo = threading.local()
+
+    def reset_locks(self):
+        """ Create the caches and their locks again, in a forked process. The threads that may
+            have held the locks, or been updating the caches, were not forked.
+        """
+        self.search_compiler = SearchQueryCompiler(self.search_compiler.plans.size)
+        self.search_results = LRUCache(self.search_results.size)
+        self.search_results_version = None
+        self.search_results_lock = threading.Lock()
+
+    def begin_read(self):
+        """ Read the index view published by the Regenerator until end_read, in the current thread.
+
+            :returns: the data version of the view, None if no view is published
+        """
+        view = self.rg.published_view
+        self.reading.view = view
+        return view.version if view is not None else None
+
+    def end_read(self):
+        self.reading.view = None
+
+    def begin_request(self):
+        """ Memoize the getters results in the current thread, until end_request """
+        self.request_memo.results = {}
+        self.request_memo.stats = {}
+        self.request_memo.version = self.data_version
+
+    def end_request(self):
+        """ Drop the memoized results of the current thread
+
+            :returns: the calls per getter: number of calls, of memoized results and time saved
+        """
+        stats = getattr(self.request_memo, 'stats', None)
+        self.request_memo.results = None
+        self.request_memo.stats = None
+        return stats
+
+    @property
+    def elements_index(self):
+        """ The elements index read by the current thread: the view it is reading, else the live index """
+        view = getattr(self.reading, 'view', None)
+        return view if view is not None else self.rg.elements_index
+
+    @property
+    def data_version(self):
+        """ The data version read by the current thread """
+        view = getattr(self.reading, 'view', None)
+        return view.version if view is not None else self.rg.data_version
 
     @property
     def is_initialized(self):
@@ -69,6 +170,26 @@ class WebUIDataManager(DataManager):
         logger.debug("[WebUI - relation], DM _is_related_to: %s", item.__class__)
         return user._is_related_to(item)
 
+    @staticmethod
+    def _visibility_key(user):
+        """ Identify the set of elements a user is allowed to view """
+        # if no user or user is an admin, all the elements are visible
+        if not user or user.is_administrator():
+            return None
+        return user.get_name()
+
+    def _visible_elements(self, user):
+        """ The hosts and services a user is allowed to view, as a set-like object
+
+            The elements index registers the elements under the contacts that are related to them,
+            as User._is_related_to does for the hosts and services.
+        """
+        index = self.elements_index
+        # if no user or user is an admin, all the elements are visible
+        if not user or user.is_administrator():
+            return index.all()
+        return index.get('contact', user.get_name())
+
     @staticmethod
     def _only_related_to(items, user):
         """ This function is just a wrapper to _is_related_to for a list.
@@ -88,6 +209,7 @@ class WebUIDataManager(DataManager):
     ##
     # Hosts
     ##
+    @request_memoized
     def get_hosts(self, user=None):
         """ Get a list of all hosts.
 
@@ -96,22 +218,26 @@ class WebUIDataManager(DataManager):
         """
         return self.search_hosts_and_services('type:host', user)
 
+    @request_memoized
     def get_important_hosts(self, user=None):
         return self.search_hosts_and_services(
                 'type:host bi:>%d' % self.important_problems_business_impact,
                 user
                 )
 
+    @request_memoized
     def get_host(self, name, user=None):
         """ Get a host by its hostname. """
 
         hosts = self.search_hosts_and_services('type:host host:^%s$' % (name), user=user)
         return hosts[0] if hosts else None
 
+    @request_memoized
     def get_host_services(self, hname, user):
         """ Get host services by its hostname. """
         return self.search_hosts_and_services('type:service host:%s' % (hname), user=user)
 
+    @request_memoized
     def get_percentage_hosts_state(self, user=None, problem=False):
         """ Get percentage of hosts not in (or in) problems.
 
@@ -130,77 +256,84 @@ class WebUIDataManager(DataManager):
         logger.debug("Hosts count: %s / %s / %s", count, h['nb_problems'], h['nb_elts'])
         return round(100.0 * (count / h['nb_elts']), 1)
 
-    def get_hosts_synthesis(self, elts=None, user=None):
+    def _synthesis_counts(self, my_type, elts, user, important=False):
+        """ Count the elements of a type per synthesis class.
+
+            The counts of all the elements a user is allowed to view are maintained by the
+            elements index, only the provided elements are counted.
+
+            :param important: only count the elements with a business impact higher than the
+                              important problems business impact
+            :returns: dictionary of synthesis class -> count, that must not be updated
+        """
         if elts is not None:
-            hosts = [item for item in elts if item.__class__.my_type == 'host']
+            counts = {}
+            for elt in elts:
+                if elt.__class__.my_type == my_type:
+                    synthesis_class = ElementsIndex.get_synthesis_class(elt)
+                    counts[synthesis_class] = counts.get(synthesis_class, 0) + 1
         else:
-            hosts = self.get_hosts(user=user)
-        logger.debug("[WebUI - datamanager] get_hosts_synthesis, %d hosts", len(hosts))
-
-        h = dict()
-        h['nb_elts'] = len(hosts)
-        if hosts:
-            h['bi'] = max(h.business_impact for h in hosts)
-
-            for state in 'up', 'pending':
-                h['nb_' + state] = sum(1 for host in hosts if host.state == state.upper())
-                h['pct_' + state] = round(100.0 * h['nb_' + state] / h['nb_elts'], 1)
-            for state in 'down', 'unreachable', 'unknown':
-                h['nb_' + state] = sum(1 for host in hosts if host.state == state.upper()
-                                       and not (host.problem_has_been_acknowledged or host.in_scheduled_downtime))
-                h['pct_' + state] = round(100.0 * h['nb_' + state] / h['nb_elts'], 1)
-
-            # Our own computation !
-            # ------
-            # Shinken/Alignak does not always reflect the "problem" state from a user point of view ...
-            # To make UI more consistent, build our own problems counter!
-            if not self.disable_inner_problems_computation:
-                h['nb_ack'] = 0
-                h['nb_problems'] = 0
-                h['nb_impacts'] = 0
-                for host in hosts:
-                    if host.state_type.upper() not in ['HARD']:
-                        continue
-                    # An host is a problem if it is in a HARD DOWN or UNKNOWN state
-                    if host.state.lower() in ['down', 'unknown']:
-                        host.is_problem = True
-                    # An host is impacted if it is UNREACHABLE
-                    if host.state.lower() in ['unreachable']:
-                        host.is_impact = True
-
-                    if host.is_problem and host.problem_has_been_acknowledged:
-                        h['nb_ack'] += 1
-
-                    if host.is_problem and not host.problem_has_been_acknowledged:
-                        h['nb_problems'] += 1
-                        if host.is_impact:
-                            h['nb_impacts'] += 1
-            else:
-                h['nb_problems'] = sum(1 for host in hosts if host.is_problem
-                                       and not host.problem_has_been_acknowledged)
-                h['nb_impacts'] = sum(1 for host in hosts if host.is_problem
-                                      and not host.problem_has_been_acknowledged and host.is_impact)
-                h['nb_ack'] = sum(1 for host in hosts if host.is_problem and host.problem_has_been_acknowledged)
-
-            h['pct_problems'] = round(100.0 * h['nb_problems'] / h['nb_elts'], 1)
-            h['pct_ack'] = round(100.0 * h['nb_ack'] / h['nb_elts'], 1)
-            h['nb_downtime'] = sum(1 for host in hosts if host.in_scheduled_downtime)
-            h['pct_downtime'] = round(100.0 * h['nb_downtime'] / h['nb_elts'], 1)
+            # pylint: disable=undefined-variable
+            if isinstance(user, (unicode, str)):
+                user = self.rg.contacts.find_by_name(user)
+            counts = self.elements_index.get_synthesis(my_type, self._visibility_key(user))
+
+        if important:
+            counts = dict((synthesis_class, count) for synthesis_class, count in counts.items()
+                          if synthesis_class.bi > self.important_problems_business_impact)
+        return counts
+
+    def _synthesis(self, counts, ok_states, problem_states):
+        """ Build a synthesis from the elements counts per synthesis class. """
+        def count(predicate):
+            return sum(nb for synthesis_class, nb in counts.iteritems() if predicate(synthesis_class))
+
+        d = dict()
+        d['nb_elts'] = sum(counts.itervalues())
+        if d['nb_elts']:
+            d['bi'] = max(synthesis_class.bi for synthesis_class in counts)
+
+            for state in ok_states:
+                d['nb_' + state] = count(lambda c: c.state == state.upper())
+                d['pct_' + state] = round(100.0 * d['nb_' + state] / d['nb_elts'], 1)
+            for state in problem_states:
+                d['nb_' + state] = count(lambda c: c.state == state.upper() and not (c.ack or c.downtime))
+                d['pct_' + state] = round(100.0 * d['nb_' + state] / d['nb_elts'], 1)
+
+            # The Regenerator classified the HARD problems and impacts when their state changed,
+            # only count those when using our own computation
+            inner = not self.disable_inner_problems_computation
+            d['nb_problems'] = count(lambda c: c.problem and not c.ack and (c.hard or not inner))
+            d['nb_impacts'] = count(lambda c: c.problem and not c.ack and c.impact and (c.hard or not inner))
+            d['nb_ack'] = count(lambda c: c.problem and c.ack and (c.hard or not inner))
+
+            d['pct_problems'] = round(100.0 * d['nb_problems'] / d['nb_elts'], 1)
+            d['pct_ack'] = round(100.0 * d['nb_ack'] / d['nb_elts'], 1)
+            d['nb_downtime'] = count(lambda c: c.downtime)
+            d['pct_downtime'] = round(100.0 * d['nb_downtime'] / d['nb_elts'], 1)
         else:
-            h['bi'] = 0
-            for state in 'up', 'down', 'unreachable', 'pending', 'unknown', 'ack', 'downtime', 'problems':
-                h['nb_' + state] = 0
-                h['pct_' + state] = 0
+            d['bi'] = 0
+            for state in ok_states + problem_states + ('ack', 'downtime', 'problems'):
+                d['nb_' + state] = 0
+                d['pct_' + state] = 0
+        return d
+
+    @request_memoized
+    def get_hosts_synthesis(self, elts=None, user=None, important=False):
+        counts = self._synthesis_counts('host', elts, user, important)
+        h = self._synthesis(counts, ('up', 'pending'), ('down', 'unreachable', 'unknown'))
 
         logger.debug("[WebUI - datamanager] get_hosts_synthesis: %s", h)
         return h
 
+    @request_memoized
     def get_important_hosts_synthesis(self, user=None):
-        return self.get_hosts_synthesis(elts=self.get_important_hosts(user))
+        return self.get_hosts_synthesis(user=user, important=True)
 
     ##
     # Services
     ##
+    @request_memoized
     def get_services(self, user=None):
         """ Get a list of all services.
 
@@ -209,17 +342,20 @@ class WebUIDataManager(DataManager):
         """
         return self.search_hosts_and_services('type:service', user)
 
+    @request_memoized
     def get_important_services(self, user=None):
         return self.search_hosts_and_services(
                 'type:service bi:>%d' % self.important_problems_business_impact,
                 user
                 )
 
+    @request_memoized
     def get_service(self, hname, sname, user):
         """ Get a service by its hostname and service description. """
         services = self.search_hosts_and_services('type:service host:^%s$ service:"^%s$"' % (hname, sname), user=user)
         return services[0] if services else None
 
+    @request_memoized
     def get_percentage_service_state(self, user=None, problem=False):
         """ Get percentage of services not in (or in) problems.
 
@@ -239,83 +375,22 @@ class WebUIDataManager(DataManager):
         logger.debug("Services count: %s / %s / %s", count, s['nb_problems'], s['nb_elts'])
         return round(100.0 * (count / s['nb_elts']), 1)
 
-    def get_services_synthesis(self, elts=None, user=None):
-        if elts is not None:
-            services = [item for item in elts if item.__class__.my_type == 'service']
-        else:
-            services = self.get_services(user=user)
-        logger.debug("[WebUI - datamanager] get_services_synthesis, %d services", len(services))
-
-        s = dict()
-        s['nb_elts'] = len(services)
-        if services:
-            s['bi'] = max(s.business_impact for s in services)
-
-            for state in 'ok', 'pending':
-                s['nb_' + state] = sum(1 for service in services if service.state == state.upper())
-                s['pct_' + state] = round(100.0 * s['nb_' + state] / s['nb_elts'], 1)
-            for state in 'warning', 'critical', 'unreachable', 'unknown':
-                s['nb_' + state] = sum(1 for service in services if service.state == state.upper()
-                                       and not (service.problem_has_been_acknowledged or service.in_scheduled_downtime))
-                s['pct_' + state] = round(100.0 * s['nb_' + state] / s['nb_elts'], 1)
-
-            s['nb_impacts'] = 0
-            # Our own computation !
-            # ------
-            # Shinken/Alignak does not always reflect the "problem" state from a user point of view ...
-            # To make UI more consistent, build our own problems counter!
-            if not self.disable_inner_problems_computation:
-                s['nb_ack'] = 0
-                s['nb_problems'] = 0
-                for service in services:
-                    if service.state_type.upper() not in ['HARD']:
-                        continue
-                    # A service is a problem if it is in a HARD WARNING, CRITICAL or UNKNOWN state
-                    if service.state.lower() in ['warning', 'critical', 'unknown']:
-                        service.is_problem = True
-                    # A service is impacted if its host is not UP
-                    if service.host.state not in ['up']:
-                        service.is_impact = True
-                    # A service is impacted if it is UNREACHABLE
-                    if service.state.lower() in ['unreachable']:
-                        service.is_impact = True
-
-                    if service.is_problem and service.problem_has_been_acknowledged:
-                        s['nb_ack'] += 1
-
-                    if service.is_problem and not service.problem_has_been_acknowledged:
-                        s['nb_problems'] += 1
-                        if service.is_impact:
-                            s['nb_impacts'] += 1
-            else:
-                s['nb_problems'] = sum(1 for service in services if service.is_problem
-                                       and not service.problem_has_been_acknowledged)
-                s['nb_impacts'] = sum(1 for service in services if service.is_problem
-                                      and not service.problem_has_been_acknowledged and service.is_impact)
-                s['nb_ack'] = sum(1 for service in services if service.is_problem
-                                  and service.problem_has_been_acknowledged)
-
-            s['pct_problems'] = round(100.0 * s['nb_problems'] / s['nb_elts'], 1)
-            s['pct_ack'] = round(100.0 * s['nb_ack'] / s['nb_elts'], 1)
-            s['nb_downtime'] = sum(1 for service in services if service.in_scheduled_downtime)
-            s['pct_downtime'] = round(100.0 * s['nb_downtime'] / s['nb_elts'], 1)
-        else:
-            s['bi'] = 0
-            for state in ['ok', 'warning', 'critical',
-                          'pending', 'unreachable', 'unknown',
-                          'ack', 'downtime', 'problems']:
-                s['nb_' + state] = 0
-                s['pct_' + state] = 0
+    @request_memoized
+    def get_services_synthesis(self, elts=None, user=None, important=False):
+        counts = self._synthesis_counts('service', elts, user, important)
+        s = self._synthesis(counts, ('ok', 'pending'), ('warning', 'critical', 'unreachable', 'unknown'))
 
         logger.debug("[WebUI - datamanager] get_services_synthesis: %s", s)
         return s
 
+    @request_memoized
     def get_important_services_synthesis(self, user=None):
-        return self.get_services_synthesis(elts=self.get_important_services(user))
+        return self.get_services_synthesis(user=user, important=True)
 
     ##
     # Elements
     ##
+    @request_memoized
     def get_element(self, name, user):
         """ Get an element by its name.
             :name: Must be "host" or "host/service"
@@ -332,11 +407,181 @@ class WebUIDataManager(DataManager):
     ##
     # Searching
     ##
+    def _search_flag(self, flag):
+        """ Elements having a flag set. A service also has the flag if its host has it. """
+        index = self.elements_index
+        elements = index.get(flag, True)
+        hosts = [e for e in elements if e.__class__.my_type == 'host']
+        if not hosts:
+            return elements
+
+        elements = set(elements)
+        for host in hosts:
+            elements.update(index.get('host', host.host_name))
+        return elements
+
+    def _search_index(self, term):
+        """ Get the index lookups for an indexed search term.
+
+            :returns: a list of (elements, exclude) tuples to apply to the searched elements,
+                      or None if the term is not an indexed one
+        """
+        index = self.elements_index
+        t, s = term.key, term.value
+
+        if t in ['h', 'host']:
+            if term.pattern is None:
+                return []
+            return [(index.find('host', term.pattern), False)]
+
+        if t in ['s', 'service']:
+            if term.pattern is None:
+                return []
+            return [(index.find('service', term.pattern), False)]
+
+        if t in ['c', 'contact']:
+            if s.lower() == 'all':
+                return []
+            # :TODO:maethor:171012: hosts and services are never matching a contact
+            return [(set(), False)]
+
+        if t in ['hg', 'hgroup', 'hostgroup']:
+            group = None if s.lower() == 'all' else self.get_hostgroup(s)
+            if not group:
+                return []
+            logger.debug("[WebUI - datamanager] found the group: %s", group.get_name())
+            return [(index.get('hostgroup', group.get_name()), False)]
+
+        if t in ['sg', 'sgroup', 'servicegroup']:
+            group = None if s.lower() == 'all' else self.get_servicegroup(s)
+            if not group:
+                return []
+            logger.debug("[WebUI - datamanager] found the group: %s", group.get_name())
+            return [(index.get('servicegroup', group.get_name()), False)]
+
+        if t == 'realm':
+            return [(index.get('realm', s), False)]
+
+        if t in ['htag', 'stag']:
+            if s.lower() == 'all':
+                return []
+            return [(index.get(t, s), False)]
+
+        if t == 'type':
+            if s.lower() == 'all':
+                return []
+            return [(index.get('type', s), False)]
+
+        if t in ['bp', 'bi']:
+            if term.predicate is None:
+                return [(set(), False)]
+            return [(index.select('bi', term.predicate), False)]
+
+        if t in ['is', 'isnot']:
+            exclude = (t == 'isnot')
+            if s.lower() in ['ack', 'downtime']:
+                return [(self._search_flag(s.lower()), exclude)]
+            if s.lower() in ['impact', 'flapping']:
+                return [(index.get(s.lower(), True), exclude)]
+
+            hard = index.get('state_type', 'HARD')
+            if s.lower() == 'soft':
+                return [(hard, not exclude)]
+            if s.lower() == 'hard':
+                return [(hard, exclude)]
+
+            # Manage SOFT & HARD state
+            # :COMMENT:maethor:171006: Kept for retrocompatility
+            lookups = []
+            if s.startswith('s'):
+                s = s[1:]
+                lookups.append((hard, True))
+            elif s.startswith('h'):
+                s = s[1:]
+                lookups.append((hard, False))
+                exclude = True
+            try:
+                if len(s) == 1:
+                    state = index.get('state_id', int(s))
+                else:
+                    state = index.get('state', s.upper())
+            except ValueError:
+                return [(set(), False)]
+            lookups.append((state, exclude))
+            return lookups
+
+        return None
+
+    @staticmethod
+    def _match_name(pat, i):
+        """ Does a free text term match the name of an element, or of its impacts and problems? """
+        for j in itertools.chain([i], i.impacts, i.source_problems):
+            if (pat.search(j.get_full_name())
+                    or (j.__class__.my_type == 'host' and j.alias and pat.search(j.alias))):
+                return True
+        return False
+
+    @staticmethod
+    def _match_output(pat, i):
+        """ Does a free text term match the output of an element, or of its impacts and problems? """
+        for j in itertools.chain([i], i.impacts, i.source_problems):
+            if pat.search(j.output):
+                return True
+        return False
+
+    def _search_scan(self, term, items, user):
+        """ Filter the items with a search term that can not be resolved with the indexes,
+            except the free text terms.
+
+            :returns: the filtered items
+        """
+        t, s = term.key, term.value
+
+        if t in ['cg', 'cgroup', 'contactgroup']:
+            if s.lower() == 'all':
+                return items
+            logger.debug("[WebUI - datamanager] searching for items related with the contactgroup %s", s)
+            group = self.get_contactgroup(s, user)
+            if not group:
+                return items
+            logger.debug("[WebUI - datamanager] found the group: %s", group.get_name())
+
+            contacts = [c for c in self.get_contacts(user=user) if c in group.members]
+            logger.debug("[WebUI - datamanager] contacts: %s", contacts)
+
+            return set(itertools.chain(*[self._only_related_to(items, self.rg.contacts.find_by_name(c))
+                                         for c in contacts]))
+
+        if t == 'ctag':
+            if s.lower() == 'all':
+                return items
+            contacts = [c for c in self.get_contacts(user=user) if s in c.tags]
+            return set(itertools.chain(*[self._only_related_to(items, c) for c in contacts]))
+
+        if t == 'duration':
+            if term.predicate is None:
+                return []
+            now = time.time()
+            return [i for i in items if term.predicate(now - int(i.last_state_change))]
+
+        # Unknown search term, ignore it
+        return items
+
     def search_hosts_and_services(self, search, user, sorter=None):
         """ Search hosts and services.
 
             This method is the heart of the datamanager. All other methods should be based on this one.
 
+            The search string is compiled once into a plan that is cached by the search query
+            compiler. The key:value search terms are resolved with the Regenerator elements index.
+            Only the remaining terms (free text names, durations and contacts relations) are
+            scanning the elements selected by the previous terms.
+
+            The terms are applied in the search order. A free text term matches the elements
+            names, or their outputs if no name of the elements selected by the previous terms
+            matches. The names or outputs filter is only applied at the end, on the elements
+            selected by all the other terms.
+
             :search: Search string
             :user: concerned user
             :sorter: function to sort the items. default=None (means no sorting)
@@ -348,316 +593,89 @@ class WebUIDataManager(DataManager):
         if isinstance(user, (unicode, str)):
             user = self.rg.contacts.find_by_name(user)
 
-        items = []
-        items.extend(self._only_related_to(super(WebUIDataManager, self).get_hosts(), user))
-        items.extend(self._only_related_to(super(WebUIDataManager, self).get_services(), user))
-
-        logger.debug("[WebUI - datamanager] search_hosts_and_services, search for %s in %d items", search, len(items))
-
-        # Search patterns like: isnot:0 isnot:ack isnot:"downtime fred" name "vm fred"
-        regex = re.compile(
-            r'''
-                                    # 1/ Search a key:value pattern.
-                (?P<key>\w+):       # Key consists of only a word followed by a colon
-                (?P<quote2>["']?)   # Optional quote character.
-                (?P<value>.*?)      # Value is a non greedy match
-                (?P=quote2)         # Closing quote equals the first.
-                ($|\s)              # Entry ends with whitespace or end of string
-                |                   # OR
-                                    # 2/ Search a single string quoted or not
-                (?P<quote>["']?)    # Optional quote character.
-                (?P<name>.*?)       # Name is a non greedy match
-                (?P=quote)          # Closing quote equals the opening one.
-                ($|\s)              # Entry ends with whitespace or end of string
-            ''',
-            re.VERBOSE)
-
-        # Replace "NOT foo" by "^((?!foo).)*$" to ignore foo
-        search = re.sub(r'NOT ([^\ ]*)', r'^((?!\1).)*$', search)
-        search = re.sub(r'not ([^\ ]*)', r'^((?!\1).)*$', search)
-
-        patterns = []
-        for match in regex.finditer(search):
-            if match.group('name'):
-                patterns.append(('name', match.group('name')))
-            elif match.group('key'):
-                patterns.append((match.group('key'), match.group('value')))
-        logger.debug("[WebUI - datamanager] search patterns: %s", patterns)
-
-        for t, s in patterns:
-            t = t.lower()
-            logger.debug("[WebUI - datamanager] searching for %s %s", t, s)
-
-            if t == 'name':
-                # Case insensitive
-                pat = re.compile(s, re.IGNORECASE)
-                new_items = []
-                for i in items:
-                    if (pat.search(i.get_full_name())
-                            or (i.__class__.my_type == 'host' and i.alias and pat.search(i.alias))):
-                        new_items.append(i)
-                    else:
-                        for j in i.impacts + i.source_problems:
-                            if (pat.search(j.get_full_name())
-                                    or (j.__class__.my_type == 'host' and j.alias and pat.search(j.alias))):
-                                new_items.append(i)
-
-                if not new_items:
-                    for i in items:
-                        if pat.search(i.output):
-                            new_items.append(i)
-                        else:
-                            for j in i.impacts + i.source_problems:
-                                if pat.search(j.output):
-                                    new_items.append(i)
-
-                items = new_items
-
-            if (t in ['h', 'host']) and s.lower() != 'all':
-                logger.debug("[WebUI - datamanager] searching for an host %s", s)
-                # Case sensitive
-                pat = re.compile(s)
-                new_items = []
-                for i in items:
-                    if i.__class__.my_type == 'host' and pat.search(i.get_name()):
-                        new_items.append(i)
-                    if i.__class__.my_type == 'service' and pat.search(i.host_name):
-                        new_items.append(i)
-
-                items = new_items
-                logger.debug("[WebUI - datamanager] host:%s, %d matching items", s, len(items))
-                for item in items:
-                    logger.debug("[WebUI - datamanager] item %s is %s", item.get_name(), item.__class__)
-
-            if (t in ['s', 'service']) and s.lower() != 'all':
-                logger.debug("[WebUI - datamanager] searching for a service %s", s)
-                pat = re.compile(s)
-                new_items = []
-                for i in items:
-                    if i.__class__.my_type == 'service' and pat.search(i.get_name()):
-                        new_items.append(i)
-
-                items = new_items
-                logger.debug("[WebUI - datamanager] service:%s, %d matching items", s, len(items))
-                for item in items:
-                    logger.debug("[WebUI - datamanager] item %s is %s", item.get_name(), item.__class__)
-
-            if (t in ['c', 'contact']) and s.lower() != 'all':
-                logger.debug("[WebUI - datamanager] searching for a contact %s", s)
-                pat = re.compile(s)
-                new_items = []
-                for i in items:
-                    if i.__class__.my_type == 'contact' and pat.search(i.get_name()):
-                        new_items.append(i)
-                    if i.__class__.my_type == 'host':
-                        # :TODO:maethor:171012:
-                        pass
-                    if i.__class__.my_type == 'service':
-                        # :TODO:maethor:171012:
-                        pass
-
-                items = new_items
-
-            if (t in ['hg', 'hgroup', 'hostgroup']) and s.lower() != 'all':
-                logger.debug("[WebUI - datamanager] searching for items in the hostgroup %s", s)
-                group = self.get_hostgroup(s)
-                if group:
-                    logger.debug("[WebUI - datamanager] found the group: %s", group.get_name())
-                    # This filters items that are related with the hostgroup only
-                    # if the item has an hostgroups property
-                    items = [i for i in items if getattr(i, 'get_hostgroups') and
-                             group.get_name() in [g.get_name() for g in i.get_hostgroups()]]
-
-            if (t in ['sg', 'sgroup', 'servicegroup']) and s.lower() != 'all':
-                logger.debug("[WebUI - datamanager] searching for items in the servicegroup %s", s)
-                group = self.get_servicegroup(s)
-                if group:
-                    logger.debug("[WebUI - datamanager] found the group: %s", group.get_name())
-                    # Only the items that have a servicegroups property
-                    items = [i for i in items if getattr(i, 'servicegroups') and
-                             group.get_name() in [g.get_name() for g in i.servicegroups]]
-
-            if (t in ['cg', 'cgroup', 'contactgroup']) and s.lower() != 'all':
-                logger.debug("[WebUI - datamanager] searching for items related with the contactgroup %s", s)
-                group = self.get_contactgroup(s, user)
-                if group:
-                    logger.debug("[WebUI - datamanager] found the group: %s", group.get_name())
-
-                    contacts = [c for c in self.get_contacts(user=user) if c in group.members]
-                    logger.info("[WebUI - datamanager] contacts: %s", contacts)
-
-                    items = list(set(itertools.chain(*[self._only_related_to(items,
-                                                                             self.rg.contacts.find_by_name(c))
-                                                       for c in contacts])))
-
-            if t == 'realm':
-                r = self.get_realm(s)
-                if not r:
-                    return []  # :TODO:maethor:150716: raise an error
-                items = [i for i in items if i.get_realm() == r]
-
-            if t == 'htag' and s.lower() != 'all':
-                items = [i for i in items if getattr(i, 'get_host_tags') and s in i.get_host_tags()]
-
-            if t == 'stag' and s.lower() != 'all':
-                items = [i for i in items if getattr(i, 'get_service_tags') and s in i.get_service_tags()]
-
-            if t == 'ctag' and s.lower() != 'all':
-                contacts = [c for c in self.get_contacts(user=user) if s in c.tags]
-                items = list(set(itertools.chain(*[self._only_related_to(items, c) for c in contacts])))
-
-            if t == 'type' and s.lower() != 'all':
-                items = [i for i in items if i.__class__.my_type == s]
-                logger.debug("[WebUI - datamanager] type:%s, %d matching items", s, len(items))
-                for item in items:
-                    logger.debug("[WebUI - datamanager] item %s is %s", item.get_name(), item.__class__)
-
-            if t in ['bp', 'bi']:
-                try:
-                    if s.startswith('>='):
-                        items = [i for i in items if i.business_impact >= int(s[2:])]
-                    elif s.startswith('<='):
-                        items = [i for i in items if i.business_impact <= int(s[2:])]
-                    elif s.startswith('>'):
-                        items = [i for i in items if i.business_impact > int(s[1:])]
-                    elif s.startswith('<'):
-                        items = [i for i in items if i.business_impact < int(s[1:])]
-                    else:
-                        if s.startswith('='):
-                            s = s[1:]
-                        items = [i for i in items if i.business_impact == int(s)]
-                except ValueError:
-                    items = []
-
-            if t == 'duration':
-                seconds_per_unit = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
-                times = [(i, time.time() - int(i.last_state_change)) for i in items]
-                try:
-                    if s.startswith('>='):
-                        s = int(s[2:-1]) * seconds_per_unit[s[-1].lower()]
-                        items = [i[0] for i in times if i[1] >= s]
-                    elif s.startswith('<='):
-                        s = int(s[2:-1]) * seconds_per_unit[s[-1].lower()]
-                        items = [i[0] for i in times if i[1] <= s]
-                    elif s.startswith('>'):
-                        s = int(s[1:-1]) * seconds_per_unit[s[-1].lower()]
-                        items = [i[0] for i in times if i[1] > s]
-                    elif s.startswith('<'):
-                        s = int(s[1:-1]) * seconds_per_unit[s[-1].lower()]
-                        items = [i[0] for i in times if i[1] < s]
-                    else:
-                        items = []
-                except Exception:
-                    items = []
-
-            if t == 'is':
-                if s.lower() == 'ack':
-                    items = [i for i in items if i.__class__.my_type == 'service'
-                             or i.problem_has_been_acknowledged]
-                    items = [i for i in items if i.__class__.my_type == 'host'
-                             or (i.problem_has_been_acknowledged or i.host.problem_has_been_acknowledged)]
-                elif s.lower() == 'downtime':
-                    items = [i for i in items if i.__class__.my_type == 'service'
-                             or i.in_scheduled_downtime]
-                    items = [i for i in items if i.__class__.my_type == 'host'
-                             or (i.in_scheduled_downtime or i.host.in_scheduled_downtime)]
-                elif s.lower() == 'impact':
-                    items = [i for i in items if i.is_impact]
-                elif s.lower() == 'flapping':
-                    items = [i for i in items if i.is_flapping]
-                elif s.lower() == 'soft':
-                    items = [i for i in items if i.state_type != 'HARD']
-                elif s.lower() == 'hard':
-                    items = [i for i in items if i.state_type == 'HARD']
-                else:
-                    # Manage SOFT & HARD state
-                    # :COMMENT:maethor:171006: Kept for retrocompatility
-                    if s.startswith('s'):
-                        s = s[1:]
-                        if len(s) == 1:
-                            items = [i for i in items if i.state_id == int(s) and i.state_type != 'HARD']
-                        else:
-                            items = [i for i in items if i.state == s.upper() and i.state_type != 'HARD']
-                    elif s.startswith('h'):
-                        s = s[1:]
-                        if len(s) == 1:
-                            items = [i for i in items if i.state_id != int(s) and i.state_type == 'HARD']
-                        else:
-                            items = [i for i in items if i.state != s.upper() and i.state_type == 'HARD']
-                    else:
-                        if len(s) == 1:
-                            items = [i for i in items if i.state_id == int(s)]
-                        else:
-                            items = [i for i in items if i.state == s.upper()]
-
-            if t == 'isnot':
-                if s.lower() == 'ack':
-                    items = [i for i in items if i.__class__.my_type == 'service'
-                             or not i.problem_has_been_acknowledged]
-                    items = [i for i in items if i.__class__.my_type == 'host'
-                             or (not i.problem_has_been_acknowledged and not i.host.problem_has_been_acknowledged)]
-                elif s.lower() == 'downtime':
-                    items = [i for i in items if i.__class__.my_type == 'service'
-                             or not i.in_scheduled_downtime]
-                    items = [i for i in items if i.__class__.my_type == 'host'
-                             or (not i.in_scheduled_downtime and not i.host.in_scheduled_downtime)]
-                elif s.lower() == 'impact':
-                    items = [i for i in items if not i.is_impact]
-                elif s.lower() == 'flapping':
-                    items = [i for i in items if not i.is_flapping]
-                elif s.lower() == 'soft':
-                    items = [i for i in items if not i.state_type != 'HARD']
-                elif s.lower() == 'hard':
-                    items = [i for i in items if not i.state_type == 'HARD']
+        index = self.elements_index
+        logger.debug("[WebUI - datamanager] search_hosts_and_services, search for %s in %d items",
+                     search, len(index))
+
+        plan = self.search_compiler.compile(search)
+        logger.debug("[WebUI - datamanager] search plan: %s", plan)
+
+        # Results computed since the last managed brok are still valid. The readers of
+        # an older view may still find their results, until a newer version is searched.
+        # The results of the time dependent searches are not cached
+        version = self.data_version
+        cached = not is_time_dependent(plan)
+        key = (plan, self._visibility_key(user), version, sorter)
+        items = self._get_search_results(key, version) if cached else None
+        if items is not None:
+            logger.debug("[WebUI - datamanager] search_hosts_and_services, cached %d matching items", len(items))
+            # Callers may update the returned list
+            return list(items)
+
+        # Only the elements the user is allowed to view
+        items = self._visible_elements(user)
+
+        # Free text terms and their match function, the names or the outputs
+        texts = []
+        for term in plan:
+            if term.key == 'name':
+                # Only checks if the elements selected so far have a matching name
+                selected = (i for i in items if all(match(text.pattern, i) for text, match in texts))
+                if any(self._match_name(term.pattern, i) for i in selected):
+                    texts.append((term, self._match_name))
                 else:
-                    # Manage soft & hard state
-                    if s.startswith('s'):
-                        s = s[1:]
-                        if len(s) == 1:
-                            items = [i for i in items if i.state_id != int(s) and i.state_type != 'HARD']
-                        else:
-                            items = [i for i in items if i.state != s.upper() and i.state_type != 'HARD']
-                    elif s.startswith('h'):
-                        s = s[1:]
-                        if len(s) == 1:
-                            items = [i for i in items if i.state_id != int(s) and i.state_type == 'HARD']
-                        else:
-                            items = [i for i in items if i.state != s.upper() and i.state_type == 'HARD']
-                    else:
-                        if len(s) == 1:
-                            items = [i for i in items if i.state_id != int(s)]
-                        else:
-                            items = [i for i in items if i.state != s.upper()]
-
-            # :COMMENT:maethor:150616: Legacy filters, kept for bookmarks compatibility
-            if t == 'ack':
-                if s.lower() == 'false' or s.lower() == 'no':
-                    patterns.append(("isnot", "ack"))
-                if s.lower() == 'true' or s.lower() == 'yes':
-                    patterns.append(("is", "ack"))
-            if t == 'downtime':
-                if s.lower() == 'false' or s.lower() == 'no':
-                    patterns.append(("isnot", "downtime"))
-                if s.lower() == 'true' or s.lower() == 'yes':
-                    patterns.append(("is", "downtime"))
-            if t == 'crit':
-                patterns.append(("is", "critical"))
+                    texts.append((term, self._match_output))
+                continue
+
+            lookups = self._search_index(term)
+            if lookups is None:
+                items = self._search_scan(term, items, user)
+            else:
+                for elements, exclude in lookups:
+                    items = (items - elements) if exclude else (items & elements)
+            logger.debug("[WebUI - datamanager] %s:%s, %d matching items", term.key, term.value, len(items))
+
+        for term, match in texts:
+            items = [i for i in items if match(term.pattern, i)]
+            logger.debug("[WebUI - datamanager] %s, %d matching items", term.value, len(items))
+
+        items = index.sort(items)
 
         if sorter is not None:
             items.sort(sorter)
 
-        logger.debug("[WebUI - datamanager] search_hosts_and_services, found %d matching items", len(items))
-
-        logger.debug("[WebUI - datamanager] ----------------------------------------")
-        for item in items:
-            logger.debug("[WebUI - datamanager] item %s is %s", item.get_name(), item.__class__)
-        logger.debug("[WebUI - datamanager] ----------------------------------------")
+        if cached:
+            self._set_search_results(key, version, tuple(items))
 
+        logger.debug("[WebUI - datamanager] search_hosts_and_services, found %d matching items", len(items))
         return items
 
+    def _get_search_results(self, key, version):
+        """ Cached search results, the cache is cleared when a newer data version is searched """
+        with self.search_results_lock:
+            if self.search_results_version is None or version > self.search_results_version:
+                self.search_results.clear()
+                self.search_results_version = version
+            return self.search_results.get(key)
+
+    def _set_search_results(self, key, version, items):
+        """ Cache search results, unless they were computed for an older data version """
+        with self.search_results_lock:
+            if version == self.search_results_version:
+                self.search_results.set(key, items)
+
+    def get_search_cache_stats(self):
+        """ Search plans and results caches statistics """
+        return {
+            'data_version': self.data_version,
+            'plans': self.search_compiler.plans.get_stats(),
+            'results': self.search_results.get_stats()
+        }
+
     ##
     # Timeperiods
     ##
+    @request_memoized
     def get_timeperiods(self, user=None, name=None):
         """ Get a list of known time periods
 
@@ -674,6 +692,7 @@ class WebUIDataManager(DataManager):
 
         return self._only_related_to(items, user)
 
+    @request_memoized
     def get_timeperiod(self, name):
         try:
             name = name.decode('utf8', 'ignore')
@@ -685,6 +704,7 @@ class WebUIDataManager(DataManager):
     ##
     # Commands
     ##
+    @request_memoized
     def get_commands(self, user=None, name=None):
         """ Get a list of known commands
 
@@ -701,6 +721,7 @@ class WebUIDataManager(DataManager):
 
         return self._only_related_to(items, user)
 
+    @request_memoized
     def get_command(self, name):
         try:
             name = name.decode('utf8', 'ignore')
@@ -712,6 +733,7 @@ class WebUIDataManager(DataManager):
     ##
     # Contacts
     ##
+    @request_memoized
     def get_contacts(self, user=None, name=None):
         """ Get a list of known contacts
 
@@ -728,6 +750,7 @@ class WebUIDataManager(DataManager):
 
         return self._only_related_to(items, user)
 
+    @request_memoized
     def get_contact(self, name=None, user=None):
         try:
             name = name.decode('utf8', 'ignore')
@@ -763,6 +786,7 @@ class WebUIDataManager(DataManager):
             except AttributeError:
                 pass
 
+    @request_memoized
     def get_contactgroups(self, user=None, name=None, parent=None, members=False):
         """ Get a list of known contacts groups
 
@@ -787,6 +811,7 @@ class WebUIDataManager(DataManager):
 
         return self._only_related_to(items, user)
 
+    @request_memoized
     def get_contactgroup(self, name, user=None, members=False):
         """ Get a specific contacts group
 
@@ -826,6 +851,7 @@ class WebUIDataManager(DataManager):
             except AttributeError:
                 pass
 
+    @request_memoized
     def get_hostgroups(self, user=None, name=None, parent=None):
         """ Get a list of known hosts groups
 
@@ -850,6 +876,7 @@ class WebUIDataManager(DataManager):
 
         return self._only_related_to(items, user)
 
+    @request_memoized
     def get_hostgroup(self, name, user=None):
         """ Get a specific hosts group
 
@@ -884,6 +911,7 @@ class WebUIDataManager(DataManager):
             except AttributeError:
                 pass
 
+    @request_memoized
     def get_servicegroups(self, user=None, name=None, parent=None, members=False):
         """ Get a list of known services groups
 
@@ -909,6 +937,7 @@ class WebUIDataManager(DataManager):
 
         return self._only_related_to(items, user)
 
+    @request_memoized
     def get_servicegroup(self, name, user=None, parent=None, members=False):
         """ Get a specific hosts group
 
@@ -926,48 +955,52 @@ class WebUIDataManager(DataManager):
     ##
     # Hosts tags
     ##
+    @request_memoized
     def get_host_tags(self):
         ''' Get the hosts tags sorted by names. '''
         logger.debug("[WebUI - datamanager] get_host_tags")
-        items = []
-        names = self.rg.tags.keys()
-
-        names.sort()
-        for name in names:
-            items.append((name, self.rg.tags[name]))
+        items = sorted(self.elements_index.counts('host_tag').items())
 
         logger.debug("[WebUI - datamanager] got %d hosts tags", len(items))
         return items
 
+    def _tagged_with(self, field, tag, user):
+        ''' Get the elements registered under a tag in the elements index, that a user is allowed to view '''
+        index = self.elements_index
+        items = index.get(field, tag)
+        if self._visibility_key(user) is not None:
+            items = items & self._visible_elements(user)
+        return index.sort(items)
+
+    @request_memoized
     def get_hosts_tagged_with(self, tag, user):
         ''' Get the hosts tagged with a specific tag. '''
-        return self.search_hosts_and_services('type:host htag:%s' % tag, user)
+        return self._tagged_with('host_tag', tag, user)
 
     ##
     # Services tags
     ##
+    @request_memoized
     def get_service_tags(self):
         ''' Get the services tags sorted by names. '''
-        items = []
-        names = self.rg.services_tags.keys()
-
-        names.sort()
-        for name in names:
-            items.append((name, self.rg.services_tags[name]))
+        items = sorted(self.elements_index.counts('stag').items())
 
         logger.debug("[WebUI - datamanager] got %d services tags", len(items))
         return items
 
+    @request_memoized
     def get_services_tagged_with(self, tag, user):
         ''' Get the services tagged with a specific tag. '''
-        return self.search_hosts_and_services('type:service stag:%s' % tag, user)
+        return self._tagged_with('stag', tag, user)
 
     ##
     # Realms
     ##
+    @request_memoized
     def get_realms(self, user=None, name=None, parent=None):
         return self._only_related_to(self.rg.realms, user)
 
+    @request_memoized
     def get_realm(self, name, user=None):
         try:
             name = name.decode('utf8', 'ignore')
@@ -1041,12 +1074,14 @@ class WebUIDataManager(DataManager):
     ##
     # Shortcuts
     ##
+    @request_memoized
     def get_overall_state(self, user):
         ''' Get the worst state of all business impacting elements. '''
         # :TODO:maethor:190103: Could be moved into dashboard
         impacts = self.search_hosts_and_services('isnot:ACK isnot:DOWNTIME is:impact', user, sorter=worse_first)
         return impacts[0].state_id if impacts else 0
 
+    @request_memoized
     def get_overall_it_state(self, user):
         ''' Get the worst state of IT problems. '''
         # :TODO:maethor:190103: Could be moved into dashboard
@@ -1056,6 +1091,7 @@ class WebUIDataManager(DataManager):
         services_state = services[0].state_id if services else 0
         return hosts_state, services_state
 
+    @request_memoized
     def guess_root_problems(self, user, obj):
         ''' Returns the root problems for a service. '''
         if obj.__class__.my_type != 'service':
@@ -1066,6 +1102,7 @@ class WebUIDataManager(DataManager):
         return r
 
     # Return a tree of {'elt': Host, 'fathers': [{}, {}]}
+    @request_memoized
     def get_business_parents(self, user, obj, levels=3):
         res = {'node': obj, 'fathers': []}
         # if levels == 0:
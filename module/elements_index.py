@@ -0,0 +1,335 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Inverted indexes of the hosts and services regenerated by the WebUI.
+
+Each host and service is registered under a list of (field, value) keys, for
+instance ('hostgroup', 'linux') or ('state', 'DOWN'). The datamanager answers
+the key:value search terms with some lookups and set intersections instead of
+scanning all the known elements.
+
+The ('contact', name) keys register the elements a contact is allowed to view,
+so the users ACL filtering is also a set intersection.
+
+The index also counts the elements per synthesis class (state, acknowledged,
+problem, business impact...), for all the elements and per contact, so the
+hosts and services synthesis do not walk the elements.
+
+The index may publish immutable views, so the pages may be rendered from a
+consistent version of the indexes while the broks are updating the index.
+"""
+
+from collections import namedtuple
+
+# Boolean element properties that are indexed under (flag, True) keys
+INDEXED_FLAGS = [
+    ('ack', 'problem_has_been_acknowledged'),
+    ('downtime', 'in_scheduled_downtime'),
+    ('flapping', 'is_flapping'),
+    ('impact', 'is_impact'),
+]
+
+EMPTY = frozenset()
+
+# Element properties counted by the hosts and services synthesis
+SynthesisClass = namedtuple('SynthesisClass', 'state hard ack downtime problem impact bi')
+
+
+def _name(item):
+    """Return the name of a linked object, or the item itself if it is still a simple name"""
+    get_name = getattr(item, 'get_name', None)
+    if get_name is not None and callable(get_name):
+        return get_name()
+    return item
+
+
+def _contacts(item):
+    """Names of the contacts of a linked object, ignoring the contacts that are still simple names"""
+    return [c.contact_name for c in getattr(item, 'contacts', None) or [] if hasattr(c, 'contact_name')]
+
+
+class ElementsView(object):
+    """Searchable hosts and services indexes
+
+    The returned sets are the inner sets: callers must never update them.
+    """
+
+    def __init__(self, fields=None, members=EMPTY, order=None, synthesis=None, version=None):
+        # field -> value -> set of elements
+        self.fields = fields if fields is not None else {}
+        # all the elements
+        self.members = members
+        # element -> sort key: hosts first, then services, in the order they were indexed
+        self.order = order if order is not None else {}
+        # contact name (None for all the elements) -> type -> synthesis class -> count
+        self.synthesis = synthesis if synthesis is not None else {}
+        # Regenerator data version of a published view
+        self.version = version
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, element):
+        return element in self.members
+
+    def all(self):
+        """All the indexed elements, as a set-like object"""
+        return self.members
+
+    def get(self, field, value):
+        """Elements registered under the (field, value) key"""
+        return self.fields.get(field, {}).get(value, EMPTY)
+
+    def get_synthesis(self, my_type, contact=None):
+        """Count of the elements of a type per synthesis class, for all the elements or the
+        elements a contact is allowed to view"""
+        return self.synthesis.get(contact, {}).get(my_type, {})
+
+    def values(self, field):
+        """Known values for a field"""
+        return self.fields.get(field, {}).keys()
+
+    def counts(self, field):
+        """Number of elements registered under each value of a field"""
+        return dict((value, len(elements)) for value, elements in self.fields.get(field, {}).items())
+
+    def select(self, field, predicate):
+        """Elements registered under a value of the field for which predicate(value) is True"""
+        result = set()
+        for value, elements in self.fields.get(field, {}).items():
+            if predicate(value):
+                result.update(elements)
+        return result
+
+    def find(self, field, pattern):
+        """Elements registered under a value of the field matching a compiled regular expression"""
+        return self.select(field, lambda value: value is not None and pattern.search(value))
+
+    def sort(self, elements):
+        """Return a list of the elements, hosts first, in the order they were indexed"""
+        return sorted(elements, key=self.order.get)
+
+
+class ElementsIndex(ElementsView):
+    """Inverted indexes of the hosts and services, updated when the elements change
+
+    The index may publish immutable views of itself, for the readers that must not
+    wait for the index updates. A new view shares the sets that did not change since
+    the previous view, only the changed sets are copied.
+    """
+
+    def __init__(self):
+        super(ElementsIndex, self).__init__()
+        self.sequence = 0
+        self.clear()
+
+    def clear(self):
+        self.fields = {}
+        # element -> tuple of the keys the element is currently registered under
+        self.keys = {}
+        self.members = self.keys.viewkeys()
+        self.order = {}
+        # element -> synthesis class the element is currently counted in
+        self.classes = {}
+        self.synthesis = {}
+        # Changes since the last published view: (field, value) keys and synthesis scopes,
+        # and whether elements were added or removed. The next view is a full copy.
+        self.changed_keys = set()
+        self.changed_scopes = set()
+        self.changed_members = True
+        self.changed_all = True
+
+    @staticmethod
+    def get_keys(element):
+        """Build the list of the (field, value) keys an element must be registered under"""
+        my_type = element.__class__.my_type
+        keys = [('type', my_type), ('host', element.host_name)]
+
+        if my_type == 'host':
+            host = element
+            # The host only, the 'htag' keys also register the services of the host
+            for tag in getattr(element, 'tags', None) or []:
+                keys.append(('host_tag', tag))
+        else:
+            host = getattr(element, 'host', None)
+            keys.append(('service', element.service_description))
+            for group in getattr(element, 'servicegroups', None) or []:
+                keys.append(('servicegroup', _name(group)))
+            for tag in getattr(element, 'tags', None) or []:
+                keys.append(('stag', tag))
+
+        if host is not None:
+            for group in getattr(host, 'hostgroups', None) or []:
+                keys.append(('hostgroup', _name(group)))
+            for tag in getattr(host, 'tags', None) or []:
+                keys.append(('htag', tag))
+            realm = getattr(host, 'realm_name', None) or getattr(host, 'realm', None)
+            if realm:
+                keys.append(('realm', _name(realm)))
+
+        keys.append(('state', element.state))
+        keys.append(('state_id', element.state_id))
+        keys.append(('state_type', element.state_type))
+        keys.append(('bi', element.business_impact))
+
+        for flag, prop in INDEXED_FLAGS:
+            if getattr(element, prop, False):
+                keys.append((flag, True))
+
+        # The contacts that are allowed to view the element: its own contacts, the contacts
+        # of its host, and the contacts of its source problems and impacts
+        contacts = set(_contacts(element))
+        if host is not None and host is not element:
+            contacts.update(_contacts(host))
+        for item in (getattr(element, 'source_problems', None) or []) + (getattr(element, 'impacts', None) or []):
+            contacts.update(_contacts(item))
+        for contact in sorted(contacts):
+            keys.append(('contact', contact))
+
+        return tuple(keys)
+
+    @staticmethod
+    def get_synthesis_class(element):
+        """Build the synthesis class an element is counted in"""
+        return SynthesisClass(element.state, element.state_type.upper() == 'HARD',
+                              bool(element.problem_has_been_acknowledged),
+                              bool(element.in_scheduled_downtime), bool(element.is_problem),
+                              bool(element.is_impact), element.business_impact)
+
+    def _count(self, element, keys, synthesis_class, delta):
+        """Update the synthesis counters of all the elements and of the element contacts"""
+        my_type = element.__class__.my_type
+        scopes = [None] + [value for field, value in keys if field == 'contact']
+        self.changed_scopes.update(scopes)
+        for scope in scopes:
+            counts = self.synthesis.setdefault(scope, {}).setdefault(my_type, {})
+            count = counts.get(synthesis_class, 0) + delta
+            if count:
+                counts[synthesis_class] = count
+            else:
+                del counts[synthesis_class]
+
+    def update(self, element):
+        """Index a new element, or update the keys of an already indexed one
+
+        :returns: True if the element keys changed
+        """
+        new_keys = self.get_keys(element)
+        old_keys = self.keys.get(element, ())
+
+        # The synthesis class does not only depend on the keys
+        new_class = self.get_synthesis_class(element)
+        old_class = self.classes.get(element)
+        if new_class != old_class or new_keys != old_keys:
+            if old_class is not None:
+                self._count(element, old_keys, old_class, -1)
+            self._count(element, new_keys, new_class, 1)
+            self.classes[element] = new_class
+
+        if new_keys == old_keys:
+            return False
+
+        if element not in self.order:
+            self.sequence += 1
+            self.order[element] = (element.__class__.my_type != 'host', self.sequence)
+            self.changed_members = True
+
+        old_keys = set(old_keys)
+        for key in old_keys.difference(new_keys):
+            self._discard(key, element)
+        for key in set(new_keys).difference(old_keys):
+            self.fields.setdefault(key[0], {}).setdefault(key[1], set()).add(element)
+            self.changed_keys.add(key)
+
+        self.keys[element] = new_keys
+        return True
+
+    def remove(self, element):
+        """Remove an element from all the indexes"""
+        keys = self.keys.pop(element, None)
+        if self.order.pop(element, None) is not None:
+            self.changed_members = True
+        for key in keys or ():
+            self._discard(key, element)
+        synthesis_class = self.classes.pop(element, None)
+        if synthesis_class is not None:
+            self._count(element, keys, synthesis_class, -1)
+
+    def _discard(self, key, element):
+        values = self.fields.get(key[0], {})
+        elements = values.get(key[1])
+        if elements is None:
+            return
+        elements.discard(element)
+        self.changed_keys.add(key)
+        if not elements:
+            del values[key[1]]
+
+    def rebuild(self, elements):
+        """Drop the current indexes and index all the provided elements"""
+        self.clear()
+        for element in elements:
+            self.update(element)
+
+    def publish(self, previous=None, version=None):
+        """Build an immutable view of the index, sharing the unchanged sets with the previous view"""
+        if previous is None or self.changed_all:
+            fields = dict((field, dict((value, frozenset(elements)) for value, elements in values.items()))
+                          for field, values in self.fields.items())
+            scopes = self.synthesis.keys()
+            synthesis = {}
+        else:
+            fields = dict(previous.fields)
+            copied = set()
+            for field, value in self.changed_keys:
+                if field not in copied:
+                    fields[field] = dict(fields.get(field, {}))
+                    copied.add(field)
+                elements = self.fields.get(field, {}).get(value)
+                if elements:
+                    fields[field][value] = frozenset(elements)
+                else:
+                    fields[field].pop(value, None)
+            scopes = self.changed_scopes
+            synthesis = dict(previous.synthesis)
+
+        for scope in scopes:
+            synthesis[scope] = dict((my_type, dict(counts))
+                                    for my_type, counts in self.synthesis.get(scope, {}).items())
+
+        if previous is None or self.changed_members or self.changed_all:
+            members = frozenset(self.keys)
+            order = dict(self.order)
+        else:
+            members = previous.members
+            order = previous.order
+
+        self.changed_keys = set()
+        self.changed_scopes = set()
+        self.changed_members = False
+        self.changed_all = False
+        return ElementsView(fields, members, order, synthesis, version)
+
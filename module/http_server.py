@@ -0,0 +1,242 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Threaded WSGI server
+
+The 'threaded' http_backend: a wsgiref based server handling the connections
+with a fixed pool of threads, so a slow page does not stall the other users.
+
+The accepted connections wait in a bounded queue for a free thread. When the
+queue is full, the new connections get a 503 response. The reads and writes of
+a request wait for the client up to a timeout, so a silent client does not hold
+a thread forever. The connections are kept alive between the requests, up to
+an idle timeout, when the response length is known and the request has no body.
+"""
+
+import socket
+import Queue
+import threading
+from wsgiref import simple_server
+
+import bottle
+
+SERVICE_UNAVAILABLE = ('HTTP/1.0 503 Service Unavailable\r\n'
+                       'Content-Type: text/plain\r\n'
+                       'Content-Length: 26\r\n'
+                       'Connection: close\r\n\r\n'
+                       'The server is overloaded.\n')
+
+
+class ServerHandler(simple_server.ServerHandler):
+    """ Response of a request, keeping the connection alive if the response length is known """
+
+    def __init__(self, stdin, stdout, stderr, environ, keep_alive=False):
+        simple_server.ServerHandler.__init__(self, stdin, stdout, stderr, environ)
+        self.keep_alive = keep_alive
+        if keep_alive:
+            self.http_version = '1.1'
+
+    def cleanup_headers(self):
+        simple_server.ServerHandler.cleanup_headers(self)
+        if 'Content-Length' not in self.headers:
+            self.keep_alive = False
+        if not self.keep_alive:
+            self.headers['Connection'] = 'close'
+
+
+class RequestHandler(simple_server.WSGIRequestHandler):
+    """ Requests of a connection, handled while the connection is kept alive """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        self.timeout = self.server.request_timeout or None
+        simple_server.WSGIRequestHandler.setup(self)
+
+    def address_string(self):
+        # No reverse DNS lookups
+        return self.client_address[0]
+
+    def log_request(self, *args, **kw):
+        if not self.server.quiet:
+            simple_server.WSGIRequestHandler.log_request(self, *args, **kw)
+
+    def handle(self):
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection:
+            self.handle_one_request(self.server.keepalive_timeout)
+
+    def handle_one_request(self, idle_timeout=None):
+        """ Handle a request. The request line is waited for up to idle_timeout if it is set, else
+        up to the request timeout. The rest of the request is handled within the request timeout """
+        try:
+            if idle_timeout is not None:
+                self.connection.settimeout(idle_timeout)
+            self.raw_requestline = self.rfile.readline(65537)
+            if idle_timeout is not None:
+                self.connection.settimeout(self.timeout)
+        except socket.timeout:
+            self.close_connection = 1
+            return
+        if not self.raw_requestline:
+            self.close_connection = 1
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = 1
+            return
+        if not self.parse_request():
+            return
+
+        # The request body may not be read by the application, the next request could not be parsed
+        if (not self.server.keepalive_timeout or 'Transfer-Encoding' in self.headers or
+                self.headers.get('Content-Length', '0').strip() not in ('', '0')):
+            self.close_connection = 1
+
+        handler = ServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+                                keep_alive=not self.close_connection)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+        if not handler.keep_alive:
+            self.close_connection = 1
+
+
+class ThreadPoolWSGIServer(simple_server.WSGIServer):
+    """ WSGI server handling the accepted connections with a pool of threads
+
+    :param workers: number of threads handling the connections
+    :param backlog: listen backlog, connections not yet accepted
+    :param queue_size: maximum number of accepted connections waiting for a thread, 0 for no limit
+    :param keepalive_timeout: seconds an idle connection is kept alive, 0 to close the connections
+    after each request. An idle connection holds its thread until the timeout
+    :param request_timeout: seconds a thread waits for the client while reading a request or writing
+    its response, 0 for no limit. A new connection that sends nothing holds its thread until the timeout
+    :param listener: an already listening socket, instead of binding the server address
+    """
+
+    def __init__(self, server_address, workers=10, backlog=128, queue_size=100, keepalive_timeout=0,
+                 request_timeout=30, listener=None, quiet=False):
+        # The TCPServer listen backlog
+        self.request_queue_size = backlog
+        if ':' in server_address[0]:
+            self.address_family = socket.AF_INET6
+        simple_server.WSGIServer.__init__(self, server_address, RequestHandler,
+                                          bind_and_activate=listener is None)
+        if listener is not None:
+            self.socket.close()
+            self.socket = listener
+            host, port = listener.getsockname()[:2]
+            self.server_name = socket.getfqdn(host)
+            self.server_port = port
+            self.setup_environ()
+
+        self.quiet = quiet
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.connections = Queue.Queue(max(0, queue_size))
+        self.lock = threading.Lock()
+        self.active = 0
+        self.handled = 0
+        self.rejected = 0
+
+        self.threads = []
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self.work, name='http-worker-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def process_request(self, request, client_address):
+        """ Queue an accepted connection for the workers, reject it if the queue is full """
+        try:
+            self.connections.put_nowait((request, client_address))
+        except Queue.Full:
+            with self.lock:
+                self.rejected += 1
+            try:
+                request.sendall(SERVICE_UNAVAILABLE)
+            except socket.error:
+                pass
+            self.shutdown_request(request)
+
+    def work(self):
+        while True:
+            request, client_address = self.connections.get()
+            if request is None:
+                break
+            with self.lock:
+                self.active += 1
+            try:
+                self.finish_request(request, client_address)
+            except socket.error:
+                # Timeout or connection closed by the client
+                pass
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self.lock:
+                    self.active -= 1
+                    self.handled += 1
+
+    def server_close(self):
+        simple_server.WSGIServer.server_close(self)
+        for _ in self.threads:
+            self.connections.put((None, None))
+
+    def get_stats(self):
+        return {
+            'workers': len(self.threads),
+            'active': self.active,
+            'queued': self.connections.qsize(),
+            'queue_size': self.connections.maxsize,
+            'handled': self.handled,
+            'rejected': self.rejected
+        }
+
+
+class ThreadedServer(bottle.ServerAdapter):
+    """ Bottle server adapter of the ThreadPoolWSGIServer. The options are the ThreadPoolWSGIServer
+    parameters """
+
+    def __init__(self, host='127.0.0.1', port=8080, **options):
+        super(ThreadedServer, self).__init__(host, port, **options)
+        self.server = None
+
+    def run(self, handler):
+        self.server = ThreadPoolWSGIServer((self.host, self.port), quiet=self.quiet, **self.options)
+        self.server.set_app(handler)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def get_stats(self):
+        """ The server statistics, None if it is not yet started """
+        return self.server.get_stats() if self.server is not None else None
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Internal metrics of the WebUI
+"""
+
+import time
+import bisect
+import threading
+
+# Default histogram buckets upper bounds, in seconds
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+class Histogram(object):
+    """ A cumulative histogram of observed values, like durations """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # One more counter for the values greater than the last bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def get_stats(self):
+        """ The histogram as a dictionary, the buckets counters are cumulative """
+        with self.lock:
+            buckets = []
+            total = 0
+            for upper, count in zip(self.buckets, self.counts):
+                total += count
+                buckets.append((upper, total))
+            buckets.append(('+Inf', self.count))
+            return {
+                'count': self.count,
+                'sum': self.sum,
+                'max': self.max,
+                'buckets': buckets
+            }
+
+
+# Broks lag histogram buckets upper bounds, in seconds
+LAG_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+class BroksMetrics(object):
+    """ Broks ingestion metrics: managed broks per type, management durations and lag
+
+    The lag is the time between the creation of a brok and the end of its management.
+    """
+
+    def __init__(self):
+        self.types = {}
+        self.lag = Histogram(LAG_BUCKETS)
+        self.last_lag = None
+        self.last_managed = None
+        self.lock = threading.Lock()
+
+    def observe(self, brok_type, duration, created=None):
+        histogram = self.types.get(brok_type)
+        if histogram is None:
+            with self.lock:
+                histogram = self.types.setdefault(brok_type, Histogram())
+        histogram.observe(duration)
+
+        self.last_managed = time.time()
+        if created:
+            self.last_lag = max(0.0, self.last_managed - created)
+            self.lag.observe(self.last_lag)
+
+    def get_stats(self):
+        with self.lock:
+            types = dict(self.types)
+        return {
+            'types': dict((brok_type, histogram.get_stats()) for brok_type, histogram in types.items()),
+            'lag': self.lag.get_stats(),
+            'last_lag': self.last_lag,
+            'last_managed': self.last_managed
+        }
+
+
+class RoutesMetrics(object):
+    """ Data lock use per page route: lock acquisitions, time waiting for the lock and time holding it """
+
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def observe(self, route, wait, held):
+        histograms = self.routes.get(route)
+        if histograms is None:
+            with self.lock:
+                histograms = self.routes.setdefault(route, (Histogram(), Histogram()))
+        histograms[0].observe(wait)
+        histograms[1].observe(held)
+
+    def get_stats(self):
+        with self.lock:
+            routes = dict(self.routes)
+        return dict((route, {'wait': wait.get_stats(), 'held': held.get_stats()})
+                    for route, (wait, held) in routes.items())
+
+
+def prometheus_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in sorted(labels.items()))
+
+
+def prometheus_histogram(name, stats, labels=None):
+    """ The Prometheus text samples of a histogram statistics """
+    labels = labels or {}
+    lines = []
+    for upper, count in stats['buckets']:
+        bucket_labels = dict(labels, le=upper)
+        lines.append('%s_bucket%s %s' % (name, prometheus_labels(bucket_labels), count))
+    lines.append('%s_sum%s %s' % (name, prometheus_labels(labels), repr(float(stats['sum']))))
+    lines.append('%s_count%s %s' % (name, prometheus_labels(labels), stats['count']))
+    return lines
+
+
+def prometheus_text(families):
+    """ Format metrics families in the Prometheus text exposition format
+
+    :param families: list of (name, type, help, lines) where lines are the metric samples
+    """
+    output = []
+    for name, metric_type, description, lines in families:
+        output.append('# HELP %s %s' % (name, description))
+        output.append('# TYPE %s %s' % (name, metric_type))
+        output.extend(lines)
+    return '\n'.join(output) + '\n'
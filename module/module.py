@@ -83,6 +83,14 @@ import bottle
 
 # Local import
 from datamanager import WebUIDataManager
+from regenerator import get_managed_brok_types, is_structural_brok
+from compact import DEFAULT_INTERNED_ATTRIBUTES
+from rwlock import ReadWriteLock
+from metrics import BroksMetrics, RoutesMetrics
+from brok_decoder import BroksDecoder
+from brok_stream import BrokRecorder
+from replicas import Replicas, ListenerServer, listen, fork_process
+from http_server import ThreadedServer
 from ui_user import User
 from helper import helper
 
@@ -294,6 +302,16 @@ class Webui_broker(BaseModule, Daemon):
 
         # Advanced options
         self.http_backend = getattr(modconf, 'http_backend', 'auto')
+        # The threaded backend: number of threads, listen backlog, idle keep-alive connections
+        # timeout in seconds (an idle connection holds its thread, disabled by default), time
+        # in seconds a thread waits for the client while handling a request, and maximum number
+        # of connections waiting for a thread
+        self.http_threads = int(getattr(modconf, 'http_threads', '10'))
+        self.http_backlog = int(getattr(modconf, 'http_backlog', '128'))
+        self.http_keepalive_timeout = float(getattr(modconf, 'http_keepalive_timeout', '0'))
+        self.http_request_timeout = float(getattr(modconf, 'http_request_timeout', '30'))
+        self.http_queue_size = int(getattr(modconf, 'http_queue_size', '100'))
+        self.http_server = None
         self.remote_user_enable = getattr(modconf, 'remote_user_enable', '0')
         self.remote_user_variable = getattr(modconf, 'remote_user_variable', 'X_REMOTE_USER')
         self.serveropts = {}
@@ -362,6 +380,63 @@ class Webui_broker(BaseModule, Daemon):
         # Inner computation rules for the problems
         self.disable_inner_problems_computation = int(getattr(modconf, 'disable_inner_problems_computation', '0'))
 
+        # Broks management: manage all the broks of a received message with the writer lock held,
+        # but release the lock after a time slice (in seconds, 0 for no limit) to serve the pages
+        self.broks_batch = to_bool(getattr(modconf, 'broks_batch', '1'))
+        self.broks_batch_time_slice = float(getattr(modconf, 'broks_batch_time_slice', '0.5'))
+        # Render the pages from published index views, only the broks adding or removing objects
+        # are managed with the writer lock held. The searches results and counters of a page come
+        # from the same view, but the hosts and services are not copied: their attributes are
+        # live, they may be more recent than the view or change while the page is rendered
+        self.published_views = to_bool(getattr(modconf, 'published_views', '0'))
+        # Forked HTTP worker processes serving the pages from their own replica of the
+        # objects, 0 to serve the pages from the process managing the broks
+        self.http_workers = int(getattr(modconf, 'http_workers', '0'))
+        # Maximum number of broks messages waiting for a worker, a later worker is forked again
+        self.http_workers_queue_size = int(getattr(modconf, 'http_workers_queue_size', '1000'))
+        self.replicas = None
+        self.listener = None
+        # Merge the check results of a same element received in a message
+        self.broks_coalesce = to_bool(getattr(modconf, 'broks_coalesce', '1'))
+        # Threads decoding the received broks without the lock, and maximum number of
+        # messages decoded or being decoded, waiting for the data thread
+        self.broks_decoders = int(getattr(modconf, 'broks_decoders', '1'))
+        self.broks_queue_size = int(getattr(modconf, 'broks_queue_size', '16'))
+        # Record the received broks in this file, up to a maximum size in MB (0 for no limit)
+        self.broks_record_file = getattr(modconf, 'broks_record_file', '')
+        self.broks_record_max_size = int(getattr(modconf, 'broks_record_max_size', '1024'))
+
+        # Snapshot of the regenerated objects, saved every period (in seconds) and loaded on start,
+        # disabled unless a file is configured
+        self.snapshot_file = getattr(modconf, 'snapshot_file', '')
+        self.snapshot_period = int(getattr(modconf, 'snapshot_period', '300'))
+        self.snapshot_last = time.time()
+        # Thread waiting for the process writing the last snapshot
+        self.snapshot_writer = None
+
+        # Number of compiled search strings kept in cache
+        self.search_plans_cache_size = int(getattr(modconf, 'search_plans_cache_size', '256'))
+        # Number of search results kept in cache until the next managed brok
+        self.search_results_cache_size = int(getattr(modconf, 'search_results_cache_size', '128'))
+        # Keep the datamanager getters results until the end of each request
+        self.request_memo = to_bool(getattr(modconf, 'request_memo', '1'))
+
+        # Compact hosts and services: only keep the live state and the attributes used by the UI,
+        # plus the attributes listed in compact_kept_attributes (comma separated). Disabled by
+        # default, the custom views may use any attribute
+        self.compact_elements = to_bool(getattr(modconf, 'compact_elements', '0'))
+        self.compact_kept_attributes = [attr.strip() for attr in
+                                        getattr(modconf, 'compact_kept_attributes', '').split(',')
+                                        if attr.strip()]
+
+        # Share the values of these attributes amongst all the elements (comma separated), and
+        # the identical plugins outputs amongst the last shared_outputs_size different outputs
+        self.interned_attributes = [attr.strip() for attr in
+                                    getattr(modconf, 'interned_attributes',
+                                            ','.join(DEFAULT_INTERNED_ATTRIBUTES)).split(',')
+                                    if attr.strip()]
+        self.shared_outputs_size = int(getattr(modconf, 'shared_outputs_size', '10000'))
+
         # Used in the dashboard view to select background color for percentages
         self.hosts_states_warning = int(getattr(modconf, 'hosts_states_warning', '95'))
         self.hosts_states_critical = int(getattr(modconf, 'hosts_states_critical', '90'))
@@ -379,6 +454,9 @@ class Webui_broker(BaseModule, Daemon):
         # We need our regenerator now (before main) so if we are in a scheduler,
         # rg will be able to skip some broks
         self.rg = Regenerator()
+        self.rg.set_compact_elements(self.compact_elements, self.compact_kept_attributes)
+        self.rg.set_shared_values(self.interned_attributes, self.shared_outputs_size)
+        self.rg.set_problems_computation(not self.disable_inner_problems_computation)
 
         # My bottle object ...
         self.bottle = bottle
@@ -395,9 +473,85 @@ class Webui_broker(BaseModule, Daemon):
             logger.warning("Running the Web UI for the Shinken framework.")
 
         self.rg.load_external_queue(self.from_q)
+
+        # Serve the last known state until the schedulers send their configuration
+        if self.snapshot_file and self.snapshot_period and os.path.exists(self.snapshot_file):
+            try:
+                self.rg.load_snapshot(self.snapshot_file)
+            except Exception as exp:
+                logger.warning("[WebUI] Unable to load the snapshot %s: %s", self.snapshot_file, str(exp))
+        if self.published_views:
+            self.rg.publish_view()
+
         # Return True to confirm correct initialization
         return True
 
+    # Shinken broker module only
+    # -----------------------------------------------------
+    # Save a snapshot of the regenerated objects when the period is over. Called from the
+    # brok thread: the objects are copied by forking a process that writes the snapshot,
+    # under the writer lock so that no page is reading or updating them meanwhile. The
+    # brok thread and the pages go on while the snapshot is written
+    def save_snapshot(self):
+        if not self.snapshot_file or not self.snapshot_period:
+            return
+        if time.time() - self.snapshot_last < self.snapshot_period:
+            return
+        # Do not save an empty or partially received configuration
+        if not self.rg.configs or self.rg.inp_hosts:
+            return
+        # The previous snapshot is still being written
+        if self.snapshot_writer is not None and self.snapshot_writer.is_alive():
+            return
+
+        self.snapshot_last = time.time()
+        counts = (len(self.rg.hosts), len(self.rg.services))
+        errors_r, errors_w = os.pipe()
+        self.wait_for_no_readers()
+        try:
+            pid = fork_process()
+            if not pid:
+                # The child process only writes the file, the locks of the other threads
+                # may have been copied in their held state. The error goes through the pipe
+                os.close(errors_r)
+                status = 0
+                try:
+                    self.rg.dump_snapshot(self.snapshot_file)
+                except BaseException as exp:
+                    os.write(errors_w, '%s: %s' % (type(exp).__name__, exp))
+                    status = 1
+                os._exit(status)
+        except OSError as exp:
+            os.close(errors_r)
+            logger.warning("[WebUI] Unable to save the snapshot %s: %s", self.snapshot_file, str(exp))
+            return
+        finally:
+            os.close(errors_w)
+            self.rwlock.release_write()
+
+        self.snapshot_writer = threading.Thread(None, self.wait_snapshot, 'snapshot-writer',
+                                                args=(pid, errors_r, counts, self.snapshot_last))
+        self.snapshot_writer.daemon = True
+        self.snapshot_writer.start()
+
+    # Wait for the process writing a snapshot and log its result
+    def wait_snapshot(self, pid, errors_r, counts, start):
+        with os.fdopen(errors_r, 'rb') as errors:
+            error = errors.read()
+        _, status = os.waitpid(pid, 0)
+        if status:
+            logger.warning("[WebUI] Unable to save the snapshot %s: %s",
+                           self.snapshot_file, error or 'exit status %d' % status)
+        else:
+            logger.info("[WebUI] Saved a snapshot of %d hosts and %d services in %s (%.2fs)",
+                        counts[0], counts[1], self.snapshot_file, time.time() - start)
+
+    # The age of the snapshot data still served, or None if all the data are live
+    def get_snapshot_age(self):
+        if not self.rg.snapshot_instances or not self.rg.snapshot_time:
+            return None
+        return time.time() - self.rg.snapshot_time
+
     # This is called only when we are in a scheduler
     # and just before we are started. So we can gain time, and
     # just load all scheduler objects without fear :) (we
@@ -505,7 +659,9 @@ class Webui_broker(BaseModule, Daemon):
         # Data manager
         self.datamgr = WebUIDataManager(self.rg, self.problems_business_impact,
                                         self.important_problems_business_impact,
-                                        self.disable_inner_problems_computation)
+                                        self.disable_inner_problems_computation,
+                                        self.search_plans_cache_size,
+                                        self.search_results_cache_size)
         self.helper = helper
 
         # Check directories
@@ -562,28 +718,125 @@ class Webui_broker(BaseModule, Daemon):
                         logger.debug("[WebUI] - %s for %s", route.name, route.rule)
 
             # We will protect the operations on
-            # the non read+write with a lock and
-            # 2 int
-            self.global_lock = threading.RLock()
-            self.nb_readers = 0
-            self.nb_writers = 0
+            # the non read+write with a readers/writer lock
+            self.rwlock = ReadWriteLock()
+
+            # Brok types managed by the Regenerator or an internal module, for the internal
+            # modules instances identified by the key
+            self.managed_brok_types_key = None
+            self.managed_brok_types = None
+            # Brok type -> number of decoded and dropped broks
+            self.broks_counters = {}
+            # Managed broks durations and lag
+            self.broks_metrics = BroksMetrics()
+            # Data lock use per page route
+            self.routes_metrics = RoutesMetrics()
 
             self.data_thread = None
             self.ls_thread = None
 
+            # Decode the received broks before the data thread manages them
+            self.decoder = BroksDecoder(self.decode_message, self.broks_decoders, self.broks_queue_size)
+
+            # The HTTP workers are forked before any thread is started. The listening socket
+            # is kept open to fork again the workers that exit
+            if self.http_workers > 0:
+                self.listener = listen(self.host, self.port, self.http_backlog)
+                self.replicas = Replicas(self.http_workers, self.http_workers_queue_size)
+                if self.replicas.fork() is not None:
+                    self.run_http_worker(self.listener)
+
+            self.recorder = None
+            if self.broks_record_file:
+                try:
+                    self.recorder = BrokRecorder(self.broks_record_file, self.broks_record_max_size * 1048576)
+                except (IOError, OSError) as exp:
+                    logger.warning("[WebUI] Unable to record the broks in %s: %s", self.broks_record_file, str(exp))
+
+            self.decoder.start()
+            self.reader_thread = threading.Thread(None, self.read_broks_thread, 'readerthread')
+            self.reader_thread.start()
+
             # Launch the data thread ...
             self.data_thread = threading.Thread(None, self.manage_brok_thread, 'datathread')
             self.data_thread.start()
             # TODO: look for alive and killing
 
+            if self.replicas:
+                logger.info("[WebUI] %d HTTP workers serving the Web UI on %s:%d",
+                            self.http_workers, self.host, self.port)
+                while not self.interrupted:
+                    self.replicas.publish_ingestion_stats(self.get_broks_stats())
+                    if self.replicas.check():
+                        # Wake the data thread up, it forks the workers again
+                        self.decoder.submit([])
+                    time.sleep(1.0)
+                self.replicas.stop()
+                self.listener.close()
+                return
+
             logger.info("[WebUI] starting Web UI server on %s:%d ...", self.host, self.port)
             bottle.TEMPLATES.clear()
-            webui_app.run(host=self.host, port=self.port, server=self.http_backend, **self.serveropts)
+            webui_app.run(host=self.host, port=self.port, server=self.get_http_server(), **self.serveropts)
         except Exception as e:
             logger.error("[WebUI] do_main exception: %s", str(e))
             logger.error("[WebUI] traceback: %s", traceback.format_exc())
             exit(1)
 
+    # Shinken broker module only
+    # -----------------------------------------------------
+    # Serve the pages in a forked HTTP worker, from the worker replica of the objects.
+    # Never returns
+    def run_http_worker(self, listener):
+        logger.info("[WebUI] HTTP worker %d started, pid=%d", self.replicas.index, os.getpid())
+
+        # A worker forked again by the data thread does not have the other threads of the
+        # WebUI process, the locks they were holding are never released: all the locks a
+        # worker may use are created again. The worker does not decode nor record broks
+        self.rwlock = ReadWriteLock()
+        self.broks_metrics = BroksMetrics()
+        self.routes_metrics = RoutesMetrics()
+        self.rg.folded_lock = threading.Lock()
+        self.datamgr.reset_locks()
+        self.decoder = BroksDecoder(self.decode_message, self.broks_decoders, self.broks_queue_size)
+        self.recorder = None
+
+        # The database connection of the WebUI process must not be used by the workers
+        self.prefs_module.reconnect()
+
+        self.data_thread = threading.Thread(None, self.manage_replica_thread, 'replicathread')
+        self.data_thread.daemon = True
+        self.data_thread.start()
+
+        try:
+            bottle.TEMPLATES.clear()
+            webui_app.run(server=self.get_http_server(listener))
+        except Exception as e:
+            logger.error("[WebUI] HTTP worker %d exception: %s", self.replicas.index, str(e))
+            logger.error("[WebUI] traceback: %s", traceback.format_exc())
+        finally:
+            os._exit(0)
+
+    # The HTTP server: the configured backend name, or a server adapter for the threaded
+    # backend and for the listening socket shared by the HTTP workers
+    def get_http_server(self, listener=None):
+        if self.http_backend == 'threaded':
+            self.http_server = ThreadedServer(self.host, self.port, workers=self.http_threads,
+                                              backlog=self.http_backlog, queue_size=self.http_queue_size,
+                                              keepalive_timeout=self.http_keepalive_timeout,
+                                              request_timeout=self.http_request_timeout,
+                                              listener=listener)
+            return self.http_server
+        if listener is not None:
+            return ListenerServer(host=self.host, port=self.port, listener=listener)
+        return self.http_backend
+
+    # The threaded HTTP server statistics, None with the other backends
+    def get_http_stats(self):
+        if self.http_server is None:
+            return None
+        return self.http_server.get_stats()
+
     # External commands
     # -----------------------------------------------------
     # pylint: disable=global-statement
@@ -610,60 +863,40 @@ class Webui_broker(BaseModule, Daemon):
     # It will say if we can launch a page rendering or not.
     # We can only if there is no writer running from now
     def wait_for_no_writers(self):
-        while not self.interrupted:
-            self.global_lock.acquire()
-            # We will be able to run
-            if self.nb_writers == 0:
-                # Ok, we can run, register us as readers
-                self.nb_readers += 1
-                self.global_lock.release()
-                break
-            # Oups, a writer is in progress. We must wait a bit
-            self.global_lock.release()
-            # Before checking again, we should wait a bit
-            # like 1ms
-            time.sleep(0.001)
+        self.rwlock.acquire_read()
 
     # Shinken broker module only
     # -----------------------------------------------------
     # It will say if we can launch a brok management or not
     # We can only if there is no readers running from now
     def wait_for_no_readers(self):
-        start = time.time()
-        while not self.interrupted:
-            self.global_lock.acquire()
-            # We will be able to run
-            if self.nb_readers == 0:
-                # Ok, we can run, register us as writers
-                self.nb_writers += 1
-                self.global_lock.release()
-                break
-            # Ok, we cannot run now, wait a bit
-            self.global_lock.release()
-            # Before checking again, we should wait a bit
-            # like 1ms
-            time.sleep(0.001)
-            # We should warn if we cannot update broks
-            # for more than 30s because it can be not good
-            if time.time() - start > 30:
-                logger.warning("[WebUI] wait_for_no_readers, we are in lock/read since more than 30s!")
-                start = time.time()
+        waited = self.rwlock.acquire_write()
+        # We should warn if we cannot update broks
+        # for more than 30s because it can be not good
+        if waited > 30:
+            logger.warning("[WebUI] wait_for_no_readers, we were in lock/read for %ds!", waited)
 
     # Shinken broker module only
     # -----------------------------------------------------
-    # We want a lock manager version of the plugin functions
-    def lockable_function(self, f):
+    # We want a lock manager version of the plugin functions. The lock use is measured
+    # per route
+    def lockable_function(self, f, route=None):
         def lock_version(**args):
+            start = time.time()
             self.wait_for_no_writers()
+            acquired = time.time()
             try:
+                if self.published_views:
+                    # The whole page is rendered from the same published view
+                    version = self.datamgr.begin_read()
+                    response.set_header('X-WebUI-Data-Version', str(version))
                 return f(**args)
             finally:
-                # We can remove us as a reader from now. It's NOT an atomic operation
-                # so we REALLY not need a lock here (yes, I try without and I got
-                # a not so accurate value there....)
-                self.global_lock.acquire()
-                self.nb_readers -= 1
-                self.global_lock.release()
+                if self.published_views:
+                    self.datamgr.end_read()
+                # We can remove us as a reader from now
+                self.rwlock.release_read()
+                self.routes_metrics.observe(route, acquired - start, time.time() - acquired)
 
         return lock_version
 
@@ -671,11 +904,10 @@ class Webui_broker(BaseModule, Daemon):
     # -----------------------------------------------------
     # It's the thread function that will get broks and update data. Will lock the whole thing
     # while updating
-    def manage_brok_thread(self):
-        logger.debug("[WebUI] manage_brok_thread start ...")
+    def read_broks_thread(self):
+        logger.debug("[WebUI] read_broks_thread start ...")
 
         while not self.interrupted:
-            start = time.clock()
             # Get messages in the queue
             try:
                 message = self.to_q.get()
@@ -688,51 +920,231 @@ class Webui_broker(BaseModule, Daemon):
                 time.sleep(1.0)
                 continue
 
-            # try to relaunch dead module
-            self.check_and_del_zombie_modules()
-
             if not message:
                 continue
 
-            logger.debug("[WebUI] manage_brok_thread got %d broks, queue length: %d",
+            logger.debug("[WebUI] read_broks_thread got %d broks, queue length: %d",
                          len(message), self.to_q.qsize())
-            for b in message:
+            if self.recorder:
+                self.recorder.record(message)
+            # Only unserialize the broks that will be managed. Wait here when
+            # too many messages are not yet managed
+            self.decoder.submit(self.filter_broks(message))
+
+        logger.debug("[WebUI] read_broks_thread end ...")
+
+    # Shinken broker module only
+    # -----------------------------------------------------
+    # Unserialize and normalize the broks of a message, called by the decoder workers
+    # without the lock
+    def decode_message(self, message):
+        decoded = []
+        for b in message:
+            # A faulty brok must not prevent the other broks of the message to be managed
+            try:
                 b.prepare()
-                self.wait_for_no_readers()
+            except Exception as exp:
+                logger.error("[WebUI] unable to decode a brok, skipped: %s", str(exp))
+                continue
+            if getattr(self.rg, 'manage_' + b.type + '_brok', None):
                 try:
-                    self.rg.manage_brok(b)
-
-                    # Question:
-                    # Do not send broks to internal modules ...
-                    # No internal WebUI modules have something to do with broks!
-                    for mod in self.modules_manager.get_internal_instances():
-                        try:
-                            mod.manage_brok(b)
-                        except Exception as exp:
-                            logger.warning("[WebUI] The mod %s raise an exception: %s, "
-                                           "I'm tagging it to restart later", mod.get_name(), str(exp))
-                            logger.debug("[WebUI] Back trace of this kill: %s", traceback.format_exc())
-                            self.modules_manager.set_to_restart(mod)
+                    self.rg.normalize_brok(b)
                 except Exception as exp:
-                    logger.error("[WebUI] manage_brok_thread exception: %s", str(exp))
-                    logger.error("[WebUI] Exception type: %s", type(exp))
-                    logger.error("[WebUI] Back trace of this kill: %s", traceback.format_exc())
-                    # No need to raise here, we are in a thread, exit!
-                    os._exit(2)
-                finally:
-                    # logger.debug("[WebUI] manage_brok_thread finally")
-                    # We can remove us as a writer from now. It's NOT an atomic operation
-                    # so we REALLY not need a lock here (yes, I try without and I got
-                    # a not so accurate value there....)
-                    self.global_lock.acquire()
-                    self.nb_writers -= 1
-                    self.global_lock.release()
+                    logger.warning("[WebUI] unable to normalize a '%s' brok, managed as is: %s", b.type, str(exp))
+            decoded.append(b)
+        if self.broks_coalesce:
+            decoded = self.rg.coalesce_broks(decoded)
+        return decoded
+
+    def manage_brok_thread(self):
+        logger.debug("[WebUI] manage_brok_thread start ...")
+
+        while not self.interrupted:
+            # Get the decoded messages, in the received order
+            message = self.decoder.get()
+            start = time.clock()
+
+            # Fork again the exited HTTP workers, the objects are consistent with the streamed broks
+            if self.replicas and self.replicas.respawn() is not None:
+                self.run_http_worker(self.listener)
+
+            # try to relaunch dead module
+            self.check_and_del_zombie_modules()
+
+            if not message:
+                continue
+
+            # The HTTP workers replicas manage the same broks
+            if self.replicas:
+                self.replicas.send([b for b in message if getattr(self.rg, 'manage_' + b.type + '_brok', None)])
+
+            self.manage_message(message)
 
             logger.debug("[WebUI] time to manage %d broks (time %.2gs)",
                          len(message), time.clock() - start)
 
+            self.save_snapshot()
+
         logger.debug("[WebUI] manage_brok_thread end ...")
 
+    # Shinken broker module only
+    # -----------------------------------------------------
+    # Manage the decoded broks of a message. In batch mode, all the broks of the message are managed
+    # with the writer lock held, unless the time slice is over; then the waiting readers are let in
+    # before managing the next broks. With the published views, only the broks adding or removing
+    # objects need the writer lock
+    def manage_message(self, message, modules=True):
+        index = 0
+        while index < len(message):
+            exclusive = self.is_exclusive_brok(message[index])
+            if exclusive:
+                self.wait_for_no_readers()
+            try:
+                slice_start = time.time()
+                while index < len(message):
+                    self.apply_brok(message[index], modules)
+                    index += 1
+                    if not self.broks_batch:
+                        break
+                    if self.broks_batch_time_slice and time.time() - slice_start > self.broks_batch_time_slice:
+                        break
+                    if index < len(message) and self.is_exclusive_brok(message[index]) != exclusive:
+                        break
+            finally:
+                if self.published_views:
+                    self.rg.publish_view()
+                # We can remove us as a writer from now
+                if exclusive:
+                    self.rwlock.release_write()
+
+    # Shinken broker module only
+    # -----------------------------------------------------
+    # In an HTTP worker, manage the broks streamed by the WebUI process with the worker replica
+    def manage_replica_thread(self):
+        logger.debug("[WebUI] manage_replica_thread start ...")
+
+        for sequence, sent, message in self.replicas.receive():
+            self.manage_message(message, modules=False)
+            self.replicas.applied(sequence, sent)
+
+        # The WebUI process stopped
+        logger.info("[WebUI] HTTP worker %d: the broks stream is closed, exiting", self.replicas.index)
+        os._exit(0)
+
+    # Shinken broker module only
+    # -----------------------------------------------------
+    # Does a brok need the writer lock? With the published views, the readers only use the
+    # published index views and the live hosts and services, only the broks adding or
+    # removing objects must wait for the readers. The scheduler update status removes the
+    # snapshot objects that were not linked again in time
+    def is_exclusive_brok(self, b):
+        return not self.published_views or is_structural_brok(b.type) or \
+            (b.type == 'update_program_status' and bool(self.rg.snapshot_instances))
+
+    # Shinken broker module only
+    # -----------------------------------------------------
+    # Brok types managed by the Regenerator or by an internal module, None if all the broks may be managed
+    def get_managed_brok_types(self):
+        instances = self.modules_manager.get_internal_instances()
+        key = tuple(id(inst) for inst in instances)
+        if key == self.managed_brok_types_key:
+            return self.managed_brok_types
+
+        types = get_managed_brok_types(self.rg)
+        for inst in instances:
+            # A module may declare the broks it is interested in ...
+            declared = getattr(inst, 'brok_types', None)
+            if declared is not None:
+                types.update(declared)
+                continue
+            # ... else it manages the broks it has a manage_<type>_brok function for,
+            # unless it has its own manage_brok function
+            manage_brok = getattr(getattr(type(inst), 'manage_brok', None), 'im_func', None)
+            if manage_brok is not BaseModule.manage_brok.im_func:
+                logger.info("[WebUI] module %s manages all the broks", inst.get_name())
+                types = None
+                break
+            types.update(get_managed_brok_types(inst))
+
+        logger.info("[WebUI] managed broks: %s", sorted(types) if types is not None else 'all')
+        self.managed_brok_types_key = key
+        self.managed_brok_types = types
+        return types
+
+    # Shinken broker module only
+    # -----------------------------------------------------
+    # Drop the broks nobody will manage, and count the kept and dropped broks per type
+    def filter_broks(self, message):
+        types = self.get_managed_brok_types()
+        kept = []
+        for b in message:
+            counters = self.broks_counters.setdefault(b.type, {'decoded': 0, 'dropped': 0})
+            if types is None or b.type in types:
+                counters['decoded'] += 1
+                kept.append(b)
+            else:
+                counters['dropped'] += 1
+        return kept
+
+    # Shinken broker module only
+    # -----------------------------------------------------
+    # Update the data with a brok. The writer lock must be held. The HTTP workers do not
+    # send the broks to the internal modules, the WebUI process already did
+    def apply_brok(self, b, modules=True):
+        start = time.time()
+        try:
+            self.rg.manage_brok(b)
+
+            # Question:
+            # Do not send broks to internal modules ...
+            # No internal WebUI modules have something to do with broks!
+            for mod in self.modules_manager.get_internal_instances() if modules else []:
+                try:
+                    mod.manage_brok(b)
+                except Exception as exp:
+                    logger.warning("[WebUI] The mod %s raise an exception: %s, "
+                                   "I'm tagging it to restart later", mod.get_name(), str(exp))
+                    logger.debug("[WebUI] Back trace of this kill: %s", traceback.format_exc())
+                    self.modules_manager.set_to_restart(mod)
+        except Exception as exp:
+            logger.error("[WebUI] manage_brok_thread exception: %s", str(exp))
+            logger.error("[WebUI] Exception type: %s", type(exp))
+            logger.error("[WebUI] Back trace of this kill: %s", traceback.format_exc())
+            # No need to raise here, we are in a thread, exit!
+            os._exit(2)
+
+        # Alignak broks have a creation time, else use the check time of the check results
+        created = getattr(b, 'creation_time', None)
+        if created is None and b.type.endswith('_check_result'):
+            created = b.data.get('last_chk', None)
+        self.broks_metrics.observe(b.type, time.time() - start, created)
+
+    # Shinken broker module only
+    # -----------------------------------------------------
+    # The broks ingestion state, to know if the UI is late. The HTTP workers report the
+    # ingestion of the WebUI process, published every second, and the replicas state
+    def get_broks_stats(self):
+        if self.replicas and self.replicas.index is not None:
+            stats = self.replicas.get_ingestion_stats()
+            if stats is not None:
+                stats['replicas'] = self.replicas.get_stats()
+                return stats
+
+        try:
+            queue_depth = self.to_q.qsize()
+        except NotImplementedError:
+            # Not available on some platforms
+            queue_depth = None
+        stats = self.broks_metrics.get_stats()
+        stats.update({
+            'queue_depth': queue_depth,
+            'folded': self.rg.folded_broks,
+            'counters': dict((brok_type, dict(counters)) for brok_type, counters in self.broks_counters.items()),
+            'decoder': self.decoder.get_stats(),
+            'replicas': self.replicas.get_stats() if self.replicas else None
+        })
+        return stats
+
     # Here we will load all plugins (pages) under the webui/plugins
     # directory. Each one can have a page, views and htdocs dir that we must
     # route correctly
@@ -785,7 +1197,11 @@ class Webui_broker(BaseModule, Daemon):
                     # Ok, we will just use the lock for all
                     # plugin page, but not for static objects
                     # so we set the lock at the function level.
-                    f = webui_app.route(route, callback=self.lockable_function(f),
+                    # The pages declaring they do not access the
+                    # monitoring data (data_access: none) do not wait for the lock.
+                    if entry.get('data_access', 'read') != 'none':
+                        f = self.lockable_function(f, route)
+                    f = webui_app.route(route, callback=f,
                                         method=method, name=name, search_engine=search_engine)
 
                 # If the plugin declare a static entry, register it
@@ -1120,6 +1536,28 @@ class Webui_broker(BaseModule, Daemon):
         return request.environ['USER']
 
 
+# Memoize the datamanager getters results for the duration of each request
+@webui_app.hook('before_request')
+def begin_request_memo():
+    app = bottle.BaseTemplate.defaults['app']
+    if app.request_memo:
+        app.datamgr.begin_request()
+
+
+@webui_app.hook('after_request')
+def end_request_memo():
+    app = bottle.BaseTemplate.defaults['app']
+    if not app.request_memo:
+        return
+
+    stats = app.datamgr.end_request()
+    if stats and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[WebUI] %s: %d datamanager calls, %d memoized, %.4fs saved (%s)",
+                     request.urlparts.path, sum(s['calls'] for s in stats.values()),
+                     sum(s['hits'] for s in stats.values()), sum(s['saved'] for s in stats.values()),
+                     ', '.join('%s: %d/%d' % (name, s['hits'], s['calls']) for name, s in sorted(stats.items())))
+
+
 @webui_app.hook('before_request')
 def login_required():
     # :COMMENT:maethor:150718: This hack is crazy, but I don't know how to do it properly
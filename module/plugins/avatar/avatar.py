@@ -132,6 +132,6 @@ pages = {
         'name': 'GetAvatar', 'route': '/avatar/:name'
     },
     get_svg_avatar: {
-        'name': 'GetSvgAvatar', 'route': '/avatar/svg/:name.svg'
+        'name': 'GetSvgAvatar', 'route': '/avatar/svg/:name.svg', 'data_access': 'none'
     }
 }
@@ -166,7 +166,7 @@ Show the perfdata graph
 pages = {
     proxy_graph: {
         'name': 'Graph', 'route': '/graph', 'view': 'graph',
-        'static': True
+        'static': True, 'data_access': 'none'
     },
     get_graphs_widget: {
         'name': 'wid_Graph', 'route': '/widget/graphs', 'view': 'widget_graphs',
@@ -142,7 +142,7 @@ pages = {
         'name': 'SetLogin', 'route': '/user/auth', 'method': 'POST'
     },
     user_logout: {
-        'name': 'Logout', 'route': '/user/logout'
+        'name': 'Logout', 'route': '/user/logout', 'data_access': 'none'
     },
     get_root: {
         'name': 'Root', 'route': '/'
@@ -58,7 +58,7 @@ def get_gotfirstdata():
 
 pages = {
     get_ping: {
-        'name': 'Ping', 'route': '/ping'
+        'name': 'Ping', 'route': '/ping', 'data_access': 'none'
     },
     get_gotfirstdata: {
         'name': 'FirstData', 'route': '/gotfirstdata'
@@ -24,9 +24,12 @@
 # along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
 
 import time
+import json
 
 from shinken.log import logger
 
+from metrics import prometheus_text, prometheus_histogram, prometheus_labels
+
 # Will be populated by the UI with it's own value
 app = None
 
@@ -65,6 +68,96 @@ def system_page():
     }
 
 
+def system_stats():
+    user = app.request.environ['USER']
+    _ = user.is_administrator() or app.redirect403()
+
+    app.response.content_type = 'application/json'
+    return json.dumps({
+        'search': app.datamgr.get_search_cache_stats(),
+        'lock': app.rwlock.get_stats(),
+        'routes': app.routes_metrics.get_stats(),
+        'broks': app.get_broks_stats(),
+        'http': app.get_http_stats(),
+        'memory': app.rg.memory,
+        'shared_values': app.rg.get_shared_values_stats()
+    })
+
+
+def system_metrics():
+    user = app.request.environ['USER']
+    _ = user.is_administrator() or app.redirect403()
+
+    broks = app.get_broks_stats()
+    lock = app.rwlock.get_stats()
+
+    managed = []
+    durations = []
+    for brok_type, stats in sorted(broks['types'].items()):
+        managed.append('webui_broks_managed_total%s %d'
+                       % (prometheus_labels({'type': brok_type}), stats['count']))
+        durations.extend(prometheus_histogram('webui_brok_manage_seconds', stats, {'type': brok_type}))
+    received = []
+    for brok_type, counters in sorted(broks['counters'].items()):
+        for state, count in sorted(counters.items()):
+            received.append('webui_broks_received_total%s %d'
+                            % (prometheus_labels({'type': brok_type, 'state': state}), count))
+
+    families = [
+        ('webui_broks_received_total', 'counter', 'Received broks, decoded or dropped', received),
+        ('webui_broks_managed_total', 'counter', 'Managed broks', managed),
+        ('webui_brok_manage_seconds', 'histogram', 'Broks management duration', durations),
+        ('webui_broks_folded_total', 'counter', 'Coalesced check result broks',
+         ['webui_broks_folded_total %d' % broks['folded']]),
+        ('webui_brok_lag_seconds', 'histogram', 'Time between a brok creation and its management',
+         prometheus_histogram('webui_brok_lag_seconds', broks['lag'])),
+        ('webui_brok_last_lag_seconds', 'gauge', 'Lag of the last managed brok',
+         ['webui_brok_last_lag_seconds %s' % repr(float(broks['last_lag'] or 0))]),
+        ('webui_broks_decoder_queued', 'gauge', 'Decoded messages waiting to be managed',
+         ['webui_broks_decoder_queued %d' % broks['decoder']['queued']]),
+        ('webui_broks_decoder_put_wait_seconds', 'histogram', 'Time waiting for the data thread',
+         prometheus_histogram('webui_broks_decoder_put_wait_seconds', broks['decoder']['put_wait'])),
+        ('webui_lock_wait_seconds', 'histogram', 'Time waiting for the data lock',
+         prometheus_histogram('webui_lock_wait_seconds', lock['write_wait'], {'mode': 'write'}) +
+         prometheus_histogram('webui_lock_wait_seconds', lock['read_wait'], {'mode': 'read'}))
+    ]
+    routes_wait = []
+    routes_held = []
+    for route, stats in sorted(app.routes_metrics.get_stats().items()):
+        routes_wait.extend(prometheus_histogram('webui_route_lock_wait_seconds', stats['wait'], {'route': route}))
+        routes_held.extend(prometheus_histogram('webui_route_lock_held_seconds', stats['held'], {'route': route}))
+    families.append(('webui_route_lock_wait_seconds', 'histogram', 'Time a page waited for the data lock',
+                     routes_wait))
+    families.append(('webui_route_lock_held_seconds', 'histogram', 'Time a page held the data lock',
+                     routes_held))
+    http = app.get_http_stats()
+    if http:
+        families.append(('webui_http_workers_active', 'gauge', 'HTTP threads handling a connection',
+                         ['webui_http_workers_active %d' % http['active']]))
+        families.append(('webui_http_queue_depth', 'gauge', 'Accepted connections waiting for an HTTP thread',
+                         ['webui_http_queue_depth %d' % http['queued']]))
+        families.append(('webui_http_rejected_total', 'counter', 'Connections rejected because the queue was full',
+                         ['webui_http_rejected_total %d' % http['rejected']]))
+    if broks['replicas']:
+        behind = []
+        delay = []
+        for worker in broks['replicas']['workers']:
+            labels = prometheus_labels({'worker': str(worker['index'])})
+            behind.append('webui_replica_behind_messages%s %d' % (labels, worker['behind']))
+            delay.append('webui_replica_delay_seconds%s %s' % (labels, repr(float(worker['delay'] or 0))))
+        families.append(('webui_replica_behind_messages', 'gauge',
+                         'Streamed broks messages not yet managed by an HTTP worker', behind))
+        families.append(('webui_replica_delay_seconds', 'gauge',
+                         'Time between the sending and the management of the last message by an HTTP worker',
+                         delay))
+    if broks['queue_depth'] is not None:
+        families.append(('webui_broks_queue_depth', 'gauge', 'Messages in the broker queue',
+                         ['webui_broks_queue_depth %d' % broks['queue_depth']]))
+
+    app.response.content_type = 'text/plain; version=0.0.4'
+    return prometheus_text(families)
+
+
 def system_widget():
     _ = app.request.environ['USER']
 
@@ -107,6 +200,12 @@ pages = {
         'name': 'System', 'route': '/system', 'view': 'system',
         'static': True
     },
+    system_stats: {
+        'name': 'SystemStats', 'route': '/system/stats'
+    },
+    system_metrics: {
+        'name': 'SystemMetrics', 'route': '/system/metrics'
+    },
     system_widget: {
         'name': 'wid_System', 'route': '/widget/system', 'view': 'system_widget',
         'widget': ['dashboard'],
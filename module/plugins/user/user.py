@@ -92,15 +92,15 @@ pages = {
         'static': True
     },
     save_pref: {
-        'name': 'SetPref', 'route': '/user/save_pref'
+        'name': 'SetPref', 'route': '/user/save_pref', 'data_access': 'none'
     },
     save_common_pref: {
-        'name': 'SetCommonPref', 'route': '/user/save_common_pref'
+        'name': 'SetCommonPref', 'route': '/user/save_common_pref', 'data_access': 'none'
     },
     get_pref: {
-        'name': 'GetPref', 'route': '/user/get_pref'
+        'name': 'GetPref', 'route': '/user/get_pref', 'data_access': 'none'
     },
     get_common_pref: {
-        'name': 'GetCommonPref', 'route': '/user/get_common_pref'
+        'name': 'GetCommonPref', 'route': '/user/get_common_pref', 'data_access': 'none'
     }
 }
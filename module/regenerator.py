@@ -33,9 +33,14 @@ by an Alignak broker.
 Some small modifications introduced by Alignak are managed in this class.
 """
 import os
+import re
+import sys
 import time
 import uuid
+import itertools
+import threading
 import traceback
+import cPickle
 
 # Import all objects we will need
 from shinken.objects.host import Host, Hosts
@@ -67,6 +72,53 @@ else:
 
 from shinken.log import logger
 
+from elements_index import ElementsIndex
+from compact import CompactElement, ValuesTable, INITIALIZED_FIELDS, \
+    DEFAULT_KEPT_ATTRIBUTES, DEFAULT_INTERNED_ATTRIBUTES, DEDUPLICATED_ATTRIBUTES, \
+    element_size, get_rss
+
+# Brok manager functions names
+BROK_MANAGER = re.compile(r'^manage_(\w+)_brok$')
+
+
+def get_managed_brok_types(obj):
+    """The types of the broks for which an object has a manage_<type>_brok function"""
+    return set(match.group(1) for match in [BROK_MANAGER.match(name) for name in dir(obj)] if match)
+
+
+def is_structural_brok(brok_type):
+    """Does a type of brok add or remove objects? The other broks only update the existing objects"""
+    return brok_type == 'program_status' or brok_type.startswith('initial_')
+
+
+# Regenerator attributes saved in the snapshots
+SNAPSHOT_ATTRIBUTES = ['configs', 'hosts', 'services', 'notificationways', 'contacts',
+                       'hostgroups', 'servicegroups', 'contactgroups', 'timeperiods', 'commands',
+                       'schedulers', 'pollers', 'reactionners', 'brokers', 'receivers',
+                       'realms']
+
+# Time (in seconds) after the snapshot load when the snapshot instances that were not linked
+# again are removed: their scheduler was removed, or restarted with another instance id
+SNAPSHOT_INSTANCES_TIMEOUT = 600
+
+
+# Broks that only update an element with its latest check result. Several such broks
+# for the same element can be merged into one
+COALESCED_BROKS = {
+    'host_check_result': 'host',
+    'host_next_schedule': 'host',
+    'service_check_result': 'service',
+    'service_next_schedule': 'service'
+}
+
+
+class CompactHost(CompactElement, Host):
+    pass
+
+
+class CompactService(CompactElement, Service):
+    pass
+
 
 # Class for a Regenerator. It will get broks, and "regenerate" real objects
 # from them :)
@@ -93,8 +145,51 @@ class Regenerator(object):
         self.receivers = ReceiverLinks([])
         # From now we only look for realms names
         self.realms = set()
-        self.tags = {}
-        self.services_tags = {}
+
+        # Inverted indexes of the hosts and services used by the searches
+        self.elements_index = ElementsIndex()
+        # Immutable view of the index published for the readers, when the views are published
+        self.published_view = None
+
+        # Identifiers (id and uuid) to object indexes, per object type, used to link the objects
+        self.ids = {'host': {}, 'service': {}, 'contact': {}, 'timeperiod': {}}
+        # Hosts and services partitions per scheduler instance: instance id -> type -> set of elements
+        self.partitions = {}
+        # Groups back references: host or service -> set of the groups it is a member of
+        self.groups_of = {}
+
+        # Incremented each time a brok is managed, so the data consumers
+        # know when their computed data are outdated
+        self.data_version = 0
+
+        # Number of broks merged into a previous brok by coalesce_broks, which is
+        # called by several decoding threads
+        self.folded_broks = 0
+        self.folded_lock = threading.Lock()
+
+        # Scheduler instances loaded from a snapshot and not yet linked again,
+        # the time the snapshot was taken and the time it was loaded
+        self.snapshot_instances = set()
+        self.snapshot_time = None
+        self.snapshot_loaded = None
+
+        # Compact hosts and services, only keeping the live state and the attributes used by the UI
+        self.host_class = Host
+        self.service_class = Service
+        self.kept_attributes = None
+        # Count of the brok attributes that were not kept, and their approximate size
+        self.dropped_attributes = 0
+        self.dropped_bytes = 0
+        # Memory usage, updated after linking the objects
+        self.memory = {}
+
+        # Shared values of the low cardinality attributes and of the plugins outputs
+        self.interned_attributes = frozenset(DEFAULT_INTERNED_ATTRIBUTES)
+        self.interned = ValuesTable()
+        self.outputs = None
+
+        # WebUI own problems and impacts classification of the hosts and services
+        self.inner_problems_computation = True
 
         # And in progress one
         self.inp_hosts = {}
@@ -151,6 +246,9 @@ class Regenerator(object):
         # WebUI - Manage notification ways
         self.notificationways = c.notificationways
 
+        self.rebuild_indexes()
+        self.data_version += 1
+
         # We also load the realms
         for h in self.hosts:
             # WebUI - Manage realms if declared (use realm_name, or realm or default 'All')
@@ -175,14 +273,104 @@ class Regenerator(object):
         # Not in don't want? so want! :)
         return True
 
-    def manage_brok(self, brok):
-        """ Look for a manager function for a brok, and call it """
-        manage = getattr(self, 'manage_' + brok.type + '_brok', None)
-        # WebUI - do not make a log because Shinken creates a brok per log!
-        if not manage:
-            return
+    def dump_snapshot(self, path):
+        """Write the regenerated objects in a file, without logging
+
+        The objects must not be updated meanwhile. The file is written beside and renamed,
+        so a snapshot file is always complete.
+        """
+        state = {
+            'timestamp': time.time(),
+            'data': dict((attr, getattr(self, attr)) for attr in SNAPSHOT_ATTRIBUTES),
+            # The instance id is not a pickled property of the Shinken hosts and services
+            'partitions': self.partitions
+        }
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, path)
+
+    def save_snapshot(self, path):
+        """Save the regenerated objects in a file"""
+        start = time.time()
+        self.dump_snapshot(path)
+        logger.info("Saved a snapshot of %d hosts and %d services in %s (%.2fs)",
+                    len(self.hosts), len(self.services), path, time.time() - start)
 
+    def load_snapshot(self, path):
+        """Load the regenerated objects from a snapshot file
 
+        The snapshot objects are served until the schedulers send their configuration again.
+        """
+        start = time.time()
+        with open(path, 'rb') as f:
+            state = cPickle.load(f)
+
+        for attr in SNAPSHOT_ATTRIBUTES:
+            if attr in state['data']:
+                setattr(self, attr, state['data'][attr])
+        for c_id, partition in state.get('partitions', {}).items():
+            for elt in itertools.chain(*partition.values()):
+                elt.instance_id = c_id
+
+        self.rebuild_indexes()
+
+        # Do not ignore the next initial program status of the schedulers
+        for config in self.configs.values():
+            config['_timestamp'] = 0
+        self.snapshot_instances = set(self.configs.keys())
+        self.snapshot_time = state['timestamp']
+        self.snapshot_loaded = time.time()
+        self.data_version += 1
+        logger.info("Loaded a snapshot of %d hosts and %d services from %s (%.2fs)",
+                    len(self.hosts), len(self.services), path, time.time() - start)
+
+    def coalesce_broks(self, broks):
+        """ Merge the check result broks of a same element within a list of broks
+
+        The data of a check result brok are merged into the first check result brok of the
+        same element, the latest values win. Any other managed brok is a barrier: the check
+        results received before it are never merged with the ones received after it.
+
+        The broks must have been prepared and normalized. A brok that could not be normalized
+        is not merged, and is a barrier.
+
+        :returns: the list of the broks to manage
+        """
+        result = []
+        pending = {}
+        folded = 0
+        for brok in broks:
+            kind = COALESCED_BROKS.get(brok.type) if getattr(brok, 'normalized', False) else None
+            if kind is None:
+                if getattr(self, 'manage_' + brok.type + '_brok', None):
+                    pending = {}
+                result.append(brok)
+                continue
+
+            key = (kind, brok.data.get('host_name'), brok.data.get('service_description'))
+            first = pending.get(key)
+            if first is None:
+                pending[key] = brok
+                result.append(brok)
+                continue
+
+            first.data.update(brok.data)
+            folded += 1
+
+        if folded:
+            logger.debug("Coalesced %d broks out of %d", folded, len(broks))
+            with self.folded_lock:
+                self.folded_broks += folded
+        return result
+
+    def normalize_brok(self, brok):
+        """ Prepare the data of an unserialized brok to be managed
+
+        Set both the identifiers of the brok and its data, and remove the data that must not
+        be applied. It does not use the regenerated objects, so it may be called without the
+        lock; manage_brok does it for the broks that were not normalized.
+        """
         # WebUI - Shinken uses id as a brok identifier whereas Alignak uses uuid
         # the idea is to make every regenerated object have both identifiers. It
         # will make it easier to migrate from Shinken to Alignak objects.
@@ -208,20 +396,228 @@ class Regenerator(object):
             brok.data['uuid'] = str(uuid.uuid4())
             brok.data['id'] = brok.data['uuid']
 
+        clean = getattr(self, 'clean_' + brok.type + '_brok', None)
+        if clean:
+            clean(brok)
+        brok.normalized = True
+
+    def manage_brok(self, brok):
+        """ Look for a manager function for a brok, and call it """
+        manage = getattr(self, 'manage_' + brok.type + '_brok', None)
+        # WebUI - do not make a log because Shinken creates a brok per log!
+        if not manage:
+            return
+
         logger.debug("Got a brok: %s", brok.type)
 
         try:
             # Catch all the broks management exceptions to avoid breaking the module
+            if not getattr(brok, 'normalized', False):
+                self.normalize_brok(brok)
             manage(brok)
         except Exception as exp:
             logger.error("Exception on brok management: %s", str(exp))
             logger.error("Traceback: %s", traceback.format_exc())
             logger.error("Brok '%s': %s", brok.type, brok.data)
+        finally:
+            # Even a failed brok management may have partially updated the objects
+            self.data_version += 1
+
+    def set_compact_elements(self, enabled, kept_attributes=()):
+        """Create the hosts and services as compact elements, keeping only the live state,
+        the structural attributes and the default kept attributes plus the given ones"""
+        if not enabled:
+            self.host_class = Host
+            self.service_class = Service
+            self.kept_attributes = None
+            return
+        self.host_class = CompactHost
+        self.service_class = CompactService
+        self.kept_attributes = INITIALIZED_FIELDS.union(DEFAULT_KEPT_ATTRIBUTES, kept_attributes)
+
+    def set_shared_values(self, interned_attributes, outputs_size):
+        """Share the values of the interned attributes, and the identical plugins outputs
+        amongst the last outputs_size different outputs (0 to not share the outputs)"""
+        self.interned_attributes = frozenset(interned_attributes)
+        self.outputs = ValuesTable(outputs_size) if outputs_size else None
+
+    def set_problems_computation(self, enabled):
+        """Classify the hosts and services problems and impacts when their state is updated"""
+        self.inner_problems_computation = enabled
 
-    # pylint: disable=no-self-use
     def update_element(self, element, data):
+        kept_attributes = self.kept_attributes
+        if not isinstance(element, CompactElement):
+            kept_attributes = None
+
         for prop in data:
-            setattr(element, prop, data[prop])
+            value = data[prop]
+            if kept_attributes is not None and prop not in kept_attributes:
+                self.dropped_attributes += 1
+                self.dropped_bytes += sys.getsizeof(value)
+                continue
+            if prop in self.interned_attributes:
+                value = self.interned.share(value)
+            elif self.outputs is not None and prop in DEDUPLICATED_ATTRIBUTES:
+                value = self.outputs.share(value)
+            setattr(element, prop, value)
+
+    def get_shared_values_stats(self):
+        """The shared values tables statistics, and the memory they save
+
+        The hosts and services are scanned: a value referenced by several attributes
+        is only counted once.
+        """
+        attributes = list(self.interned_attributes)
+        if self.outputs is not None:
+            attributes.extend(DEDUPLICATED_ATTRIBUTES)
+
+        references = {}
+        total = 0
+        for elt in itertools.chain(self.hosts, self.services):
+            for prop in attributes:
+                value = getattr(elt, prop, None)
+                if isinstance(value, basestring) and value:
+                    total += sys.getsizeof(value)
+                    references[id(value)] = sys.getsizeof(value)
+        stored = sum(references.values())
+
+        return {
+            'interned': self.interned.get_stats(),
+            'outputs': self.outputs.get_stats() if self.outputs is not None else None,
+            'attributes': sorted(attributes),
+            'values_bytes': stored,
+            'saved_bytes': total - stored
+        }
+
+    def update_memory_stats(self, rss_before):
+        """Measure the hosts and services records and the process memory after a linking"""
+        elements_bytes = 0
+        for elt in itertools.chain(self.hosts, self.services):
+            elements_bytes += element_size(elt)
+        self.memory = {
+            'compact': self.kept_attributes is not None,
+            'elements_bytes': elements_bytes,
+            'dropped_attributes': self.dropped_attributes,
+            'dropped_bytes': self.dropped_bytes,
+            'rss_before_linking': rss_before,
+            'rss': get_rss()
+        }
+        logger.info("Memory: %d hosts and %d services records, %d bytes, %d dropped attributes "
+                    "(%d bytes), RSS %d MB before linking and %d MB after",
+                    len(self.hosts), len(self.services), elements_bytes, self.dropped_attributes,
+                    self.dropped_bytes, rss_before / 1048576, self.memory['rss'] / 1048576)
+
+    @property
+    def tags(self):
+        """Hosts tags: tag -> number of hosts tagged with it"""
+        return self.elements_index.counts('host_tag')
+
+    @property
+    def services_tags(self):
+        """Services tags: tag -> number of services tagged with it"""
+        return self.elements_index.counts('stag')
+
+    def classify_element(self, elt):
+        """WebUI own problems classification, when the state of a host or service is updated
+
+        Shinken/Alignak does not always reflect the "problem" state from a user point of view...
+        To make the UI more consistent, the HARD problem states are flagged as problems, and the
+        HARD UNREACHABLE elements and the services of a host that is not UP are flagged as impacts.
+        The element must be indexed again afterwards.
+        """
+        if not self.inner_problems_computation:
+            return
+
+        state = elt.state.upper()
+        if elt.__class__.my_type == 'host':
+            if elt.state_type.upper() == 'HARD':
+                # An host is a problem if it is in a HARD DOWN or UNKNOWN state
+                if state in ['DOWN', 'UNKNOWN']:
+                    elt.is_problem = True
+                # An host is impacted if it is UNREACHABLE
+                if state == 'UNREACHABLE':
+                    elt.is_impact = True
+            # Its services are impacted
+            if state != 'UP':
+                for service in getattr(elt, 'services', None) or []:
+                    if not service.is_impact:
+                        self.classify_element(service)
+                        self.elements_index.update(service)
+            return
+
+        if elt.state_type.upper() != 'HARD':
+            return
+        # A service is a problem if it is in a HARD WARNING, CRITICAL or UNKNOWN state
+        if state in ['WARNING', 'CRITICAL', 'UNKNOWN']:
+            elt.is_problem = True
+        # A service is impacted if its host is not UP or if it is UNREACHABLE
+        host = getattr(elt, 'host', None)
+        if state == 'UNREACHABLE' or (host is not None and host.state.upper() != 'UP'):
+            elt.is_impact = True
+
+    def publish_view(self):
+        """Publish an immutable view of the elements index, at the current data version
+
+        The readers keep using the view they got while the next view is being prepared.
+        """
+        self.published_view = self.elements_index.publish(self.published_view, self.data_version)
+        return self.published_view
+
+    def rebuild_indexes(self):
+        """Build all the objects indexes again, after the objects were loaded at once"""
+        self.elements_index.rebuild(itertools.chain(self.hosts, self.services))
+        for ids in self.ids.values():
+            ids.clear()
+        self.partitions = {}
+        self.groups_of = {}
+        for item in itertools.chain(self.contacts, self.timeperiods):
+            self.index_ids(item)
+        for elt in itertools.chain(self.hosts, self.services):
+            self.register_element(elt)
+        self.register_members(itertools.chain(self.hostgroups, self.servicegroups))
+
+    def register_element(self, elt):
+        """Register a linked host or service in its instance partition and the ids index"""
+        self.index_ids(elt)
+        partition = self.partitions.setdefault(getattr(elt, 'instance_id', None), {})
+        partition.setdefault(elt.__class__.my_type, set()).add(elt)
+
+    def unregister_element(self, elt):
+        """Remove a host or service from all the indexes"""
+        self.elements_index.remove(elt)
+        self.unindex_ids(elt)
+        self.partitions.get(getattr(elt, 'instance_id', None), {}).get(elt.__class__.my_type, set()).discard(elt)
+        self.groups_of.pop(elt, None)
+
+    def register_members(self, groups):
+        """Register the groups back references of their members"""
+        for group in groups:
+            for member in group.members:
+                self.groups_of.setdefault(member, set()).add(group)
+
+    def index_ids(self, item):
+        """Register an object under its id and uuid"""
+        ids = self.ids[item.__class__.my_type]
+        for key in (getattr(item, 'id', None), getattr(item, 'uuid', None)):
+            if key is not None:
+                ids[key] = item
+
+    def unindex_ids(self, item):
+        """Unregister an object from its id and uuid"""
+        ids = self.ids[item.__class__.my_type]
+        for key in (getattr(item, 'id', None), getattr(item, 'uuid', None)):
+            if key is not None and ids.get(key) is item:
+                del ids[key]
+
+    @staticmethod
+    def groups_by_name(groups):
+        """Build a name and uuid to group dictionary, the first group wins as when searching in the list"""
+        result = {}
+        for group in groups:
+            result.setdefault(group.get_name(), group)
+            result.setdefault(getattr(group, 'uuid', None), group)
+        return result
 
     def _update_realm(self, data):
         """Set and return the realm the daemon is attached to
@@ -262,6 +658,7 @@ class Regenerator(object):
             return
 
         start = time.time()
+        rss_before = get_rss()
         logger.info("Linking objects together for %s, starting...", inst_id)
 
         # check if the instance is really defined, so got ALL the
@@ -287,6 +684,10 @@ class Regenerator(object):
         # because it was more logical to linkify timeperiods and contacts
         # stuff before hosts and services
 
+        # Duration of each linking phase
+        durations = []
+        phase_start = time.time()
+
         # WebUI - linkiify timeperiods
         for tp in self.timeperiods:
             new_exclude = []
@@ -299,6 +700,9 @@ class Regenerator(object):
                     logger.warning("Unknown TP %s for TP: %s", exname, tp)
             tp.exclude = new_exclude
 
+        durations.append(('timeperiods', time.time() - phase_start))
+        phase_start = time.time()
+
         # WebUI - linkify contacts groups with their contacts
         for cg in inp_contactgroups:
             logger.debug("Contacts group: %s", cg.get_name())
@@ -329,21 +733,24 @@ class Regenerator(object):
                 self.contactgroups.add_item(group)
 
         # Merge contactgroups with real ones
+        contactgroups = self.groups_by_name(self.contactgroups)
         for group in self.contactgroups:
             # Link with the other groups
             new_groups = []
             for cgname in group.contactgroup_members:
-                for cg in self.contactgroups:
-                    if cgname == cg.get_name() or cgname == cg.uuid:
-                        new_groups.append(cg)
-                        logger.debug("Found contactgroup %s", cg.get_name())
-                        break
+                cg = contactgroups.get(cgname)
+                if cg is not None:
+                    new_groups.append(cg)
+                    logger.debug("Found contactgroup %s", cg.get_name())
                 else:
                     logger.warning("No contactgroup %s for contactgroup: %s", cgname, group.get_name())
             group.contactgroup_members = new_groups
         for group in self.contactgroups:
             logger.debug("- members: %s / %s", group.members, group.contactgroup_members)
 
+        durations.append(('contactgroups', time.time() - phase_start))
+        phase_start = time.time()
+
         # Linkify hosts groups with their hosts
         for hg in inp_hostgroups:
             logger.debug("Hosts group: %s", hg.get_name())
@@ -370,26 +777,31 @@ class Regenerator(object):
                 # Copy group identifiers because they will have changed after a restart
                 hg.id = group.id
                 hg.uuid = group.uuid
+                self.register_members([hg])
             else:
                 logger.debug("- add a group")
                 self.hostgroups.add_item(group)
+                self.register_members([group])
 
         # Merge hosts groups with real ones
+        hostgroups = self.groups_by_name(self.hostgroups)
         for group in self.hostgroups:
             # Link with the other groups
             new_groups = []
             for hgname in group.hostgroup_members:
-                for hg in self.hostgroups:
-                    if hgname == hg.get_name() or hgname == hg.uuid:
-                        new_groups.append(hg)
-                        logger.debug("Found hostgroup %s", hg.get_name())
-                        break
+                hg = hostgroups.get(hgname)
+                if hg is not None:
+                    new_groups.append(hg)
+                    logger.debug("Found hostgroup %s", hg.get_name())
                 else:
                     logger.warning("No hostgroup %s for hostgroup: %s", hgname, group.get_name())
             group.hostgroup_members = new_groups
         for group in self.hostgroups:
             logger.debug("- members: %s / %s", group.members, group.hostgroup_members)
 
+        durations.append(('hostgroups', time.time() - phase_start))
+        phase_start = time.time()
+
         # Now link hosts with their hosts groups, commands and timeperiods
         for h in inp_hosts:
             if h.hostgroups:
@@ -399,11 +811,10 @@ class Regenerator(object):
                 new_groups = []
                 logger.debug("Searching hostgroup for the host %s, hostgroups: %s", h.get_name(), hgs)
                 for hgname in hgs:
-                    for group in self.hostgroups:
-                        if hgname == group.get_name() or hgname == group.uuid:
-                            new_groups.append(group)
-                            logger.debug("Found hostgroup %s", group.get_name())
-                            break
+                    group = hostgroups.get(hgname)
+                    if group is not None:
+                        new_groups.append(group)
+                        logger.debug("Found hostgroup %s", group.get_name())
                     else:
                         logger.warning("No hostgroup %s for host: %s", hgname, h.get_name())
                 h.hostgroups = new_groups
@@ -424,17 +835,16 @@ class Regenerator(object):
             self.linkify_contacts(h, 'contacts')
             logger.debug("Host %s has contacts: %s", h.get_name(), h.contacts)
 
-            # Linkify tags
-            for t in h.tags:
-                if t not in self.tags:
-                    self.tags[t] = 0
-                self.tags[t] += 1
-
             # We can really declare this host OK now
             old_h = self.hosts.find_by_name(h.get_name())
             if old_h is not None:
                 self.hosts.remove_item(old_h)
+                self.unregister_element(old_h)
             self.hosts.add_item(h)
+            self.register_element(h)
+
+        durations.append(('hosts', time.time() - phase_start))
+        phase_start = time.time()
 
         # Linkify services groups with their services
         for sg in inp_servicegroups:
@@ -462,26 +872,31 @@ class Regenerator(object):
                 # Copy group identifiers because they will have changed after a restart
                 sg.id = group.id
                 sg.uuid = group.uuid
+                self.register_members([sg])
             else:
                 logger.debug("- add a group")
                 self.servicegroups.add_item(group)
+                self.register_members([group])
 
         # Merge services groups with real ones
+        servicegroups = self.groups_by_name(self.servicegroups)
         for group in self.servicegroups:
             # Link with the other groups
             new_groups = []
             for sgname in group.servicegroup_members:
-                for sg in self.servicegroups:
-                    if sgname == sg.get_name() or sgname == sg.uuid:
-                        new_groups.append(sg)
-                        logger.debug("Found servicegroup %s", sg.get_name())
-                        break
+                sg = servicegroups.get(sgname)
+                if sg is not None:
+                    new_groups.append(sg)
+                    logger.debug("Found servicegroup %s", sg.get_name())
                 else:
                     logger.warning("No servicegroup %s for servicegroup: %s", sgname, group.get_name())
             group.servicegroup_members = new_groups
         for group in self.servicegroups:
             logger.debug("- members: %s / %s", group.members, group.servicegroup_members)
 
+        durations.append(('servicegroups', time.time() - phase_start))
+        phase_start = time.time()
+
         # Now link services with hosts, servicesgroups, commands and timeperiods
         for s in inp_services:
             if s.servicegroups:
@@ -491,11 +906,10 @@ class Regenerator(object):
                 new_groups = []
                 logger.debug("Searching servicegroup for the service %s, servicegroups: %s", s.get_full_name(), sgs)
                 for sgname in sgs:
-                    for group in self.servicegroups:
-                        if sgname == group.get_name() or sgname == group.uuid:
-                            new_groups.append(group)
-                            logger.debug("Found servicegroup %s", group.get_name())
-                            break
+                    group = servicegroups.get(sgname)
+                    if group is not None:
+                        new_groups.append(group)
+                        logger.debug("Found servicegroup %s", group.get_name())
                     else:
                         logger.warning("No servicegroup %s for service: %s", sgname, s.get_full_name())
                 s.servicegroups = new_groups
@@ -525,14 +939,16 @@ class Regenerator(object):
             self.linkify_contacts(s, 'contacts')
             logger.debug("Service %s has contacts: %s", s.get_full_name(), s.contacts)
 
-            # Linkify services tags
-            for t in s.tags:
-                if t not in self.services_tags:
-                    self.services_tags[t] = 0
-                self.services_tags[t] += 1
-
             # We can really declare this service OK now
+            old_s = self.services.find_srv_by_name_and_hostname(hname, s.service_description)
+            if old_s is not None and old_s is not s:
+                self.services.remove_item(old_s)
+                self.unregister_element(old_s)
             self.services.add_item(s, index=True)
+            self.register_element(s)
+
+        durations.append(('services', time.time() - phase_start))
+        phase_start = time.time()
 
         # Add realm of the hosts
         for h in inp_hosts:
@@ -567,6 +983,23 @@ class Regenerator(object):
             self.linkify_dict_srv_and_hosts(s, 'parent_dependencies')
             self.linkify_dict_srv_and_hosts(s, 'child_dependencies')
 
+        durations.append(('relations', time.time() - phase_start))
+        phase_start = time.time()
+
+        # Now the hosts and services are linked, they can be classified and searched for
+        for elt in itertools.chain(inp_hosts, inp_services):
+            self.classify_element(elt)
+            self.elements_index.update(elt)
+
+        durations.append(('index', time.time() - phase_start))
+
+        # The snapshot hosts and services that were not sent again do not exist anymore
+        if inst_id in self.snapshot_instances:
+            self.snapshot_instances.discard(inst_id)
+            self.clean_instance(inst_id, keep=set(itertools.chain(inp_hosts, inp_services)))
+        if self.snapshot_instances:
+            self.expire_snapshot_instances(inst_id)
+
         # clean old objects
         del self.inp_hosts[inst_id]
         del self.inp_hostgroups[inst_id]
@@ -581,7 +1014,9 @@ class Regenerator(object):
             for item in getattr(self, "%ss" % item_type):
                 logger.debug("- %s", item)
 
-        logger.info("Linking objects together, end. Duration: %s", time.time() - start)
+        logger.info("Linking objects together, end. Duration: %s (%s)", time.time() - start,
+                    ', '.join(["%s: %.3f" % (phase, duration) for phase, duration in durations]))
+        self.update_memory_stats(rss_before)
 
     def linkify_a_command(self, o, prop):
         """We look for o.prop (CommandCall) and we link the inner
@@ -635,10 +1070,11 @@ class Regenerator(object):
 
         logger.debug("Linkify a timeperiod: %s, found: %s", prop, type(t))
         logger.debug("Linkify a timeperiod: %s, found: %s", prop, t)
-        for tp in self.timeperiods:
-            if t == tp.get_name() or t == tp.uuid:
-                setattr(o, prop, tp)
-                break
+        tp = self.timeperiods.find_by_name(t)
+        if tp is None:
+            tp = self.ids['timeperiod'].get(t)
+        if tp is not None:
+            setattr(o, prop, tp)
         else:
             logger.warning("Timeperiod not linkified: %s / %s !", type(t), t)
 
@@ -666,10 +1102,9 @@ class Regenerator(object):
                 new_v.append(c)
             else:
                 # WebUI - search contact by id because we did not found by name
-                for contact in self.contacts:
-                    if cname == contact.uuid:
-                        new_v.append(contact)
-                        break
+                c = self.ids['contact'].get(cname)
+                if c is not None:
+                    new_v.append(c)
 
         setattr(o, prop, new_v)
 
@@ -685,15 +1120,11 @@ class Regenerator(object):
         if 'hosts' not in v or 'services' not in v:
             # WebUI - Alignak do not use the same structure as Shinken
             for id in v:
-                for host in self.hosts:
-                    if id == host.id:
-                        new_v.append(host)
-                        break
-                else:
-                    for service in self.services:
-                        if id == service.id:
-                            new_v.append(service)
-                            break
+                elt = self.ids['host'].get(id)
+                if elt is None:
+                    elt = self.ids['service'].get(id)
+                if elt is not None:
+                    new_v.append(elt)
         else:
             # WebUI - plain old Shinken structure
             for name in v['services']:
@@ -723,10 +1154,9 @@ class Regenerator(object):
                 new_v.append(h)
             else:
                 # WebUI - we did not found by name, let's try with an identifier
-                for host in self.hosts:
-                    if hname == host.uuid:
-                        new_v.append(host)
-                        break
+                h = self.ids['host'].get(hname)
+                if h is not None:
+                    new_v.append(h)
 
         setattr(o, prop, new_v)
 
@@ -744,10 +1174,9 @@ class Regenerator(object):
             if s:
                 new_v.append(s)
             else:
-                for service in self.services:
-                    if sdesc == service.uuid:
-                        new_v.append(service)
-                        break
+                s = self.ids['service'].get(sdesc)
+                if s is not None:
+                    new_v.append(s)
 
         setattr(o, prop, new_v)
 
@@ -840,56 +1269,60 @@ class Regenerator(object):
         data['_timestamp'] = now
         self.configs[c_id] = data
 
-        # We should clean all previously added hosts and services
-        logger.debug("Cleaning hosts/service of %s", c_id)
-        to_del_h = [h for h in self.hosts if h.instance_id == c_id]
-        to_del_srv = [s for s in self.services if s.instance_id == c_id]
-
-        if to_del_h:
-            # Clean hosts from hosts and hostgroups
-            logger.info("Cleaning %d hosts", len(to_del_h))
+        # We should clean all previously added hosts and services, unless they were
+        # loaded from a snapshot: they are still served until the new ones are linked
+        if c_id in self.snapshot_instances:
+            logger.info("Keeping the snapshot hosts/services of %s until they are linked again", c_name)
+        else:
+            self.clean_instance(c_id)
 
-            for h in to_del_h:
-                self.hosts.remove_item(h)
+    def expire_snapshot_instances(self, inst_id=None):
+        """Remove the snapshot instances that will not be linked again
 
-            # Exclude from all hostgroups members the hosts of this scheduler instance
-            for hg in self.hostgroups:
-                logger.debug("Cleaning hostgroup %s: %d members", hg.get_name(), len(hg.members))
-                try:
-                    # hg.members = [h for h in hg.members if h.instance_id != c_id]
-                    hg.members = []
-                    for h in hg.members:
-                        if h.instance_id != c_id:
-                            hg.members.append(h)
-                        else:
-                            logger.debug("- removing host: %s", h)
-                except Exception as exp:
-                    logger.error("Exception when cleaning hostgroup: %s", str(exp))
-
-                logger.debug("hostgroup members count after cleaning: %d members", len(hg.members))
-
-        if to_del_srv:
-            # Clean services from services and servicegroups
-            logger.debug("Cleaning %d services", len(to_del_srv))
-
-            for s in to_del_srv:
-                self.services.remove_item(s)
-
-            # Exclude from all servicegroups members the services of this scheduler instance
-            for sg in self.servicegroups:
-                logger.debug("Cleaning servicegroup %s: %d members", sg.get_name(), len(sg.members))
-                try:
-                    # sg.members = [s for s in sg.members if s.instance_id != c_id]
-                    sg.members = []
-                    for s in sg.members:
-                        if s.instance_id != c_id:
-                            sg.members.append(s)
-                        else:
-                            logger.debug("- removing service: %s", s)
-                except Exception as exp:
-                    logger.error("Exception when cleaning servicegroup: %s", str(exp))
-
-                logger.debug("- members count after cleaning: %d members", len(sg.members))
+        An Alignak scheduler gets a new instance id when it restarts: the snapshot instance
+        with the same name as the linked instance is replaced by it. The snapshot instances
+        that were not linked again before the timeout are removed too.
+        """
+        name = self.configs[inst_id].get('instance_name') if inst_id is not None else None
+        expired = time.time() - self.snapshot_loaded > SNAPSHOT_INSTANCES_TIMEOUT
+        for c_id in list(self.snapshot_instances):
+            # This instance is sending its initial status
+            if c_id in self.inp_hosts:
+                continue
+            if not expired and (name is None or self.configs[c_id].get('instance_name') != name):
+                continue
+            logger.info("Removing the snapshot hosts/services of %s, not linked again",
+                        self.configs[c_id].get('instance_name', c_id))
+            self.snapshot_instances.discard(c_id)
+            self.clean_instance(c_id)
+            self.partitions.pop(c_id, None)
+            del self.configs[c_id]
+
+    def clean_instance(self, c_id, keep=()):
+        """Remove the hosts and services of a scheduler instance, except the ones in keep
+
+        Only the instance partition and the groups of the removed elements are walked.
+        """
+        logger.debug("Cleaning hosts/service of %s", c_id)
+        partition = self.partitions.get(c_id, {})
+        for my_type, items in [('host', self.hosts), ('service', self.services)]:
+            to_del = [elt for elt in partition.get(my_type, ()) if elt not in keep]
+            if not to_del:
+                continue
+            logger.info("Cleaning %d %ss", len(to_del), my_type)
+
+            groups = set()
+            for elt in to_del:
+                items.remove_item(elt)
+                groups.update(self.groups_of.get(elt, ()))
+                self.unregister_element(elt)
+
+            # Exclude the removed elements from their groups members
+            to_del = set(to_del)
+            for group in groups:
+                logger.debug("Cleaning %s group %s: %d members", my_type, group.get_name(), len(group.members))
+                group.members = [elt for elt in group.members if elt not in to_del]
+                logger.debug("- members count after cleaning: %d members", len(group.members))
 
     def manage_initial_host_status_brok(self, b):
         """Got a new host"""
@@ -906,7 +1339,7 @@ class Regenerator(object):
         logger.debug("Creating a host: %s - %s from scheduler %s", data['id'], hname, inst_id)
         logger.debug("Creating a host: %s ", data)
 
-        host = Host({})
+        host = self.host_class({})
         self.update_element(host, data)
 
         # Update downtimes/comments
@@ -972,7 +1405,7 @@ class Regenerator(object):
         if isinstance(data['display_name'], list):
             data['display_name'] = data['service_description']
 
-        service = Service({})
+        service = self.service_class({})
         self.update_element(service, data)
 
         # Update downtimes/comments
@@ -1040,6 +1473,7 @@ class Regenerator(object):
             c = Contact({})
             self.update_element(c, data)
             self.contacts.add_item(c)
+        self.index_ids(c)
 
         # Delete some useless contact values
         # WebUI - todo, perharps we should not nullify these values!
@@ -1167,6 +1601,7 @@ class Regenerator(object):
             tp = Timeperiod({})
             self.update_element(tp, data)
             self.timeperiods.add_item(tp)
+        self.index_ids(tp)
 
         # Alignak do not keep the Timerange objects and serializes as dict...
         # so we must restore Timeranges from the dictionary
@@ -1327,6 +1762,9 @@ class Regenerator(object):
         logger.debug("Got a scheduler update status from %s", c_name)
         logger.debug("Data: %s", data)
 
+        if self.snapshot_instances:
+            self.expire_snapshot_instances()
+
         # If we got an update about an unknown instance, cry and ask for a full version!
         # Checked that Alignak will also provide information if it gets such a message...
         if c_id not in self.configs.keys():
@@ -1346,15 +1784,8 @@ class Regenerator(object):
         data['_timestamp'] = time.time()
         self.configs[c_id].update(data)
 
-    def manage_update_host_status_brok(self, b):
-        """Got an host update
-        Something changed in the host configuration"""
-        data = b.data
-        hname = data['host_name']
-        host = self.hosts.find_by_name(hname)
-        if not host:
-            return
-
+    def clean_update_host_status_brok(self, b):
+        """Remove the host update data that must not be applied"""
         # There are some properties that should not change and are already linked
         # so just remove them
         clean_prop = ['uuid', 'check_command', 'hostgroups',
@@ -1363,8 +1794,7 @@ class Regenerator(object):
                       'maintenance_period', 'realm', 'customs', 'escalations']
 
         # some are only use when a topology change happened
-        toplogy_change = b.data['topology_change']
-        if not toplogy_change:
+        if not b.data['topology_change']:
             # No childs property in Alignak hosts
             if ALIGNAK:
                 clean_prop.extend(['parents', 'child_dependencies', 'parent_dependencies'])
@@ -1372,7 +1802,35 @@ class Regenerator(object):
                 clean_prop.extend(['childs', 'parents', 'child_dependencies', 'parent_dependencies'])
 
         for prop in clean_prop:
-            del data[prop]
+            del b.data[prop]
+
+    def clean_update_service_status_brok(self, b):
+        """Remove the service update data that must not be applied"""
+        # There are some properties that should not change and are already linked
+        # so just remove them
+        clean_prop = ['uuid', 'check_command', 'servicegroups',
+                      'contacts', 'notification_period', 'contact_groups',
+                      'check_period', 'event_handler',
+                      'maintenance_period', 'customs', 'escalations']
+
+        # some are only use when a topology change happened
+        if not b.data['topology_change']:
+            clean_prop.extend(['child_dependencies', 'parent_dependencies'])
+
+        for prop in clean_prop:
+            del b.data[prop]
+
+    def manage_update_host_status_brok(self, b):
+        """Got an host update
+        Something changed in the host configuration"""
+        data = b.data
+        hname = data['host_name']
+        host = self.hosts.find_by_name(hname)
+        if not host:
+            return
+
+        # some are only use when a topology change happened
+        toplogy_change = b.data['topology_change']
 
         logger.debug("Updated host: %s", hname)
         self.before_after_hook(b, host)
@@ -1393,25 +1851,16 @@ class Regenerator(object):
         # Update downtimes/comments
         self._update_events(host)
 
+        self.classify_element(host)
+        self.elements_index.update(host)
+
     def manage_update_service_status_brok(self, b):
         """Got a service update
         Something changed in the service configuration"""
-        # There are some properties that should not change and are already linked
-        # so just remove them
-        clean_prop = ['uuid', 'check_command', 'servicegroups',
-                      'contacts', 'notification_period', 'contact_groups',
-                      'check_period', 'event_handler',
-                      'maintenance_period', 'customs', 'escalations']
-
         # some are only use when a topology change happened
         toplogy_change = b.data['topology_change']
-        if not toplogy_change:
-            clean_prop.extend(['child_dependencies', 'parent_dependencies'])
 
         data = b.data
-        for prop in clean_prop:
-            del data[prop]
-
         hname = data['host_name']
         sdesc = data['service_description']
         service = self.services.find_srv_by_name_and_hostname(hname, sdesc)
@@ -1434,6 +1883,9 @@ class Regenerator(object):
         # Update downtimes/comments
         self._update_events(service)
 
+        self.classify_element(service)
+        self.elements_index.update(service)
+
     def _update_satellite_status(self, sat_list, sat_name, data):
         """Update a satellite status"""
         logger.debug("Update satellite '%s' status: %s", sat_name, data)
@@ -1493,6 +1945,8 @@ class Regenerator(object):
         if 'uuid' in data:
             data.pop('uuid')
         self.update_element(h, data)
+        self.classify_element(h)
+        self.elements_index.update(h)
 
     def manage_host_next_schedule_brok(self, b):
         """This brok should arrive within a second after the host_check_result_brok.
@@ -1519,6 +1973,8 @@ class Regenerator(object):
         if 'uuid' in data:
             data.pop('uuid')
         self.update_element(s, data)
+        self.classify_element(s)
+        self.elements_index.update(s)
 
     def manage_service_next_schedule_brok(self, b):
         """This brok should arrive within a second after the service_check_result_brok.
@@ -0,0 +1,401 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+HTTP workers processes and their replicas of the regenerated objects
+
+The WebUI process forks the HTTP workers before it starts managing the broks.
+Each worker inherits the listening socket and the objects regenerated so far,
+and serves the pages from its own replica.
+
+The WebUI process does not serve the pages. It decodes, normalizes and coalesces
+the received broks once, manages them, and streams them to the workers through
+pipes. A thread of each worker manages the streamed broks with the worker
+Regenerator. Each streamed message is the pickled tuple (sequence, sent time,
+broks), prefixed with its length.
+
+The workers write the last applied sequence in a shared memory array, so the
+replicas lag is known by all the processes. The WebUI process publishes its
+broks ingestion statistics in shared memory too, for the workers pages.
+
+A worker that exits is forked again by the data thread of the WebUI process,
+between two managed messages: the new worker inherits objects consistent with
+the last streamed message. A worker that is too late to manage the stream is
+stopped, and forked again the same way.
+
+A worker forked again only has the data thread of the threaded WebUI process. A
+lock held by another thread at that time is copied held, and never released in
+the worker. The logging locks are held while forking. The worker creates again
+all the other locks it uses: the data lock, the metrics, the search caches and
+the broks decoder. The internal modules and the plugins must not use, in a
+worker, a lock or a thread the WebUI process created after it started. A
+spawned process would not inherit the replica; the whole objects would have to
+be streamed to it.
+"""
+
+import os
+import time
+import Queue
+import socket
+import signal
+import threading
+import cPickle
+import logging
+import multiprocessing
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+import bottle
+
+from shinken.log import logger
+
+from brok_stream import LENGTH
+
+# Shared status of each worker: sequence, sent time and applied time of the last applied message
+STATUS_FIELDS = 3
+# Size of the shared memory for the pickled broks ingestion statistics of the WebUI process
+INGESTION_STATS_SIZE = 1048576
+
+
+def encode_message(sequence, broks, sent=None):
+    """ Length prefixed record of a streamed message """
+    record = cPickle.dumps((sequence, sent if sent is not None else time.time(), broks),
+                           cPickle.HIGHEST_PROTOCOL)
+    return LENGTH.pack(len(record)) + record
+
+
+def read_messages(f):
+    """ Iterate over the (sequence, sent time, broks) messages of a stream, until its end """
+    while True:
+        header = f.read(LENGTH.size)
+        if len(header) < LENGTH.size:
+            return
+        (length,) = LENGTH.unpack(header)
+        record = f.read(length)
+        if len(record) < length:
+            return
+        yield cPickle.loads(record)
+
+
+def fork_process():
+    """ Fork the process, holding the logging locks so that the child process does not
+    inherit a lock held by another thread of a threaded process. The child process must
+    create again the other locks it uses """
+    logging._acquireLock()
+    handlers = [handler for handler in [ref() for ref in logging._handlerList] if handler is not None]
+    for handler in handlers:
+        handler.acquire()
+    try:
+        return os.fork()
+    finally:
+        for handler in reversed(handlers):
+            handler.release()
+        logging._releaseLock()
+
+
+def listen(host, port, backlog=128):
+    """ Bind the listening socket shared by the HTTP workers """
+    listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    return listener
+
+
+class ListenerServer(bottle.ServerAdapter):
+    """ Bottle server adapter accepting the connections of an already listening socket,
+    the 'listener' option. The forked HTTP workers share the same socket """
+
+    def run(self, handler):
+        listener = self.options['listener']
+        quiet = self.quiet
+
+        class RequestHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kw):
+                if not quiet:
+                    return WSGIRequestHandler.log_request(self, *args, **kw)
+
+        server = WSGIServer(listener.getsockname(), RequestHandler, bind_and_activate=False)
+        server.socket.close()
+        server.socket = listener
+        host, port = listener.getsockname()[:2]
+        server.server_name = socket.getfqdn(host)
+        server.server_port = port
+        server.setup_environ()
+        server.set_app(handler)
+        server.serve_forever()
+
+
+class ReplicaWorker(object):
+    """ A forked HTTP worker, seen from the WebUI process
+
+    The messages are written to the worker pipe by a thread, so a slow worker
+    does not delay the broks management nor the other workers. At most queue_size
+    messages wait for the worker.
+    """
+
+    def __init__(self, index, pid, pipe, queue_size=1000):
+        self.index = index
+        self.pid = pid
+        self.pipe = pipe
+        self.alive = True
+        self.queue = Queue.Queue(max(1, queue_size))
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.write, name='replica-writer-%d' % self.index)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            try:
+                self.pipe.write(data)
+                self.pipe.flush()
+            except (IOError, OSError) as exp:
+                logger.error("[WebUI] HTTP worker %d (pid %d) does not receive the broks anymore: %s",
+                             self.index, self.pid, str(exp))
+                self.alive = False
+                break
+        try:
+            self.pipe.close()
+        except (IOError, OSError):
+            pass
+
+    def stop(self):
+        self.alive = False
+        try:
+            self.queue.put_nowait(None)
+        except Queue.Full:
+            # The writer stops when the worker process exits
+            pass
+
+    def put(self, data):
+        """ Queue a message for the worker, stop the worker if its queue is full.
+        The stopped worker is forked again with an up to date replica """
+        try:
+            self.queue.put_nowait(data)
+        except Queue.Full:
+            logger.error("[WebUI] HTTP worker %d (pid %d) is %d messages late, stopping it",
+                         self.index, self.pid, self.queue.maxsize)
+            self.stop()
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+
+class Replicas(object):
+    """ The HTTP workers processes and the broks stream to their replicas
+
+    :param count: number of HTTP workers
+    :param queue_size: maximum number of streamed messages waiting for a worker
+    """
+
+    def __init__(self, count, queue_size=1000):
+        self.count = count
+        self.queue_size = queue_size
+        # Shared with the workers: last sent sequence, and the status of each worker
+        self.sequence = multiprocessing.RawValue('l', 0)
+        self.status = multiprocessing.RawArray('d', count * STATUS_FIELDS)
+        self.pids = multiprocessing.RawArray('i', count)
+        # Published broks ingestion statistics, and their version: odd while they are written
+        self.ingestion = multiprocessing.RawArray('c', INGESTION_STATS_SIZE)
+        self.ingestion_version = multiprocessing.RawValue('l', 0)
+        self.workers = []
+        # Index of the worker in a worker process, None in the WebUI process
+        self.index = None
+        self.reader = None
+        # Indexes of the exited workers, to fork again
+        self.exited = set()
+        self.lock = threading.Lock()
+
+    def fork(self):
+        """ Fork the workers. No thread must be running yet.
+
+        :returns: the worker index in a worker process, None in the WebUI process
+        """
+        for index in range(self.count):
+            if self.spawn(index):
+                return index
+
+        for worker in self.workers:
+            worker.start()
+        return None
+
+    def spawn(self, index):
+        """ Fork a worker, its replica is up to date with the last streamed message
+
+        :returns: True in the worker process, False in the WebUI process
+        """
+        read_fd, write_fd = os.pipe()
+        pid = fork_process()
+        if pid == 0:
+            os.close(write_fd)
+            for worker in self.workers:
+                try:
+                    worker.pipe.close()
+                except (IOError, OSError):
+                    pass
+            self.workers = []
+            self.exited = set()
+            self.lock = threading.Lock()
+            self.index = index
+            self.reader = os.fdopen(read_fd, 'rb')
+            self.applied(self.sequence.value, time.time())
+            # The worker stops with the default signals behavior
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            return True
+
+        os.close(read_fd)
+        self.pids[index] = pid
+        worker = ReplicaWorker(index, pid, os.fdopen(write_fd, 'wb'), self.queue_size)
+        if index < len(self.workers):
+            self.workers[index] = worker
+        else:
+            self.workers.append(worker)
+        logger.info("[WebUI] forked the HTTP worker %d, pid %d", index, pid)
+        return False
+
+    def respawn(self):
+        """ Fork again the workers that exited, from the WebUI process data thread, when the
+        objects are consistent with the last streamed message. A new worker must create again
+        the locks it uses, see the module documentation
+
+        :returns: the worker index in a new worker process, None in the WebUI process
+        """
+        with self.lock:
+            exited = sorted(self.exited)
+            self.exited.clear()
+        for index in exited:
+            if self.spawn(index):
+                return index
+            self.workers[index].start()
+        return None
+
+    def send(self, broks):
+        """ Stream managed broks to all the workers, from the WebUI process """
+        if not broks:
+            return
+        self.sequence.value += 1
+        data = encode_message(self.sequence.value, broks)
+        for worker in self.workers:
+            if worker.alive:
+                worker.put(data)
+
+    def receive(self):
+        """ Iterate over the (sequence, sent time, broks) streamed messages, in a worker process.
+        The iteration stops when the WebUI process closes the stream """
+        return read_messages(self.reader)
+
+    def applied(self, sequence, sent):
+        """ A worker managed the broks of a streamed message """
+        offset = self.index * STATUS_FIELDS
+        self.status[offset:offset + STATUS_FIELDS] = [sequence, sent, time.time()]
+
+    def check(self):
+        """ Look for the workers that exited, from the WebUI process
+
+        :returns: True if some workers must be forked again
+        """
+        for worker in self.workers:
+            if worker.pid is None:
+                continue
+            try:
+                pid, status = os.waitpid(worker.pid, os.WNOHANG)
+            except OSError:
+                pid, status = worker.pid, -1
+            if pid:
+                logger.error("[WebUI] HTTP worker %d (pid %d) exited, status: %d, forking it again",
+                             worker.index, worker.pid, status)
+                worker.stop()
+                worker.pid = None
+                with self.lock:
+                    self.exited.add(worker.index)
+        return bool(self.exited)
+
+    def stop(self):
+        """ Stop the workers, from the WebUI process """
+        for worker in self.workers:
+            worker.stop()
+            if worker.pid is not None:
+                try:
+                    os.kill(worker.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+    def publish_ingestion_stats(self, stats):
+        """ Share the broks ingestion statistics with the workers, from the WebUI process """
+        record = cPickle.dumps(stats, cPickle.HIGHEST_PROTOCOL)
+        record = LENGTH.pack(len(record)) + record
+        if len(record) > INGESTION_STATS_SIZE:
+            logger.warning("[WebUI] the broks ingestion statistics are too large to be shared: %d bytes",
+                           len(record))
+            return
+        self.ingestion_version.value += 1
+        self.ingestion[:len(record)] = record
+        self.ingestion_version.value += 1
+
+    def get_ingestion_stats(self):
+        """ The last broks ingestion statistics published by the WebUI process, None if
+        they are not available """
+        for _ in range(10):
+            version = self.ingestion_version.value
+            if not version:
+                return None
+            if version % 2 == 0:
+                (length,) = LENGTH.unpack(self.ingestion[:LENGTH.size])
+                record = self.ingestion[LENGTH.size:LENGTH.size + length]
+                if self.ingestion_version.value == version:
+                    return cPickle.loads(record)
+            # Being written
+            time.sleep(0.001)
+        return None
+
+    def get_stats(self):
+        now = time.time()
+        sequence = self.sequence.value
+        workers = []
+        for index in range(self.count):
+            offset = index * STATUS_FIELDS
+            applied, sent, applied_time = self.status[offset:offset + STATUS_FIELDS]
+            workers.append({
+                'index': index,
+                'pid': self.pids[index],
+                'sequence': int(applied),
+                # Streamed messages not yet managed by the worker
+                'behind': sequence - int(applied),
+                # Time between the sending and the management of the last managed message
+                'delay': applied_time - sent if applied_time else None,
+                'last_applied': now - applied_time if applied_time else None
+            })
+        return {
+            'worker': self.index,
+            'sequence': sequence,
+            'workers': workers
+        }
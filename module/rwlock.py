@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Readers/writer lock protecting the regenerated data
+
+The pages rendering are the readers and the broks management is the writer.
+"""
+
+import time
+import threading
+
+from metrics import Histogram
+
+
+class ReadWriteLock(object):
+    """ A readers/writer lock with writers preference
+
+    When a writer is waiting, the new readers wait for it. When a writer releases
+    the lock, the readers that were waiting are let in before the next writer, so
+    neither the readers nor the writers may be starved.
+
+    A thread that already holds the read lock may acquire it again.
+
+    The waiting threads are blocked on a condition: there is no polling.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_readers = 0
+        self.waiting_writers = 0
+        # Number of waiting readers to let in before the next writer, and number of writer
+        # releases: only the readers that were waiting at the last release use the handoff
+        self.handoff = 0
+        self.generation = 0
+        self.local = threading.local()
+
+        # Time spent waiting for the lock, in seconds
+        self.read_wait = Histogram()
+        self.write_wait = Histogram()
+
+    def acquire_read(self):
+        depth = getattr(self.local, 'depth', 0)
+        if depth:
+            self.local.depth = depth + 1
+            return
+
+        start = time.time()
+        with self.condition:
+            ticket = self.generation
+            self.waiting_readers += 1
+            while self.writer or (self.waiting_writers and ticket == self.generation):
+                self.condition.wait()
+            self.waiting_readers -= 1
+            if ticket != self.generation and self.handoff:
+                self.handoff -= 1
+            self.readers += 1
+        self.local.depth = 1
+        self.read_wait.observe(time.time() - start)
+
+    def release_read(self):
+        self.local.depth -= 1
+        if self.local.depth:
+            return
+
+        with self.condition:
+            self.readers -= 1
+            if not self.readers:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        """ Acquire the lock for writing
+
+        :returns: the time spent waiting for the lock
+        """
+        start = time.time()
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writer or self.readers or self.handoff:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+        waited = time.time() - start
+        self.write_wait.observe(waited)
+        return waited
+
+    def release_write(self):
+        with self.condition:
+            self.writer = False
+            self.handoff = self.waiting_readers
+            self.generation += 1
+            self.condition.notify_all()
+
+    def get_stats(self):
+        return {
+            'readers': self.readers,
+            'writer': self.writer,
+            'waiting_readers': self.waiting_readers,
+            'waiting_writers': self.waiting_writers,
+            'read_wait': self.read_wait.get_stats(),
+            'write_wait': self.write_wait.get_stats()
+        }
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Search strings compiler.
+
+A search string like 'isnot:UP isnot:OK bi:>=3 "vm fred"' is parsed once into
+a plan: a tuple of SearchTerm with the regular expressions already compiled and
+the numeric comparisons already parsed. The plans are immutable, so they are
+kept in a bounded LRU cache and shared by all the requests searching for the
+same string.
+"""
+
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+# Search patterns like: isnot:0 isnot:ack isnot:"downtime fred" name "vm fred"
+SEARCH_REGEX = re.compile(
+    r'''
+                            # 1/ Search a key:value pattern.
+        (?P<key>\w+):       # Key consists of only a word followed by a colon
+        (?P<quote2>["']?)   # Optional quote character.
+        (?P<value>.*?)      # Value is a non greedy match
+        (?P=quote2)         # Closing quote equals the first.
+        ($|\s)              # Entry ends with whitespace or end of string
+        |                   # OR
+                            # 2/ Search a single string quoted or not
+        (?P<quote>["']?)    # Optional quote character.
+        (?P<name>.*?)       # Name is a non greedy match
+        (?P=quote)          # Closing quote equals the opening one.
+        ($|\s)              # Entry ends with whitespace or end of string
+    ''',
+    re.VERBOSE)
+
+SECONDS_PER_UNIT = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+# A compiled search term:
+# - key: lower case search key ('name' for the free text terms)
+# - value: searched value, as it was written
+# - pattern: compiled regular expression for the name, host and service terms
+# - predicate: comparison function for the bi and duration terms, None if the
+#   compared value is not valid
+SearchTerm = namedtuple('SearchTerm', ['key', 'value', 'pattern', 'predicate'])
+
+
+def split_comparison(value, operators=('>=', '<=', '>', '<', '=')):
+    """ Split a comparison value like '>=3' into an operator and the compared string """
+    for operator in operators:
+        if value.startswith(operator):
+            return operator, value[len(operator):]
+    return '=', value
+
+
+def comparison_function(operator, reference):
+    return {
+        '>=': lambda v: v >= reference,
+        '<=': lambda v: v <= reference,
+        '>': lambda v: v > reference,
+        '<': lambda v: v < reference,
+        '=': lambda v: v == reference
+    }[operator]
+
+
+def parse_search(search):
+    """ Split a search string into a list of (key, value) search terms """
+    # Replace "NOT foo" by "^((?!foo).)*$" to ignore foo
+    search = re.sub(r'NOT ([^\ ]*)', r'^((?!\1).)*$', search)
+    search = re.sub(r'not ([^\ ]*)', r'^((?!\1).)*$', search)
+
+    patterns = []
+    for match in SEARCH_REGEX.finditer(search):
+        if match.group('name'):
+            patterns.append(('name', match.group('name')))
+        elif match.group('key'):
+            t, s = match.group('key').lower(), match.group('value')
+            # :COMMENT:maethor:150616: Legacy filters, kept for bookmarks compatibility
+            if t in ['ack', 'downtime']:
+                if s.lower() in ['false', 'no']:
+                    patterns.append(('isnot', t))
+                if s.lower() in ['true', 'yes']:
+                    patterns.append(('is', t))
+            elif t == 'crit':
+                patterns.append(('is', 'critical'))
+            else:
+                patterns.append((t, s))
+    return patterns
+
+
+def compile_term(t, s):
+    """ Build the SearchTerm of a (key, value) search term """
+    pattern = None
+    predicate = None
+
+    if t == 'name':
+        # Case insensitive
+        pattern = re.compile(s, re.IGNORECASE)
+    elif t in ['h', 'host', 's', 'service'] and s.lower() != 'all':
+        # Case sensitive
+        pattern = re.compile(s)
+    elif t in ['bp', 'bi']:
+        operator, value = split_comparison(s)
+        try:
+            predicate = comparison_function(operator, int(value))
+        except ValueError:
+            pass
+    elif t == 'duration':
+        operator, value = split_comparison(s, operators=('>=', '<=', '>', '<'))
+        if value != s:
+            try:
+                value = int(value[:-1]) * SECONDS_PER_UNIT[value[-1].lower()]
+                predicate = comparison_function(operator, value)
+            except Exception:
+                pass
+
+    return SearchTerm(t, s, pattern, predicate)
+
+
+def compile_search(search):
+    """ Compile a search string into a plan: a tuple of SearchTerm """
+    return tuple(compile_term(t, s) for t, s in parse_search(search))
+
+
+# Search keys whose results depend on the current time, not only on the data
+TIME_DEPENDENT_KEYS = frozenset(['duration'])
+
+
+def is_time_dependent(plan):
+    """ True if the results of a search plan change with the time """
+    return any(term.key in TIME_DEPENDENT_KEYS for term in plan)
+
+
+class LRUCache(object):
+    """ A bounded and thread safe Least Recently Used cache """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # Move the item to the most recently used end
+            self.items[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def get_stats(self):
+        return {
+            'size': self.size,
+            'count': len(self.items),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+class SearchQueryCompiler(object):
+    """ Compile the search strings and cache the resulting plans """
+
+    def __init__(self, cache_size=256):
+        self.plans = LRUCache(cache_size)
+
+    def compile(self, search):
+        plan = self.plans.get(search)
+        if plan is None:
+            plan = compile_search(search)
+            self.plans.set(search, plan)
+        return plan
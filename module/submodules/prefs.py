@@ -46,6 +46,14 @@ class PrefsMetaModule(MetaModule):
 
         return self.module is not None
 
+    def reconnect(self):
+        """ Open a new database connection, in a forked HTTP worker """
+        if isinstance(self.module, MongoDBPreferences) and self.module.uri:
+            try:
+                self.module.open()
+            except Exception as exp:
+                logger.warning("[WebUI] %s", str(exp))
+
     def get_ui_user_preference(self, user, key=None, default=None):
         if self.is_available():
             return self.module.get_ui_user_preference(user, key) or default
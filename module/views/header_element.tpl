@@ -136,6 +136,15 @@
          </a>
       </li>
 
+      %snapshot_age = app.get_snapshot_age()
+      %if snapshot_age is not None:
+      <li>
+         <a class="btn btn-ico" href="#" title="Waiting for the schedulers, the displayed data are from a snapshot taken {{ app.helper.print_duration(app.rg.snapshot_time, just_duration=True, x_elts=2) }} ago">
+            <i class="fa fa-history text-warning"></i>
+         </a>
+      </li>
+      %end
+
       %if refresh:
       <li>
          <button class="btn btn-ico js-toggle-page-refresh">
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+WebUI benchmark suite
+
+Build a synthetic estate, manage its broks with a Regenerator and measure the
+linking, the broks management, the searches, the synthesis, the users ACL and
+the main pages handlers. The results are written as JSON, so the results of two
+commits may be compared:
+
+    python test/benchmark.py --hosts 10000 --output before.json
+    python test/benchmark.py --hosts 10000 --output after.json --compare before.json
+"""
+
+import os
+import sys
+import imp
+import json
+import time
+import platform
+import argparse
+
+MODULE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'module'))
+sys.path.insert(0, MODULE_DIR)
+
+import bottle
+
+from shinken.log import logger
+
+from regenerator import Regenerator
+from datamanager import WebUIDataManager
+from compact import DEFAULT_INTERNED_ATTRIBUTES, get_rss
+from ui_user import User
+from helper import helper
+from estate import Estate
+
+PROBLEMS_SEARCH_STRING = "isnot:UP isnot:OK isnot:PENDING isnot:ACK isnot:DOWNTIME isnot:SOFT bi:>=0"
+
+# Common searches of the WebUI pages
+SEARCHES = (
+    '', 'type:host', 'type:service', PROBLEMS_SEARCH_STRING, 'is:DOWN', 'isnot:OK type:service',
+    'hg:hostgroup-001', 'sg:servicegroup-001', 'htag:tag-001', 'bi:>=3', 'host-0000',
+    'type:host is:impact', 'service-001 is:CRITICAL'
+)
+
+PAGES_PLUGINS = ('problems', 'impacts', 'minemap', 'eltdetail', 'groups')
+
+
+class Preferences(object):
+    """ Users preferences without a storage, the default values """
+
+    def get_ui_user_preference(self, user, key, default=None):
+        return default
+
+    def set_ui_user_preference(self, user, key, value):
+        pass
+
+    def get_user_bookmarks(self, user):
+        return []
+
+    def get_common_bookmarks(self):
+        return []
+
+
+class BenchmarkApp(object):
+    """ The WebUI attributes used by the pages handlers """
+    PROBLEMS_SEARCH_STRING = PROBLEMS_SEARCH_STRING
+    problems_business_impact = 0
+    play_sound = False
+
+    def __init__(self, datamgr):
+        self.datamgr = datamgr
+        self.bottle = bottle
+        self.request = bottle.request
+        self.helper = helper
+        self.prefs_module = Preferences()
+
+    def get_search_string(self):
+        search_params = self.request.GET.getall('search')
+        return ' '.join(search_params) if search_params else None
+
+    def get_and_update_search_string_with_problems_filters(self, redirect=True):
+        return self.get_search_string() or self.PROBLEMS_SEARCH_STRING
+
+    def redirect404(self, msg="Not found"):
+        raise self.bottle.HTTPError(404, msg)
+
+
+def timed(function, repeat=1, setup=None):
+    """ Run a function repeat times, returns the min, mean and max durations in seconds """
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.time()
+        function()
+        durations.append(time.time() - start)
+    return {
+        'min': min(durations),
+        'mean': sum(durations) / len(durations),
+        'max': max(durations)
+    }
+
+
+def load_plugin(name):
+    plugin_dir = os.path.join(MODULE_DIR, 'plugins', name)
+    return imp.load_module(name, *imp.find_module(name, [plugin_dir]))
+
+
+def bind_request(user, query=''):
+    bottle.request.bind({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/', 'QUERY_STRING': query})
+    bottle.request.environ['USER'] = user
+
+
+def manage_broks(rg, broks):
+    """ Manage broks, returns the time spent per brok type """
+    types = {}
+    for brok in broks:
+        start = time.time()
+        brok.prepare()
+        rg.manage_brok(brok)
+        duration = time.time() - start
+        counters = types.setdefault(brok.type, {'count': 0, 'time': 0.0})
+        counters['count'] += 1
+        counters['time'] += duration
+    for counters in types.values():
+        counters['rate'] = counters['count'] / counters['time'] if counters['time'] else None
+    return types
+
+
+def run(estate, compact=True, updates=10000, repeat=5):
+    results = {}
+
+    rg = Regenerator()
+    rg.set_compact_elements(compact)
+    rg.set_shared_values(DEFAULT_INTERNED_ATTRIBUTES, 10000)
+    datamgr = WebUIDataManager(rg)
+
+    # Initial broks and linking
+    broks = estate.all_initial_broks()
+    rss = get_rss()
+    results['initial_broks'] = manage_broks(rg, broks)
+    results['linking'] = results['initial_broks']['initial_broks_done']['time']
+    results['memory'] = {'rss': get_rss() - rss, 'elements': rg.memory}
+    del broks
+
+    # Live broks
+    results['check_results'] = manage_broks(rg, estate.check_result_broks(updates))
+    results['updates'] = manage_broks(rg, estate.update_broks(updates / 10))
+
+    admin = User.from_contact(rg.contacts.find_by_name(estate.contact_name(0)))
+    user = User.from_contact(rg.contacts.find_by_name(estate.contact_name(1)))
+
+    # Searches, without and with the results cache
+    results['searches'] = {}
+    for search in SEARCHES:
+        results['searches'][search] = {
+            'found': len(datamgr.search_hosts_and_services(search, admin)),
+            'cold': timed(lambda: datamgr.search_hosts_and_services(search, admin), repeat,
+                          setup=datamgr.search_results.clear),
+            'cached': timed(lambda: datamgr.search_hosts_and_services(search, admin), repeat)
+        }
+
+    # Synthesis and ACL filtering
+    results['synthesis'] = {}
+    results['acl'] = {}
+    for name, contact in (('admin', admin), ('user', user)):
+        results['synthesis'][name] = {
+            'hosts': timed(lambda: datamgr.get_hosts_synthesis(user=contact), repeat,
+                           setup=datamgr.search_results.clear),
+            'services': timed(lambda: datamgr.get_services_synthesis(user=contact), repeat,
+                              setup=datamgr.search_results.clear)
+        }
+        results['acl'][name] = {
+            'visible': len(datamgr.search_hosts_and_services('', contact)),
+            'search': timed(lambda: datamgr.search_hosts_and_services(PROBLEMS_SEARCH_STRING, contact),
+                            repeat, setup=datamgr.search_results.clear),
+            'related': timed(lambda: datamgr._only_related_to(list(rg.hosts) + list(rg.services), contact),
+                             repeat)
+        }
+
+    # Pages handlers, without the templates rendering
+    app = BenchmarkApp(datamgr)
+    plugins = {}
+    for name in PAGES_PLUGINS:
+        plugins[name] = load_plugin(name)
+        plugins[name].app = app
+    host_name = estate.host_name(0)
+    pages = (
+        ('problems', plugins['problems'].get_all, (), 'search=' + PROBLEMS_SEARCH_STRING),
+        ('all', plugins['problems'].get_all, (), 'search=&step=100'),
+        ('impacts', plugins['impacts'].show_impacts, (), ''),
+        ('minemap', plugins['minemap'].show_minemap, (), 'search=type:host'),
+        ('host', plugins['eltdetail'].show_host, (host_name,), ''),
+        ('hostgroups', plugins['groups'].show_hostgroups, (), '')
+    )
+    results['pages'] = {}
+    for name, handler, args, query in pages:
+        results['pages'][name] = {}
+        for user_name, contact in (('admin', admin), ('user', user)):
+            bind_request(contact, query)
+            results['pages'][name][user_name] = timed(lambda: handler(*args), repeat,
+                                                      setup=datamgr.search_results.clear)
+
+    return results
+
+
+def compare(previous, current, path=()):
+    """ Iterate over the (path, previous, current) durations of two results """
+    for key in sorted(current):
+        value = current[key]
+        before = previous.get(key) if isinstance(previous, dict) else None
+        if before is None:
+            continue
+        if isinstance(value, dict):
+            for item in compare(before, value, path + (key,)):
+                yield item
+        elif key in ('time', 'mean', 'linking') and isinstance(value, float):
+            yield '/'.join(path + (key,)), before, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the WebUI on a synthetic estate")
+    parser.add_argument('--hosts', type=int, default=1000, help="number of hosts")
+    parser.add_argument('--services', type=int, default=10, help="number of services per host")
+    parser.add_argument('--hostgroups', type=int, default=50, help="number of hosts groups")
+    parser.add_argument('--hostgroups-per-host', type=int, default=3, help="groups of each host")
+    parser.add_argument('--servicegroups', type=int, default=50, help="number of services groups")
+    parser.add_argument('--tags', type=int, default=20, help="number of hosts tags")
+    parser.add_argument('--tags-per-host', type=int, default=2, help="tags of each host")
+    parser.add_argument('--depth', type=int, default=2, help="depth of the hosts dependencies")
+    parser.add_argument('--contacts', type=int, default=20, help="number of contacts")
+    parser.add_argument('--contacts-per-element', type=int, default=2, help="contacts of each element")
+    parser.add_argument('--schedulers', type=int, default=1, help="number of schedulers")
+    parser.add_argument('--problems', type=float, default=0.1, help="ratio of elements with a problem")
+    parser.add_argument('--updates', type=int, default=10000, help="number of check results broks")
+    parser.add_argument('--repeat', type=int, default=5, help="runs of each measure")
+    parser.add_argument('--seed', type=int, default=0, help="random generator seed")
+    parser.add_argument('--no-compact', action='store_true', help="do not use the compact hosts and services")
+    parser.add_argument('--output', help="JSON results file, default is the standard output")
+    parser.add_argument('--compare', help="JSON results file of a previous run, to compare with")
+    args = parser.parse_args(argv)
+
+    logger.setLevel('WARNING')
+
+    estate = Estate(hosts=args.hosts, services=args.services, hostgroups=args.hostgroups,
+                    hostgroups_per_host=args.hostgroups_per_host, servicegroups=args.servicegroups,
+                    tags=args.tags, tags_per_host=args.tags_per_host, depth=args.depth,
+                    contacts=args.contacts, contacts_per_element=args.contacts_per_element,
+                    schedulers=args.schedulers, problems=args.problems, seed=args.seed)
+    report = {
+        'estate': estate.get_stats(),
+        'compact': not args.no_compact,
+        'python': platform.python_version(),
+        'date': time.time(),
+        'results': run(estate, compact=not args.no_compact, updates=args.updates, repeat=args.repeat)
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if previous.get('estate') != report['estate']:
+            sys.stderr.write("The compared results are not from the same estate\n")
+        for path, before, after in compare(previous['results'], report['results']):
+            sys.stderr.write("%-70s %10.4f %10.4f %+7.1f%%\n"
+                             % (path, before, after, 100.0 * (after - before) / before if before else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2009-2014:
+#    Gabes Jean, naparuba@gmail.com
+#    Gerhard Lausser, Gerhard.Lausser@consol.de
+#    Gregory Starck, g.starck@gmail.com
+#    Hartmut Goebel, h.goebel@goebel-consult.de
+#    Frederic Mohier, frederic.mohier@gmail.com
+#
+# This file is part of Shinken.
+#
+# Shinken is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Shinken is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Shinken.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Synthetic monitored estates
+
+An Estate builds the broks a Shinken scheduler would send for a configurable
+number of hosts and services: the initial status broks, then check results and
+status updates. The broks data hold all the properties the Shinken objects send
+in their broks, with their default values unless the estate sets them.
+"""
+
+import copy
+import time
+import random
+import itertools
+
+from shinken.brok import Brok
+from shinken.objects.host import Host
+from shinken.objects.service import Service
+
+HOST_STATES = ['UP', 'DOWN', 'UNREACHABLE']
+SERVICE_STATES = ['OK', 'WARNING', 'CRITICAL', 'UNKNOWN']
+
+
+def brok_defaults(cls, brok_type):
+    """ The default values of the properties a class sends in a type of broks """
+    data = {}
+    for prop, entry in itertools.chain(cls.properties.items(), cls.running_properties.items()):
+        if brok_type in entry.fill_brok and entry.has_default:
+            data[prop] = entry.default
+    return data
+
+
+class Estate(object):
+    """ A synthetic estate
+
+    :param hosts: number of hosts
+    :param services: number of services per host
+    :param hostgroups: number of hosts groups, each host is a member of hostgroups_per_host groups
+    :param servicegroups: number of services groups, each service is a member of one group
+    :param tags: number of hosts tags, each host has tags_per_host tags
+    :param depth: depth of the hosts parents trees, 0 for no dependencies
+    :param contacts: number of contacts, the first one is an administrator. Each element
+    has contacts_per_element contacts
+    :param schedulers: number of schedulers the hosts are dispatched to
+    :param problems: ratio of the hosts and services with a problem
+    """
+
+    def __init__(self, hosts=100, services=10, hostgroups=10, hostgroups_per_host=2,
+                 servicegroups=10, tags=10, tags_per_host=2, depth=2, contacts=10,
+                 contacts_per_element=2, schedulers=1, problems=0.1, seed=0):
+        self.hosts = hosts
+        self.services = services
+        self.hostgroups = max(1, hostgroups)
+        self.hostgroups_per_host = min(hostgroups_per_host, self.hostgroups)
+        self.servicegroups = max(1, servicegroups)
+        self.tags = max(1, tags)
+        self.tags_per_host = min(tags_per_host, self.tags)
+        self.depth = depth
+        self.contacts = max(1, contacts)
+        self.contacts_per_element = min(contacts_per_element, self.contacts)
+        self.schedulers = max(1, schedulers)
+        self.problems = problems
+        self.random = random.Random(seed)
+
+        self.host_defaults = brok_defaults(Host, 'full_status')
+        self.service_defaults = brok_defaults(Service, 'full_status')
+        self.host_check_defaults = brok_defaults(Host, 'check_result')
+        self.service_check_defaults = brok_defaults(Service, 'check_result')
+
+    def get_stats(self):
+        return dict((name, value) for name, value in self.__dict__.items()
+                    if isinstance(value, (int, float)))
+
+    @staticmethod
+    def host_name(i):
+        return 'host-%06d' % i
+
+    @staticmethod
+    def service_description(j):
+        return 'service-%03d' % j
+
+    @staticmethod
+    def contact_name(k):
+        return 'contact-%03d' % k
+
+    def instance_hosts(self, instance_id):
+        return range(instance_id, self.hosts, self.schedulers)
+
+    def element_contacts(self, i):
+        return [self.contact_name((i + k) % self.contacts) for k in range(self.contacts_per_element)]
+
+    def parent(self, i):
+        """ The parent host of a host, hosts are chained by trees of depth levels """
+        if not self.depth or not i % (self.depth + 1):
+            return None
+        return i - 1
+
+    def random_state(self, states):
+        if self.random.random() < self.problems:
+            state_id = self.random.randint(1, len(states) - 1)
+        else:
+            state_id = 0
+        return states[state_id], state_id
+
+    def host_status(self, i, instance_id):
+        name = self.host_name(i)
+        state, state_id = self.random_state(HOST_STATES)
+        parent = self.parent(i)
+        children = [i + 1] if i + 1 < self.hosts and self.parent(i + 1) == i else []
+        data = copy.deepcopy(self.host_defaults)
+        data.update({
+            'id': 'host-%d' % i, 'instance_id': instance_id, 'host_name': name, 'alias': name,
+            'display_name': name, 'address': '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255),
+            'state': state, 'state_id': state_id, 'state_type': 'HARD',
+            'last_state_change': time.time() - self.random.randint(0, 86400),
+            'output': 'PING %s' % state, 'business_impact': self.random.randint(0, 5),
+            'problem_has_been_acknowledged': bool(state_id and self.random.random() < 0.2),
+            'is_problem': bool(state_id),
+            'hostgroups': ['hostgroup-%03d' % ((i + k) % self.hostgroups) for k in range(self.hostgroups_per_host)],
+            'tags': ['tag-%03d' % ((i + k) % self.tags) for k in range(self.tags_per_host)],
+            'contacts': self.element_contacts(i), 'contact_groups': [],
+            'check_command': None, 'event_handler': None, 'check_period': '24x7',
+            'notification_period': '24x7', 'maintenance_period': None, 'realm': 'All',
+            'parents': [self.host_name(parent)] if parent is not None else [],
+            'childs': [self.host_name(child) for child in children],
+            'parent_dependencies': {'hosts': [self.host_name(parent)] if parent is not None else [],
+                                    'services': []},
+            'child_dependencies': {'hosts': [self.host_name(child) for child in children],
+                                   'services': []},
+            'impacts': [], 'source_problems': [], 'downtimes': [], 'comments': []
+        })
+        return data
+
+    def service_status(self, i, j, instance_id):
+        host_name = self.host_name(i)
+        description = self.service_description(j)
+        state, state_id = self.random_state(SERVICE_STATES)
+        data = copy.deepcopy(self.service_defaults)
+        data.update({
+            'id': 'service-%d-%d' % (i, j), 'instance_id': instance_id, 'host_name': host_name,
+            'service_description': description, 'display_name': description,
+            'state': state, 'state_id': state_id,
+            'state_type': 'HARD' if self.random.random() < 0.9 else 'SOFT',
+            'last_state_change': time.time() - self.random.randint(0, 86400),
+            'output': '%s - %s' % (state, description), 'perf_data': 'value=%d' % j,
+            'business_impact': self.random.randint(0, 5),
+            'problem_has_been_acknowledged': bool(state_id and self.random.random() < 0.2),
+            'is_problem': bool(state_id),
+            'servicegroups': ['servicegroup-%03d' % self.servicegroup(i, j)],
+            'tags': [], 'contacts': self.element_contacts(i + j), 'contact_groups': [],
+            'check_command': None, 'event_handler': None, 'check_period': '24x7',
+            'notification_period': '24x7', 'maintenance_period': None,
+            'parent_dependencies': {'hosts': [host_name], 'services': []},
+            'child_dependencies': {'hosts': [], 'services': []},
+            'impacts': [], 'source_problems': [], 'downtimes': [], 'comments': []
+        })
+        return data
+
+    def servicegroup(self, i, j):
+        return (i * self.services + j) % self.servicegroups
+
+    def initial_broks(self, instance_id=0):
+        """ The initial status broks of a scheduler instance """
+        common = {'instance_id': instance_id, 'instance_name': 'scheduler-%d' % instance_id}
+        hosts = self.instance_hosts(instance_id)
+        broks = [
+            Brok('program_status', dict(common, is_running=1, last_alive=time.time())),
+            Brok('initial_timeperiod_status', dict(common, id='timeperiod-24x7', timeperiod_name='24x7',
+                                                   dateranges=[], exclude=[], unresolved=[]))
+        ]
+
+        for k in range(self.contacts):
+            broks.append(Brok('initial_contact_status', dict(
+                common, id='contact-%d' % k, contact_name=self.contact_name(k), is_admin='1' if not k else '0',
+                notificationways=[], host_notification_commands=[], service_notification_commands=[],
+                host_notification_period=None, service_notification_period=None)))
+        broks.append(Brok('initial_contactgroup_status', dict(
+            common, id='contactgroup-all', contactgroup_name='all',
+            members=[('contact-%d' % k, self.contact_name(k)) for k in range(self.contacts)],
+            contactgroup_members='')))
+
+        for g in range(self.hostgroups):
+            members = [('host-%d' % i, self.host_name(i)) for i in hosts
+                       if g in [(i + k) % self.hostgroups for k in range(self.hostgroups_per_host)]]
+            broks.append(Brok('initial_hostgroup_status', dict(
+                common, id='hostgroup-%d' % g, hostgroup_name='hostgroup-%03d' % g,
+                members=members, hostgroup_members='')))
+        for g in range(self.servicegroups):
+            members = [('service-%d-%d' % (i, j), self.service_description(j))
+                       for i in hosts for j in range(self.services) if self.servicegroup(i, j) == g]
+            broks.append(Brok('initial_servicegroup_status', dict(
+                common, id='servicegroup-%d' % g, servicegroup_name='servicegroup-%03d' % g,
+                members=members, servicegroup_members='')))
+
+        for i in hosts:
+            broks.append(Brok('initial_host_status', self.host_status(i, instance_id)))
+            for j in range(self.services):
+                broks.append(Brok('initial_service_status', self.service_status(i, j, instance_id)))
+
+        broks.append(Brok('initial_broks_done', dict(common)))
+        return broks
+
+    def all_initial_broks(self):
+        return list(itertools.chain(*[self.initial_broks(inst) for inst in range(self.schedulers)]))
+
+    def check_result_broks(self, count):
+        """ Random check results of the hosts and services """
+        broks = []
+        for _ in range(count):
+            i = self.random.randrange(self.hosts)
+            if self.services and self.random.random() > 1.0 / (self.services + 1):
+                j = self.random.randrange(self.services)
+                state, state_id = self.random_state(SERVICE_STATES)
+                data = dict(self.service_check_defaults, host_name=self.host_name(i),
+                            service_description=self.service_description(j),
+                            output='%s - %s' % (state, self.service_description(j)),
+                            perf_data='value=%d' % self.random.randint(0, 100))
+                brok_type = 'service_check_result'
+            else:
+                state, state_id = self.random_state(HOST_STATES)
+                data = dict(self.host_check_defaults, host_name=self.host_name(i),
+                            output='PING %s' % state)
+                brok_type = 'host_check_result'
+            data.update({
+                'instance_id': i % self.schedulers, 'state': state, 'state_id': state_id,
+                'state_type': 'HARD', 'last_chk': time.time(), 'is_problem': bool(state_id)
+            })
+            broks.append(Brok(brok_type, data))
+        return broks
+
+    def update_broks(self, count):
+        """ Random hosts and services status updates, without topology change """
+        broks = []
+        for _ in range(count):
+            i = self.random.randrange(self.hosts)
+            if self.services and self.random.random() > 1.0 / (self.services + 1):
+                data = self.service_status(i, self.random.randrange(self.services), i % self.schedulers)
+                brok_type = 'update_service_status'
+            else:
+                data = self.host_status(i, i % self.schedulers)
+                brok_type = 'update_host_status'
+            data.update({'topology_change': False, 'uuid': data['id'], 'customs': {}, 'escalations': []})
+            broks.append(Brok(brok_type, data))
+        return broks
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import unittest
+from module import brok_decoder
+
+
+class TestBroksDecoder(unittest.TestCase):
+    def test_received_order(self):
+        def decode(message):
+            # The first messages are the slowest to decode
+            time.sleep(0.01 * (5 - message[0]))
+            return [b * 10 for b in message]
+
+        decoder = brok_decoder.BroksDecoder(decode, workers=4, queue_size=8)
+        decoder.start()
+        for i in range(5):
+            decoder.submit([i])
+        self.assertEqual([decoder.get() for _ in range(5)], [[0], [10], [20], [30], [40]])
+        self.assertEqual(decoder.get_stats()['decode']['count'], 5)
+
+    def test_bounded_queue(self):
+        decoder = brok_decoder.BroksDecoder(lambda message: message, workers=1, queue_size=1)
+        decoder.start()
+        decoder.submit([1])
+        submitted = threading.Event()
+
+        def submit():
+            decoder.submit([2])
+            submitted.set()
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        # The queue is full until the first message is managed
+        self.assertFalse(submitted.wait(0.1))
+        self.assertEqual(decoder.get(), [1])
+        self.assertTrue(submitted.wait(5))
+        self.assertEqual(decoder.get(), [2])
+        thread.join()
+
+    def test_decoding_error(self):
+        decoder = brok_decoder.BroksDecoder(lambda message: 1 / 0)
+        decoder.start()
+        decoder.submit([1])
+        self.assertEqual(decoder.get(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
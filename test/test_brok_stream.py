@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from module import brok_stream
+
+
+class TestBrokRecorder(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'broks.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record_and_read(self):
+        recorder = brok_stream.BrokRecorder(self.path)
+        recorder.record([{'type': 'program_status'}, {'type': 'host_check_result'}])
+        recorder.record([{'type': 'log'}])
+        recorder.close()
+        records = list(brok_stream.read_broks(self.path))
+        self.assertEqual([brok['type'] for _, brok in records],
+                         ['program_status', 'host_check_result', 'log'])
+
+    def test_max_size(self):
+        recorder = brok_stream.BrokRecorder(self.path, max_size=1)
+        recorder.record([{'type': 'program_status'}])
+        # The record is full, the next broks are not recorded
+        recorder.record([{'type': 'log'}])
+        self.assertEqual(len(list(brok_stream.read_broks(self.path))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
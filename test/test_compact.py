@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import cPickle
+import unittest
+from module import compact
+
+
+class Property(object):
+    def __init__(self, default=None, has_default=True):
+        self.default = default
+        self.has_default = has_default
+
+
+class Element(object):
+    properties = {
+        'business_impact': Property(2),
+        'address': Property(has_default=False),
+        'notes': Property('')
+    }
+    running_properties = {
+        'state': Property('PENDING'),
+        'impacts': Property([]),
+        'latency': Property(0)
+    }
+
+    def __init__(self):
+        self.init_running_properties()
+
+    def init_running_properties(self):
+        for prop, entry in self.running_properties.items():
+            setattr(self, prop, entry.default)
+
+
+class CompactElement(compact.CompactElement, Element):
+    pass
+
+
+class SlottedElement(Element):
+    # Like the Shinken elements, the properties are slots
+    __slots__ = ('state', 'latency', 'host_name')
+
+
+class CompactSlottedElement(compact.CompactElement, SlottedElement):
+    pass
+
+
+class TestCompactElement(unittest.TestCase):
+    def test_hot_fields(self):
+        elt = CompactElement()
+        self.assertEqual(elt.__dict__, {'state': 'PENDING', 'impacts': []})
+        elt.state = 'UP'
+        self.assertEqual(elt.state, 'UP')
+
+    def test_defaults(self):
+        elt = CompactElement()
+        # Not initialized, but read from the properties default values
+        self.assertNotIn('latency', elt.__dict__)
+        self.assertEqual(elt.latency, 0)
+        self.assertEqual(elt.business_impact, 2)
+        self.assertEqual(elt.notes, '')
+        self.assertRaises(AttributeError, getattr, elt, 'address')
+        self.assertRaises(AttributeError, getattr, elt, 'unknown')
+
+    def test_mutable_defaults_are_copied(self):
+        elt = CompactElement()
+        self.assertIsNot(elt.impacts, Element.running_properties['impacts'].default)
+
+    def test_mutable_defaults_are_kept(self):
+        # A mutable default read from the properties is kept, so its updates are not lost
+        Element.running_properties['children'] = Property([])
+        self.addCleanup(Element.running_properties.pop, 'children')
+        elt = CompactElement()
+        self.assertNotIn('children', elt.__dict__)
+        elt.children.append('srv')
+        self.assertEqual(elt.children, ['srv'])
+        self.assertEqual(CompactElement().children, [])
+        self.assertEqual(Element.running_properties['children'].default, [])
+
+    def test_pickle(self):
+        elt = CompactElement()
+        elt.state = 'DOWN'
+        elt.host_name = 'srv'
+        copy = cPickle.loads(cPickle.dumps(elt, cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy.state, 'DOWN')
+        self.assertEqual(copy.host_name, 'srv')
+        self.assertEqual(copy.latency, 0)
+
+    def test_pickle_base_slots(self):
+        elt = CompactSlottedElement()
+        elt.state = 'DOWN'
+        elt.host_name = 'srv'
+        elt.output = 'PING OK'
+        copy = cPickle.loads(cPickle.dumps(elt, cPickle.HIGHEST_PROTOCOL))
+        self.assertEqual((copy.state, copy.host_name, copy.output), ('DOWN', 'srv', 'PING OK'))
+
+
+class TestValuesTable(unittest.TestCase):
+    def test_share(self):
+        table = compact.ValuesTable()
+        first = ''.join(['PING', ' OK'])
+        second = ''.join(['PING', ' OK'])
+        self.assertIs(table.share(first), first)
+        self.assertIs(table.share(second), first)
+        self.assertEqual(table.share(3), 3)
+        self.assertEqual(table.get_stats()['hits'], 1)
+
+    def test_bounded(self):
+        table = compact.ValuesTable(2)
+        table.share('a')
+        table.share('b')
+        table.share('c')
+        self.assertEqual(len(table), 1)
+        self.assertIn('c', table)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+from shinken.brok import Brok
+from module.regenerator import Regenerator
+from module.datamanager import WebUIDataManager
+from module.ui_user import User
+from estate import Estate
+
+
+class TestDataManager(unittest.TestCase):
+    def setUp(self):
+        self.estate = Estate(hosts=12, services=3, hostgroups=4, servicegroups=2, tags=3,
+                             depth=2, contacts=3, schedulers=2, problems=0)
+        self.rg = Regenerator()
+        for brok in self.estate.all_initial_broks():
+            brok.prepare()
+            self.rg.manage_brok(brok)
+        self.datamgr = WebUIDataManager(self.rg)
+
+    def manage(self, *broks):
+        for brok in broks:
+            brok.prepare()
+            self.rg.manage_brok(brok)
+
+    def host_down(self, i, **data):
+        return Brok('host_check_result', dict(self.estate.host_check_defaults, host_name=self.estate.host_name(i),
+                                              state='DOWN', state_id=1, state_type='HARD', is_problem=True, **data))
+
+    def user(self, k):
+        return User.from_contact(self.rg.contacts.find_by_name(self.estate.contact_name(k)))
+
+    def test_search_results_cache(self):
+        search = self.datamgr.search_hosts_and_services
+        hosts = search('type:host', None)
+        self.assertEqual(search('type:host', None), hosts)
+        stats = self.datamgr.get_search_cache_stats()['results']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+        # The callers get their own list
+        hosts.pop()
+        self.assertEqual(len(search('type:host', None)), 12)
+        # The users do not share their results
+        self.assertLess(len(search('type:host', self.user(1))), 12)
+
+        # A managed brok changes the data version, the results are computed again
+        self.assertEqual(search('is:DOWN', None), [])
+        self.manage(self.host_down(2))
+        self.assertEqual([host.host_name for host in search('is:DOWN', None)], [self.estate.host_name(2)])
+
+    def test_visibility(self):
+        def check():
+            for k in range(3):
+                user = self.user(k)
+                related = [elt for elt in list(self.rg.hosts) + list(self.rg.services) if user._is_related_to(elt)]
+                self.assertTrue(related)
+                self.assertEqual(set(self.datamgr.search_hosts_and_services('', user)), set(related))
+
+        check()
+        # A problem makes its impacts visible to the contacts of the problem, and the reverse
+        problem, impact = self.rg.hosts.find_by_name(self.estate.host_name(0)), \
+            self.rg.hosts.find_by_name(self.estate.host_name(8))
+        broks = []
+        for i, data in ((0, {'impacts': [impact.uuid]}), (8, {'source_problems': [problem.uuid]})):
+            data = dict(self.estate.host_status(i, i % 2), **data)
+            data.update({'topology_change': False, 'uuid': data['id'], 'customs': {}, 'escalations': []})
+            broks.append(Brok('update_host_status', data))
+        visible = set(self.datamgr.search_hosts_and_services('type:host', self.user(1)))
+        self.manage(*broks)
+        self.assertEqual(impact.source_problems, [problem])
+        self.assertNotEqual(set(self.datamgr.search_hosts_and_services('type:host', self.user(1))), visible)
+        check()
+
+    def test_read_during_update(self):
+        # The pages read a published view while the state broks are managed without the lock
+        self.rg.publish_view()
+        stop = threading.Event()
+        errors = []
+        reads = []
+
+        def read():
+            while not stop.is_set():
+                version = self.datamgr.begin_read()
+                try:
+                    down = self.datamgr.search_hosts_and_services('type:host is:DOWN', None)
+                    synthesis = self.datamgr.get_hosts_synthesis()
+                    # The searches and counters of a page are computed from the same view
+                    if len(down) != synthesis['nb_down'] or self.datamgr.data_version != version:
+                        errors.append((version, len(down), synthesis['nb_down']))
+                    reads.append(version)
+                except Exception as exp:
+                    errors.append(exp)
+                finally:
+                    self.datamgr.end_read()
+
+        threads = [threading.Thread(target=read) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        try:
+            for n in range(72):
+                i = n % 12
+                if n % 24 < 12:
+                    brok = self.host_down(i)
+                else:
+                    brok = Brok('host_check_result', dict(self.estate.host_check_defaults,
+                                                          host_name=self.estate.host_name(i),
+                                                          state='UP', state_id=0, state_type='HARD'))
+                self.manage(brok)
+                if n % 3 == 2:
+                    self.rg.publish_view()
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(reads)
+
+        # The elements are not copied: a view may list an element whose live state is more recent
+        self.manage(self.host_down(11))
+        self.datamgr.begin_read()
+        try:
+            self.assertEqual(self.datamgr.search_hosts_and_services('type:host is:DOWN', None), [])
+        finally:
+            self.datamgr.end_read()
+        self.assertEqual(self.rg.hosts.find_by_name(self.estate.host_name(11)).state, 'DOWN')
+        self.rg.publish_view()
+        self.datamgr.begin_read()
+        try:
+            self.assertEqual([h.host_name for h in self.datamgr.search_hosts_and_services('type:host is:DOWN', None)],
+                             [self.estate.host_name(11)])
+        finally:
+            self.datamgr.end_read()
+
+    def test_reset_locks(self):
+        # The locks held by the threads of the process a worker was forked from
+        self.datamgr.search_results_lock.acquire()
+        self.datamgr.search_compiler.plans.lock.acquire()
+        self.datamgr.search_results.lock.acquire()
+        self.datamgr.reset_locks()
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            self.datamgr.search_hosts_and_services('type:host', None)))
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(results[0]), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from shinken.brok import Brok
+from module.regenerator import Regenerator
+from module.datamanager import WebUIDataManager
+from module.ui_user import User
+from module.search_query import compile_search
+from estate import Estate
+
+
+class TestEstate(unittest.TestCase):
+    def setUp(self):
+        self.estate = Estate(hosts=12, services=3, hostgroups=4, servicegroups=2, tags=3,
+                             depth=2, contacts=3, schedulers=2)
+        self.rg = Regenerator()
+        for brok in self.estate.all_initial_broks():
+            brok.prepare()
+            self.rg.manage_brok(brok)
+        self.datamgr = WebUIDataManager(self.rg)
+
+    def test_linking(self):
+        self.assertEqual(len(self.rg.hosts), 12)
+        self.assertEqual(len(self.rg.services), 36)
+        host = self.rg.hosts.find_by_name(self.estate.host_name(1))
+        self.assertEqual([parent.host_name for parent in host.parents], [self.estate.host_name(0)])
+        self.assertEqual(len(host.services), 3)
+        self.assertEqual(len(host.hostgroups), 2)
+
+    def test_searches(self):
+        self.assertEqual(len(self.datamgr.search_hosts_and_services('type:host', None)), 12)
+        self.assertEqual(len(self.datamgr.search_hosts_and_services('type:host htag:tag-000', None)), 8)
+        self.assertEqual(len(self.datamgr.search_hosts_and_services('type:host hg:hostgroup-000', None)), 6)
+        # The durations change with the time, their results are not cached
+        cached = len(self.datamgr.search_results)
+        self.datamgr.search_hosts_and_services('type:host duration:>1h', None)
+        self.assertEqual(len(self.datamgr.search_results), cached)
+
+    def test_tags(self):
+        self.assertEqual(self.datamgr.get_host_tags(), [('tag-000', 8), ('tag-001', 8), ('tag-002', 8)])
+        self.assertEqual(len(self.datamgr.get_hosts_tagged_with('tag-000', None)), 8)
+        # The counts do not drift when a scheduler sends its configuration again
+        for brok in self.estate.initial_broks(0):
+            brok.prepare()
+            self.rg.manage_brok(brok)
+        self.assertEqual(self.rg.tags, {'tag-000': 8, 'tag-001': 8, 'tag-002': 8})
+
+    def test_problems_classification(self):
+        name = self.estate.host_name(4)
+        data = dict(self.estate.host_check_defaults, host_name=name, state='DOWN', state_id=1,
+                    state_type='HARD', is_problem=False)
+        brok = Brok('host_check_result', data)
+        brok.prepare()
+        self.rg.manage_brok(brok)
+        host = self.rg.hosts.find_by_name(name)
+        self.assertTrue(host.is_problem)
+        self.assertTrue(all(service.is_impact for service in host.services
+                            if service.state_type == 'HARD'))
+        self.assertIn(host, self.datamgr.search_hosts_and_services('type:host is:DOWN', None))
+
+        # The synthesis only read the classification
+        version = self.rg.data_version
+        synthesis = self.datamgr.get_hosts_synthesis()
+        self.assertEqual(self.datamgr.get_hosts_synthesis(), synthesis)
+        self.datamgr.get_services_synthesis()
+        self.assertEqual(self.rg.data_version, version)
+
+    def test_synthesis_counters(self):
+        for brok in self.estate.check_result_broks(100) + self.estate.update_broks(20):
+            brok.prepare()
+            self.rg.manage_brok(brok)
+        self.rg.clean_instance(1)
+
+        for name in (self.estate.contact_name(0), self.estate.contact_name(1)):
+            user = User.from_contact(self.rg.contacts.find_by_name(name))
+            hosts = self.datamgr.search_hosts_and_services('type:host', user)
+            services = self.datamgr.search_hosts_and_services('type:service', user)
+            self.assertEqual(self.datamgr.get_hosts_synthesis(user=user),
+                             self.datamgr.get_hosts_synthesis(hosts, user))
+            self.assertEqual(self.datamgr.get_services_synthesis(user=user),
+                             self.datamgr.get_services_synthesis(services, user))
+            self.assertEqual(self.datamgr.get_important_services_synthesis(user=user),
+                             self.datamgr.get_services_synthesis(self.datamgr.get_important_services(user)))
+
+    def test_published_views(self):
+        self.rg.clean_instance(1)
+        view = self.rg.publish_view()
+        self.datamgr.begin_read()
+        try:
+            hosts = self.datamgr.search_hosts_and_services('type:host', None)
+            synthesis = self.datamgr.get_services_synthesis()
+            self.assertEqual(self.datamgr.data_version, view.version)
+        finally:
+            self.datamgr.end_read()
+        self.assertEqual(len(hosts), 6)
+
+        # The broks update the live index, the published view does not change
+        for brok in self.estate.check_result_broks(50):
+            brok.prepare()
+            self.rg.manage_brok(brok)
+        self.datamgr.begin_read()
+        try:
+            self.assertEqual(self.datamgr.search_hosts_and_services('type:host', None), hosts)
+            self.assertEqual(self.datamgr.get_services_synthesis(), synthesis)
+        finally:
+            self.datamgr.end_read()
+
+        # The next view only copies the changed sets
+        new_view = self.rg.publish_view()
+        self.assertIs(new_view.members, view.members)
+        self.assertIs(new_view.fields['realm'], view.fields['realm'])
+        self.datamgr.begin_read()
+        try:
+            self.assertEqual(self.datamgr.get_services_synthesis(),
+                             self.datamgr.get_services_synthesis(self.rg.services))
+        finally:
+            self.datamgr.end_read()
+
+    def test_request_memo(self):
+        name = self.estate.host_name(2)
+        self.datamgr.begin_request()
+        host = self.datamgr.get_host(name)
+        synthesis = self.datamgr.get_hosts_synthesis()
+        self.assertIs(self.datamgr.get_host(name), host)
+        self.assertIs(self.datamgr.get_hosts_synthesis(), synthesis)
+        # The unhashable arguments are not memoized
+        self.datamgr.get_hosts_synthesis(list(self.rg.hosts))
+        self.datamgr.get_hosts_synthesis(list(self.rg.hosts))
+
+        # The data changed, the results are computed again
+        brok = Brok('host_check_result', dict(self.estate.host_check_defaults, host_name=name, state='DOWN',
+                                              state_id=1, state_type='HARD'))
+        brok.prepare()
+        self.rg.manage_brok(brok)
+        self.assertNotEqual(self.datamgr.get_hosts_synthesis(), synthesis)
+
+        stats = self.datamgr.end_request()
+        self.assertEqual(stats['get_host'], {'calls': 2, 'hits': 1, 'saved': stats['get_host']['saved']})
+        self.assertEqual(stats['get_hosts_synthesis']['calls'], 3)
+        self.assertEqual(stats['get_hosts_synthesis']['hits'], 1)
+        self.assertIsNone(self.datamgr.end_request())
+
+    def test_check_results(self):
+        for brok in self.estate.check_result_broks(50) + self.estate.update_broks(10):
+            brok.prepare()
+            self.rg.manage_brok(brok)
+        self.assertEqual(len(self.rg.services), 36)
+
+    def test_coalesce_not_normalized(self):
+        name = self.estate.host_name(2)
+        broks = []
+        for state_id in range(3):
+            brok = Brok('host_check_result', dict(self.estate.host_check_defaults, host_name=name,
+                                                  state_id=state_id))
+            brok.prepare()
+            broks.append(brok)
+        self.rg.normalize_brok(broks[0])
+        self.rg.normalize_brok(broks[2])
+        # The brok that could not be normalized is a barrier
+        self.assertEqual(self.rg.coalesce_broks(broks), broks)
+        self.rg.normalize_brok(broks[1])
+        self.assertEqual(self.rg.coalesce_broks(broks), broks[:1])
+        self.assertEqual(broks[0].data['state_id'], 2)
+
+
+
+def reference_filter(datamgr, term, items):
+    """ The linear scan of the items with a search term, as the search worked before the indexes """
+    t, s = term.key, term.value
+    if t in ['h', 'host', 's', 'service'] and term.pattern is None:
+        return items
+    if t in ['h', 'host']:
+        return [i for i in items if term.pattern.search(i.host_name)]
+    if t in ['s', 'service']:
+        return [i for i in items if i.__class__.my_type == 'service' and term.pattern.search(i.get_name())]
+    if t in ['hg', 'hgroup', 'hostgroup']:
+        group = datamgr.get_hostgroup(s)
+        if not group:
+            return items
+        return [i for i in items if group.get_name() in [g.get_name() for g in i.get_hostgroups()]]
+    if t in ['sg', 'sgroup', 'servicegroup']:
+        group = datamgr.get_servicegroup(s)
+        if not group:
+            return items
+        return [i for i in items if group.get_name() in [g.get_name() for g in getattr(i, 'servicegroups', [])]]
+    if t in ['c', 'contact']:
+        # Only the contacts were matching
+        return items if s.lower() == 'all' else []
+    if t == 'realm':
+        return [i for i in items if i.get_realm() == s]
+    if t == 'htag':
+        return [i for i in items if s in i.get_host_tags()]
+    if t == 'stag':
+        return [i for i in items if i.__class__.my_type == 'service' and s in i.get_service_tags()]
+    if t == 'type':
+        return [i for i in items if i.__class__.my_type == s]
+    if t == 'bi':
+        return [i for i in items if term.predicate(i.business_impact)]
+    if t in ['is', 'isnot']:
+        negate = t == 'isnot'
+        if s in ['ack', 'downtime']:
+            attr = 'problem_has_been_acknowledged' if s == 'ack' else 'in_scheduled_downtime'
+            flagged = lambda i: getattr(i, attr) or (i.__class__.my_type == 'service' and getattr(i.host, attr))
+            return [i for i in items if flagged(i) != negate]
+        if s in ['impact', 'flapping']:
+            attr = 'is_impact' if s == 'impact' else 'is_flapping'
+            return [i for i in items if bool(getattr(i, attr)) != negate]
+        if s in ['soft', 'hard']:
+            return [i for i in items if ((i.state_type == 'HARD') == (s == 'hard')) != negate]
+        hard = None
+        if s.startswith('s'):
+            s, hard = s[1:], False
+        elif s.startswith('h'):
+            s, hard, negate = s[1:], True, True
+        matches = (lambda i: i.state_id == int(s)) if len(s) == 1 else (lambda i: i.state == s.upper())
+        return [i for i in items if matches(i) != negate and
+                (hard is None or (i.state_type == 'HARD') == hard)]
+    return datamgr._search_scan(term, items, None)
+
+
+def reference_search(datamgr, search):
+    items = list(datamgr.rg.hosts) + list(datamgr.rg.services)
+    for term in compile_search(search):
+        if term.key == 'name':
+            names = [i for i in items if datamgr._match_name(term.pattern, i)]
+            items = names or [i for i in items if datamgr._match_output(term.pattern, i)]
+        else:
+            items = reference_filter(datamgr, term, items)
+    return set(items)
+
+
+class TestSearchParity(unittest.TestCase):
+    """ The indexed searches find the same elements as the linear scan """
+
+    def setUp(self):
+        self.estate = Estate(hosts=30, services=4, hostgroups=4, servicegroups=3, tags=3,
+                             depth=2, contacts=3, schedulers=2, problems=0.4)
+        self.rg = Regenerator()
+        for brok in self.estate.all_initial_broks():
+            brok.prepare()
+            self.rg.manage_brok(brok)
+        # Some elements in a downtime or flapping
+        for index, brok in enumerate(self.estate.update_broks(20)):
+            brok.prepare()
+            brok.data['in_scheduled_downtime'] = index % 2 == 0
+            brok.data['is_flapping'] = index % 3 == 0
+            self.rg.manage_brok(brok)
+        self.datamgr = WebUIDataManager(self.rg)
+
+    def check(self, search):
+        found = set(self.datamgr.search_hosts_and_services(search, None))
+        self.assertEqual(found, reference_search(self.datamgr, search), search)
+        return found
+
+    def test_terms(self):
+        searches = [
+            'h:host-00000[1-3]', 'host:^host-00001', 's:service-00[12]', 'service:all',
+            'hg:hostgroup-001', 'sg:servicegroup-002', 'hg:unknown', 'realm:All', 'realm:unknown',
+            'htag:tag-001', 'stag:tag-001', 'type:host', 'type:service', 'bi:>=3', 'bi:<2', 'bi:4',
+            'c:contact-000'
+        ]
+        for search in searches:
+            self.check(search)
+
+    def test_states(self):
+        for key in ['is', 'isnot']:
+            for value in ['ack', 'downtime', 'impact', 'flapping', 'soft', 'hard',
+                          '0', '1', '2', 'UP', 'down', 'critical', 'OK', 'warning',
+                          's1', 'sCRITICAL', 'h0', 'hOK']:
+                self.check('%s:%s' % (key, value))
+        self.assertTrue(self.check('is:downtime'))
+        self.assertTrue(self.check('is:flapping'))
+        self.assertTrue(self.check('is:ack'))
+
+    def test_mixed(self):
+        searches = [
+            'type:service is:critical', 'isnot:0 isnot:ack bi:>=2', 'hg:hostgroup-000 isnot:hard',
+            # Free text terms, matching the names or else the outputs
+            'host-00000', 'CRITICAL', 'service-001 is:critical', 'is:critical service-001',
+            'is:critical WARNING', 'WARNING is:critical', 'host-000001 CRITICAL',
+            'NOT host-00000 type:host'
+        ]
+        for search in searches:
+            self.check(search)
+
+    def test_free_text_order(self):
+        # The output of a critical service names a host without critical service
+        host_name = self.estate.host_name(3)
+        broks = [Brok('host_check_result', dict(self.estate.host_check_defaults, host_name=host_name,
+                                                 state='UP', state_id=0, state_type='HARD', is_problem=False))]
+        for j in range(4):
+            broks.append(Brok('service_check_result', dict(
+                self.estate.service_check_defaults, host_name=host_name,
+                service_description=self.estate.service_description(j), state='OK', state_id=0,
+                state_type='HARD', is_problem=False, output='OK')))
+        broks.append(Brok('service_check_result', dict(
+            self.estate.service_check_defaults, host_name=self.estate.host_name(5),
+            service_description=self.estate.service_description(0), state='CRITICAL', state_id=2,
+            state_type='HARD', is_problem=True, output='disk %s full' % host_name)))
+        for brok in broks:
+            brok.prepare()
+            self.rg.manage_brok(brok)
+
+        # The name matches before the state term restricts the elements: no output is searched
+        self.assertEqual(self.check('%s is:critical' % host_name), set())
+        # No critical element has a matching name: the outputs are searched
+        found = self.check('is:critical %s' % host_name)
+        self.assertEqual([i.get_full_name() for i in found],
+                         ['%s/%s' % (self.estate.host_name(5), self.estate.service_description(0))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import socket
+import httplib
+import threading
+import unittest
+import bottle
+from module.http_server import ThreadPoolWSGIServer
+
+
+class TestThreadPoolWSGIServer(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.server = None
+
+    def start(self, app, **options):
+        self.server = ThreadPoolWSGIServer(('127.0.0.1', 0), quiet=True, **options)
+        self.server.set_app(app)
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        self.port = self.server.server_port
+
+    def tearDown(self):
+        self.release.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def get(self, connection, path):
+        connection.request('GET', path)
+        response = connection.getresponse()
+        return response.status, response.read(), response.getheader('connection')
+
+    def app(self):
+        app = bottle.Bottle()
+        app.route('/fast', callback=lambda: 'fast')
+
+        def slow():
+            self.release.wait(5)
+            return 'slow'
+        app.route('/slow', callback=slow)
+
+        def stream():
+            yield 'a'
+            yield 'b'
+        app.route('/stream', callback=stream)
+        return app
+
+    def test_slow_page(self):
+        self.start(self.app(), workers=2, keepalive_timeout=0)
+        slow = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        slow.request('GET', '/slow')
+        time.sleep(0.1)
+        # The other thread serves the other users
+        self.assertEqual(self.get(httplib.HTTPConnection('127.0.0.1', self.port, timeout=5), '/fast')[1], 'fast')
+        time.sleep(0.1)
+        self.assertEqual(self.server.get_stats()['active'], 1)
+        self.release.set()
+        self.assertEqual(slow.getresponse().read(), 'slow')
+
+    def test_keep_alive(self):
+        self.start(self.app(), workers=1, keepalive_timeout=2)
+        connection = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.assertEqual(self.get(connection, '/fast'), (200, 'fast', None))
+        sock = connection.sock
+        self.assertEqual(self.get(connection, '/fast'), (200, 'fast', None))
+        self.assertIs(connection.sock, sock)
+        # Unknown length, the connection is closed
+        self.assertEqual(self.get(connection, '/stream'), (200, 'ab', 'close'))
+
+        # No keep-alive by default
+        self.tearDown()
+        self.start(self.app(), workers=1)
+        self.assertEqual(self.get(httplib.HTTPConnection('127.0.0.1', self.port, timeout=5), '/fast'),
+                         (200, 'fast', 'close'))
+
+    def test_idle_connection(self):
+        # A connection that sends nothing does not hold the only thread forever
+        self.start(self.app(), workers=1, keepalive_timeout=0, request_timeout=0.5)
+        idle = socket.create_connection(('127.0.0.1', self.port), timeout=5)
+        self.addCleanup(idle.close)
+        time.sleep(0.1)
+        self.assertEqual(self.server.get_stats()['active'], 1)
+        start = time.time()
+        self.assertEqual(self.get(httplib.HTTPConnection('127.0.0.1', self.port, timeout=5), '/fast')[1], 'fast')
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(idle.recv(1024), '')
+
+        # The keep-alive wait between the requests does not use the request timeout
+        self.tearDown()
+        self.start(self.app(), workers=1, keepalive_timeout=1, request_timeout=0.2)
+        connection = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.assertEqual(self.get(connection, '/fast'), (200, 'fast', None))
+        sock = connection.sock
+        time.sleep(0.5)
+        self.assertEqual(self.get(connection, '/fast'), (200, 'fast', None))
+        self.assertIs(connection.sock, sock)
+
+    def test_queue_full(self):
+        self.start(self.app(), workers=1, queue_size=1, keepalive_timeout=0)
+        busy = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        busy.request('GET', '/slow')
+        time.sleep(0.1)
+        queued = socket.create_connection(('127.0.0.1', self.port))
+        time.sleep(0.1)
+        rejected = httplib.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        self.assertEqual(self.get(rejected, '/fast')[0], 503)
+        stats = self.server.get_stats()
+        self.assertEqual((stats['active'], stats['queued'], stats['rejected']), (1, 1, 1))
+        queued.close()
+        self.release.set()
+        self.assertEqual(busy.getresponse().read(), 'slow')
+
+
+if __name__ == '__main__':
+    unittest.main()
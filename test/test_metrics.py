@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+from module import metrics
+
+
+class TestHistogram(unittest.TestCase):
+    def test_cumulative_buckets(self):
+        histogram = metrics.Histogram((1, 5))
+        for value in (0.5, 2, 3, 10):
+            histogram.observe(value)
+        stats = histogram.get_stats()
+        self.assertEqual(stats['buckets'], [(1, 1), (5, 3), ('+Inf', 4)])
+        self.assertEqual(stats['max'], 10)
+
+
+class TestBroksMetrics(unittest.TestCase):
+    def test_observe(self):
+        broks = metrics.BroksMetrics()
+        broks.observe('host_check_result', 0.001, created=time.time() - 2)
+        broks.observe('log', 0.001)
+        stats = broks.get_stats()
+        self.assertEqual(sorted(stats['types']), ['host_check_result', 'log'])
+        self.assertEqual(stats['lag']['count'], 1)
+        self.assertTrue(stats['last_lag'] >= 2)
+
+
+class TestRoutesMetrics(unittest.TestCase):
+    def test_observe(self):
+        routes = metrics.RoutesMetrics()
+        routes.observe('/host/:name', 0.5, 2.0)
+        routes.observe('/host/:name', 0.0, 1.0)
+        routes.observe('/dashboard', 0.0, 0.1)
+        stats = routes.get_stats()
+        self.assertEqual(sorted(stats), ['/dashboard', '/host/:name'])
+        self.assertEqual(stats['/host/:name']['held']['count'], 2)
+        self.assertEqual(stats['/host/:name']['held']['max'], 2.0)
+        self.assertEqual(stats['/host/:name']['wait']['sum'], 0.5)
+
+
+class TestPrometheus(unittest.TestCase):
+    def test_text(self):
+        histogram = metrics.Histogram((1,))
+        histogram.observe(0.5)
+        text = metrics.prometheus_text([
+            ('webui_test_seconds', 'histogram', 'Test',
+             metrics.prometheus_histogram('webui_test_seconds', histogram.get_stats(), {'type': 'a"b'}))
+        ])
+        self.assertEqual(text.splitlines(), [
+            '# HELP webui_test_seconds Test',
+            '# TYPE webui_test_seconds histogram',
+            'webui_test_seconds_bucket{le="1",type="a\\"b"} 1',
+            'webui_test_seconds_bucket{le="+Inf",type="a\\"b"} 1',
+            'webui_test_seconds_sum{type="a\\"b"} 0.5',
+            'webui_test_seconds_count{type="a\\"b"} 1'
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
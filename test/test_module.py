@@ -1,8 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import tempfile, unittest
+import os, tempfile, threading, time, unittest
+from shinken.basemodule import BaseModule
+from shinken.brok import Brok
+from shinken.objects.module import Module
 from module import module
+from module.regenerator import Regenerator
+from module.datamanager import WebUIDataManager
+from module.rwlock import ReadWriteLock
+from estate import Estate
 
 class Conf(object): pass
 
@@ -51,5 +58,175 @@ class TestResolveAuthSecret(unittest.TestCase):
         self.assertEqual(res1, res2)
 
 
+class RecordingLock(object):
+    """ A writer lock recording the broks managed while it is held """
+    def __init__(self):
+        self.slices = []
+        self.held = False
+
+    def acquire_write(self):
+        self.held = True
+        self.slices.append([])
+        return 0
+
+    def release_write(self):
+        self.held = False
+
+
+class TestManageMessage(unittest.TestCase):
+    def setUp(self):
+        self.broker = module.Webui_broker.__new__(module.Webui_broker)
+        self.broker.rwlock = RecordingLock()
+        self.broker.published_views = False
+        self.broker.broks_batch = 1
+        self.broker.broks_batch_time_slice = 0
+        self.broker.apply_brok = self.apply_brok
+        self.delay = 0
+
+    def apply_brok(self, brok, modules=True):
+        self.assertTrue(self.broker.rwlock.held)
+        self.broker.rwlock.slices[-1].append(brok.type)
+        time.sleep(self.delay)
+
+    def manage(self, count):
+        message = [Conf() for _ in range(count)]
+        for i, brok in enumerate(message):
+            brok.type = 'brok-%d' % i
+        self.broker.manage_message(message)
+        return [len(managed) for managed in self.broker.rwlock.slices]
+
+    def test_single_batch(self):
+        self.assertEqual(self.manage(6), [6])
+        self.assertEqual(self.broker.rwlock.slices[0], ['brok-%d' % i for i in range(6)])
+
+    def test_per_brok(self):
+        self.broker.broks_batch = 0
+        self.assertEqual(self.manage(3), [1, 1, 1])
+
+    def test_time_slice(self):
+        # The writer lock is released when the time slice is over, the broks order is kept
+        self.broker.broks_batch_time_slice = 0.05
+        self.delay = 0.03
+        self.assertEqual(self.manage(6), [2, 2, 2])
+        self.assertEqual(sum(self.broker.rwlock.slices, []), ['brok-%d' % i for i in range(6)])
+
+
+class ModulesManager(object):
+    def __init__(self, *instances):
+        self.instances = list(instances)
+
+    def get_internal_instances(self):
+        return self.instances
+
+
+class LogsModule(BaseModule):
+    def manage_log_brok(self, brok):
+        pass
+
+
+class AllBroksModule(BaseModule):
+    def manage_brok(self, brok):
+        pass
+
+
+class TestFilterBroks(unittest.TestCase):
+    def setUp(self):
+        self.broker = module.Webui_broker.__new__(module.Webui_broker)
+        self.broker.rg = Regenerator()
+        self.broker.modules_manager = ModulesManager()
+        self.broker.managed_brok_types_key = None
+        self.broker.managed_brok_types = None
+        self.broker.broks_counters = {}
+
+    def filter(self, *types):
+        return [b.type for b in self.broker.filter_broks([Brok(brok_type, {}) for brok_type in types])]
+
+    def test_regenerator_types(self):
+        self.assertEqual(self.filter('host_check_result', 'log', 'log', 'initial_host_status'),
+                         ['host_check_result', 'initial_host_status'])
+        self.assertEqual(self.broker.broks_counters['log'], {'decoded': 0, 'dropped': 2})
+        self.assertEqual(self.broker.broks_counters['host_check_result'], {'decoded': 1, 'dropped': 0})
+
+    def test_modules_types(self):
+        # A module manages the broks it has a function for ...
+        self.broker.modules_manager.instances.append(LogsModule(Module({'module_name': 'logs', 'module_type': 'logs'})))
+        self.assertEqual(self.filter('log', 'unknown'), ['log'])
+        # ... or the broks it declares, the types are computed again when the modules change
+        declared = Conf()
+        declared.brok_types = ['unknown']
+        self.broker.modules_manager.instances.append(declared)
+        self.assertEqual(self.filter('log', 'unknown', 'other'), ['log', 'unknown'])
+        # A module with its own manage_brok function may manage any brok
+        self.broker.modules_manager.instances.append(AllBroksModule(Module({'module_name': 'all', 'module_type': 'all'})))
+        self.assertEqual(self.filter('log', 'unknown', 'other'), ['log', 'unknown', 'other'])
+        self.broker.modules_manager.instances.pop()
+        self.assertEqual(self.filter('other'), [])
+
+
+class TestSaveSnapshot(unittest.TestCase):
+    def setUp(self):
+        estate = Estate(hosts=30, services=5, schedulers=2)
+        self.broker = module.Webui_broker.__new__(module.Webui_broker)
+        self.broker.rg = Regenerator()
+        for brok in estate.all_initial_broks():
+            brok.prepare()
+            self.broker.rg.manage_brok(brok)
+        self.broker.datamgr = WebUIDataManager(self.broker.rg)
+        self.broker.rwlock = ReadWriteLock()
+        fd, self.broker.snapshot_file = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.broker.snapshot_file)
+        self.broker.snapshot_period = 300
+        self.broker.snapshot_last = 0
+        self.broker.snapshot_writer = None
+
+    def test_save_while_searching(self):
+        stop = threading.Event()
+        errors = []
+
+        def search():
+            # The pages read the objects under the reader lock
+            while not stop.is_set():
+                self.broker.rwlock.acquire_read()
+                try:
+                    self.broker.datamgr.search_hosts_and_services('type:service is:critical', None)
+                    self.broker.datamgr.get_hosts_synthesis()
+                except Exception as exp:
+                    errors.append(exp)
+                finally:
+                    self.broker.rwlock.release_read()
+
+        threads = [threading.Thread(target=search) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        try:
+            self.broker.save_snapshot()
+            self.broker.snapshot_writer.join(30)
+            self.assertFalse(self.broker.snapshot_writer.is_alive())
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+
+        rg = Regenerator()
+        rg.load_snapshot(self.broker.snapshot_file)
+        self.assertEqual((len(rg.hosts), len(rg.services)), (30, 150))
+
+    def test_single_writer(self):
+        writer = Conf()
+        writer.is_alive = lambda: True
+        self.broker.snapshot_writer = writer
+        self.broker.save_snapshot()
+        self.assertIs(self.broker.snapshot_writer, writer)
+        self.assertEqual(os.path.getsize(self.broker.snapshot_file), 0)
+
+    def test_save_error(self):
+        self.broker.snapshot_file = os.path.join(self.broker.snapshot_file, 'not-a-directory')
+        self.broker.save_snapshot()
+        self.broker.snapshot_writer.join(30)
+        self.assertFalse(os.path.exists(self.broker.snapshot_file))
+
+
 if __name__ == '__main__':
     unittest.main()
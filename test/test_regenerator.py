@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+from shinken.brok import Brok
+from module.regenerator import Regenerator, SNAPSHOT_INSTANCES_TIMEOUT
+from module.datamanager import WebUIDataManager
+from estate import Estate
+
+
+class TestRegenerator(unittest.TestCase):
+    def setUp(self):
+        self.estate = Estate(hosts=12, services=3, hostgroups=4, servicegroups=2, tags=3,
+                             depth=2, contacts=3, schedulers=2, problems=0)
+        self.rg = Regenerator()
+        self.manage(*self.estate.all_initial_broks())
+
+    def manage(self, *broks):
+        for brok in broks:
+            brok.prepare()
+            self.rg.manage_brok(brok)
+
+    def test_ids_indexes(self):
+        def check():
+            self.assertEqual(len(self.rg.hosts), 12)
+            self.assertEqual(len(self.rg.services), 36)
+            self.assertEqual(len(self.rg.ids['host']), 12)
+            self.assertEqual(len(self.rg.ids['service']), 36)
+            for host in self.rg.hosts:
+                self.assertIs(self.rg.ids['host'][host.id], host)
+                self.assertIs(self.rg.hosts.find_by_name(host.host_name), host)
+            for service in self.rg.services:
+                self.assertIs(self.rg.ids['service'][service.id], service)
+            for k in range(3):
+                contact = self.rg.contacts.find_by_name(self.estate.contact_name(k))
+                self.assertIs(self.rg.ids['contact']['contact-%d' % k], contact)
+            self.assertIs(self.rg.ids['timeperiod']['timeperiod-24x7'], self.rg.timeperiods.find_by_name('24x7'))
+
+            # The relations are linked with the indexed objects
+            host = self.rg.hosts.find_by_name(self.estate.host_name(1))
+            self.assertEqual(sorted(contact.contact_name for contact in host.contacts),
+                             self.estate.element_contacts(1))
+            self.assertIs(host.check_period, self.rg.timeperiods.find_by_name('24x7'))
+            self.assertEqual(sorted(group.get_name() for group in host.hostgroups), ['hostgroup-001', 'hostgroup-002'])
+
+        check()
+        host = self.rg.hosts.find_by_name(self.estate.host_name(1))
+        self.assertEqual(host.parents, [self.rg.hosts.find_by_name(self.estate.host_name(0))])
+
+        # A scheduler sending its configuration again replaces its objects, without duplicates
+        # (the program status of a scheduler is ignored during a minute after the previous one)
+        self.rg.configs[0]['_timestamp'] -= 60
+        old = self.rg.hosts.find_by_name(self.estate.host_name(2))
+        self.manage(*self.estate.initial_broks(0))
+        check()
+        host = self.rg.hosts.find_by_name(self.estate.host_name(2))
+        self.assertIsNot(host, old)
+        self.assertNotIn(old, self.rg.ids['host'].values())
+        for group in host.hostgroups:
+            self.assertNotIn(old, group.members)
+
+    def host_result(self, i, state_id, **data):
+        return Brok('host_check_result', dict(self.estate.host_check_defaults, host_name=self.estate.host_name(i),
+                                              state_id=state_id, output='output %d' % state_id, **data))
+
+    def service_result(self, i, j, state_id):
+        return Brok('service_check_result', dict(self.estate.service_check_defaults,
+                                                 host_name=self.estate.host_name(i),
+                                                 service_description=self.estate.service_description(j),
+                                                 state_id=state_id, output='output %d' % state_id))
+
+    def test_coalesce_broks(self):
+        status = self.estate.host_status(5, 1)
+        status.update({'topology_change': False, 'uuid': status['id'], 'customs': {}, 'escalations': []})
+        broks = [
+            self.host_result(2, 1),
+            self.service_result(2, 0, 1),
+            self.host_result(3, 1),
+            self.host_result(2, 2, last_chk=1),
+            Brok('host_next_schedule', dict(self.estate.host_check_defaults, host_name=self.estate.host_name(3),
+                                            next_chk=2)),
+            Brok('update_host_status', status),
+            self.service_result(2, 0, 3),
+            self.host_result(2, 0),
+            self.service_result(2, 0, 2),
+            # An unmanaged brok is not a barrier
+            Brok('unknown_brok_type', {}),
+            self.host_result(2, 1),
+        ]
+        for brok in broks:
+            brok.prepare()
+            self.rg.normalize_brok(brok)
+
+        result = self.rg.coalesce_broks(list(broks))
+        # The first brok of each element in a barrier interval is kept, in the received order
+        self.assertEqual(result, [broks[i] for i in (0, 1, 2, 5, 6, 7, 9)])
+        # The latest values win
+        self.assertEqual((broks[0].data['state_id'], broks[0].data['output'], broks[0].data['last_chk']),
+                         (2, 'output 2', 1))
+        self.assertEqual(broks[2].data['next_chk'], 2)
+        self.assertEqual(broks[6].data['output'], 'output 2')
+        self.assertEqual(broks[7].data['state_id'], 1)
+        self.assertEqual(self.rg.folded_broks, 4)
+
+        # The coalesced broks update the elements as the received ones
+        self.manage(*result)
+        host = self.rg.hosts.find_by_name(self.estate.host_name(2))
+        self.assertEqual((host.state_id, host.output), (1, 'output 1'))
+        service = self.rg.services.find_srv_by_name_and_hostname(self.estate.host_name(2),
+                                                                 self.estate.service_description(0))
+        self.assertEqual((service.state_id, service.output), (2, 'output 2'))
+        self.assertEqual(self.rg.hosts.find_by_name(self.estate.host_name(3)).next_chk, 2)
+
+
+    def test_clean_instance(self):
+        kept = self.rg.hosts.find_by_name(self.estate.host_name(1))
+        removed = [elt for elt in list(self.rg.hosts) + list(self.rg.services)
+                   if elt.instance_id == 1 and elt is not kept and elt not in kept.services]
+        others = [elt for elt in list(self.rg.hosts) + list(self.rg.services) if elt.instance_id == 0]
+        groups = set()
+        for elt in removed:
+            groups.update(self.rg.groups_of[elt])
+        self.assertTrue(groups)
+
+        self.rg.clean_instance(1, keep=set([kept] + kept.services))
+        self.assertEqual(len(self.rg.hosts), 7)
+        self.assertEqual(len(self.rg.services), 21)
+        self.assertEqual(self.rg.partitions[1], {'host': set([kept]), 'service': set(kept.services)})
+        self.assertEqual(len(self.rg.partitions[0]['host']), 6)
+        for elt in others:
+            self.assertIs(self.rg.ids[elt.__class__.my_type][elt.id], elt)
+        for elt in removed:
+            self.assertNotIn(elt.id, self.rg.ids[elt.__class__.my_type])
+            self.assertNotIn(elt, self.rg.groups_of)
+        # The removed elements are not members of their groups anymore, nor searched for
+        for group in groups:
+            self.assertFalse(set(group.members) & set(removed))
+        self.assertIn(kept, kept.hostgroups[0].members)
+        datamgr = WebUIDataManager(self.rg)
+        self.assertEqual(set(datamgr.search_hosts_and_services('', None)), set(others + [kept] + kept.services))
+
+    def snapshot_path(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_snapshot(self):
+        self.manage(*self.estate.check_result_broks(50))
+        path = self.snapshot_path()
+        self.rg.save_snapshot(path)
+        self.assertFalse(os.path.exists(path + '.tmp'))
+        rg = Regenerator()
+        rg.load_snapshot(path)
+
+        self.assertEqual(sorted(rg.configs), [0, 1])
+        for host in self.rg.hosts:
+            loaded = rg.hosts.find_by_name(host.host_name)
+            self.assertEqual((loaded.state_id, loaded.output, loaded.instance_id),
+                             (host.state_id, host.output, host.instance_id))
+            self.assertEqual([parent.host_name for parent in loaded.parents],
+                             [parent.host_name for parent in host.parents])
+            self.assertEqual(sorted(s.get_name() for s in loaded.services), sorted(s.get_name() for s in host.services))
+            self.assertIs(rg.ids['host'][host.id], loaded)
+        self.assertEqual(len(rg.services), 36)
+        self.assertEqual(dict((c_id, dict((t, len(elts)) for t, elts in partition.items()))
+                              for c_id, partition in rg.partitions.items()),
+                         {0: {'host': 6, 'service': 18}, 1: {'host': 6, 'service': 18}})
+        # The loaded objects are indexed for the searches
+        search = 'hg:hostgroup-001 type:host'
+        self.assertEqual(sorted(h.host_name for h in WebUIDataManager(rg).search_hosts_and_services(search, None)),
+                         sorted(h.host_name for h in WebUIDataManager(self.rg).search_hosts_and_services(search, None)))
+
+    def test_snapshot_instances(self):
+        path = self.snapshot_path()
+        self.rg.save_snapshot(path)
+        rg = Regenerator()
+        rg.load_snapshot(path)
+        self.assertEqual(rg.snapshot_instances, set([0, 1]))
+
+        # The scheduler 0 restarts with another instance id, and without its first host
+        removed = self.estate.host_name(0)
+        for brok in self.estate.initial_broks(0):
+            brok.prepare()
+            brok.data['instance_id'] = 'uuid-0'
+            if brok.data.get('host_name') != removed:
+                rg.manage_brok(brok)
+        self.assertEqual(rg.snapshot_instances, set([1]))
+        self.assertEqual(sorted(rg.configs), [1, 'uuid-0'])
+        self.assertIsNone(rg.hosts.find_by_name(removed))
+        self.assertEqual((len(rg.hosts), len(rg.services)), (11, 33))
+
+        # The scheduler 1 did not come back in time
+        rg.snapshot_loaded -= SNAPSHOT_INSTANCES_TIMEOUT + 1
+        brok = Brok('update_program_status', {'instance_id': 'uuid-0', 'instance_name': 'scheduler-0'})
+        brok.prepare()
+        rg.manage_brok(brok)
+        self.assertEqual(rg.snapshot_instances, set())
+        self.assertEqual(sorted(rg.configs), ['uuid-0'])
+        self.assertEqual((len(rg.hosts), len(rg.services)), (5, 15))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import signal
+import logging
+import threading
+import unittest
+from StringIO import StringIO
+from module.regenerator import Regenerator
+from module.replicas import Replicas, encode_message, read_messages, fork_process
+from estate import Estate
+
+
+def work(replicas):
+    """ Worker process: apply the stream until the WebUI process closes it """
+    try:
+        for sequence, sent, _ in replicas.receive():
+            replicas.applied(sequence, sent)
+    finally:
+        os._exit(0)
+
+
+class TestReplicas(unittest.TestCase):
+    def test_stream(self):
+        estate = Estate(hosts=4, services=2)
+        broks = estate.all_initial_broks()
+        for brok in broks:
+            brok.prepare()
+        stream = StringIO(encode_message(1, broks, 10.0) + encode_message(2, [], 11.0))
+
+        rg = Regenerator()
+        messages = list(read_messages(stream))
+        self.assertEqual([(sequence, sent) for sequence, sent, _ in messages], [(1, 10.0), (2, 11.0)])
+        for brok in messages[0][2]:
+            rg.manage_brok(brok)
+        self.assertEqual(len(rg.services), 8)
+
+        # A truncated message ends the stream
+        data = encode_message(1, broks)
+        self.assertEqual(list(read_messages(StringIO(data[:-1]))), [])
+
+    def test_workers(self):
+        replicas = Replicas(2)
+        if replicas.fork() is not None:
+            work(replicas)
+
+        replicas.send(['first'])
+        replicas.send([])
+        replicas.send(['second'])
+        self.stop(replicas)
+
+        stats = replicas.get_stats()
+        self.assertIsNone(stats['worker'])
+        self.assertEqual(stats['sequence'], 2)
+        self.assertEqual([worker['sequence'] for worker in stats['workers']], [2, 2])
+        self.assertEqual([worker['behind'] for worker in stats['workers']], [0, 0])
+
+    def test_respawn(self):
+        replicas = Replicas(2)
+        if replicas.fork() is not None:
+            work(replicas)
+        replicas.send(['first'])
+        self.assertIsNone(replicas.respawn())
+
+        pid = replicas.workers[0].pid
+        os.kill(pid, signal.SIGKILL)
+        for _ in range(100):
+            if replicas.check():
+                break
+            time.sleep(0.02)
+        self.assertEqual(replicas.exited, set([0]))
+        if replicas.respawn() is not None:
+            work(replicas)
+        self.assertNotEqual(replicas.workers[0].pid, pid)
+        self.assertFalse(replicas.check())
+
+        # The new worker starts from the last streamed message
+        replicas.send(['second'])
+        self.stop(replicas)
+        stats = replicas.get_stats()
+        self.assertEqual([worker['sequence'] for worker in stats['workers']], [2, 2])
+
+    def test_late_worker(self):
+        replicas = Replicas(1, queue_size=2)
+        if replicas.fork() is not None:
+            # This worker does not read the stream
+            try:
+                time.sleep(10)
+            finally:
+                os._exit(0)
+        for _ in range(4):
+            replicas.send(['x' * 100000])
+        self.assertFalse(replicas.workers[0].alive)
+
+        # The worker is stopped and forked again
+        for _ in range(100):
+            if replicas.check():
+                break
+            time.sleep(0.02)
+        if replicas.respawn() is not None:
+            work(replicas)
+        replicas.send(['last'])
+        self.stop(replicas)
+        self.assertEqual(replicas.get_stats()['workers'][0]['sequence'], 5)
+
+    def test_ingestion_stats(self):
+        replicas = Replicas(1)
+        self.assertIsNone(replicas.get_ingestion_stats())
+        replicas.publish_ingestion_stats({'folded': 1})
+        if replicas.fork() is not None:
+            # The worker reports what the WebUI process publishes next
+            try:
+                for sequence, sent, _ in replicas.receive():
+                    if replicas.get_ingestion_stats() == {'folded': 2}:
+                        replicas.applied(sequence, sent)
+            finally:
+                os._exit(0)
+        self.assertEqual(replicas.get_ingestion_stats(), {'folded': 1})
+        replicas.publish_ingestion_stats({'folded': 2})
+        replicas.send(['first'])
+        self.stop(replicas)
+        self.assertEqual(replicas.get_stats()['workers'][0]['sequence'], 1)
+
+    def test_fork_logging_locks(self):
+        # Another thread is logging while the process is forked
+        output = StringIO()
+        handler = logging.StreamHandler(output)
+        log = logging.getLogger('test-fork')
+        log.addHandler(handler)
+        self.addCleanup(log.removeHandler, handler)
+        held = threading.Event()
+
+        def emit():
+            with handler.lock:
+                held.set()
+                time.sleep(0.2)
+
+        thread = threading.Thread(target=emit)
+        thread.start()
+        held.wait()
+        pid = fork_process()
+        if pid == 0:
+            log.error('child')
+            os._exit(0)
+        thread.join()
+        for _ in range(100):
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                break
+            time.sleep(0.05)
+        else:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.fail("the child process is blocked on the logging lock")
+
+    def stop(self, replicas):
+        for worker in replicas.workers:
+            worker.stop()
+            worker.thread.join()
+            os.waitpid(worker.pid, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
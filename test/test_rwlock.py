@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+from module import rwlock
+
+
+class TestReadWriteLock(unittest.TestCase):
+    def test_readers_share_the_lock(self):
+        lock = rwlock.ReadWriteLock()
+        lock.acquire_read()
+        acquired = threading.Event()
+
+        def reader():
+            lock.acquire_read()
+            acquired.set()
+            lock.release_read()
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        lock.release_read()
+
+    def test_read_lock_is_reentrant(self):
+        lock = rwlock.ReadWriteLock()
+        lock.acquire_read()
+        lock.acquire_read()
+        lock.release_read()
+        self.assertEqual(lock.readers, 1)
+        lock.release_read()
+        self.assertEqual(lock.readers, 0)
+
+    def test_writer_preference(self):
+        lock = rwlock.ReadWriteLock()
+        events = []
+        lock.acquire_read()
+
+        def writer():
+            lock.acquire_write()
+            events.append('write')
+            lock.release_write()
+
+        def reader():
+            lock.acquire_read()
+            events.append('read')
+            lock.release_read()
+
+        writer_thread = threading.Thread(target=writer)
+        writer_thread.start()
+        while not lock.waiting_writers:
+            time.sleep(0.001)
+
+        # A new reader must wait for the waiting writer
+        reader_thread = threading.Thread(target=reader)
+        reader_thread.start()
+        while not lock.waiting_readers:
+            time.sleep(0.001)
+        self.assertEqual(events, [])
+
+        lock.release_read()
+        writer_thread.join(5)
+        reader_thread.join(5)
+        self.assertEqual(events, ['write', 'read'])
+        self.assertEqual(lock.get_stats()['write_wait']['count'], 1)
+        self.assertEqual(lock.get_stats()['read_wait']['count'], 2)
+
+    def test_handoff_to_the_waiting_readers_only(self):
+        lock = rwlock.ReadWriteLock()
+        events = []
+        lock.acquire_write()
+        release_first = threading.Event()
+
+        def first_reader():
+            lock.acquire_read()
+            events.append('first')
+            release_first.wait(5)
+            lock.release_read()
+
+        def writer():
+            lock.acquire_write()
+            events.append('write')
+            lock.release_write()
+
+        def late_reader():
+            lock.acquire_read()
+            events.append('late')
+            lock.release_read()
+
+        first_thread = threading.Thread(target=first_reader)
+        first_thread.start()
+        while not lock.waiting_readers:
+            time.sleep(0.001)
+        writer_thread = threading.Thread(target=writer)
+        writer_thread.start()
+        while not lock.waiting_writers:
+            time.sleep(0.001)
+
+        # The first reader was waiting when the lock was released, the late one arrives after
+        lock.release_write()
+        late_thread = threading.Thread(target=late_reader)
+        late_thread.start()
+        while 'first' not in events:
+            time.sleep(0.001)
+        release_first.set()
+        for thread in (first_thread, writer_thread, late_thread):
+            thread.join(5)
+        self.assertEqual(events, ['first', 'write', 'late'])
+        self.assertEqual(lock.handoff, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from module import search_query
+
+
+class TestCompileSearch(unittest.TestCase):
+    def test_terms(self):
+        plan = search_query.compile_search('isnot:UP bi:>=3 "vm fred" h:^srv')
+        self.assertEqual([(t.key, t.value) for t in plan],
+                         [('isnot', 'UP'), ('bi', '>=3'), ('name', 'vm fred'), ('h', '^srv')])
+
+    def test_precompiled(self):
+        name, host, bi, duration = search_query.compile_search('VM h:^srv bi:>2 duration:<=5m')
+        self.assertTrue(name.pattern.search('my-vm'))
+        self.assertTrue(host.pattern.search('srv-web'))
+        self.assertFalse(host.pattern.search('SRV-web'))
+        self.assertTrue(bi.predicate(3))
+        self.assertFalse(bi.predicate(2))
+        self.assertTrue(duration.predicate(300))
+        self.assertFalse(duration.predicate(301))
+
+    def test_invalid_comparisons(self):
+        bi, duration = search_query.compile_search('bi:>=high duration:5m')
+        self.assertIsNone(bi.predicate)
+        self.assertIsNone(duration.predicate)
+
+    def test_time_dependent(self):
+        self.assertTrue(search_query.is_time_dependent(search_query.compile_search('is:DOWN duration:>1h')))
+        self.assertFalse(search_query.is_time_dependent(search_query.compile_search('is:DOWN bi:>1')))
+
+    def test_legacy_filters(self):
+        plan = search_query.compile_search('ack:false downtime:yes crit:1')
+        self.assertEqual([(t.key, t.value) for t in plan],
+                         [('isnot', 'ack'), ('is', 'downtime'), ('is', 'critical')])
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_bounded(self):
+        cache = search_query.LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        # b is the least recently used one
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.get_stats()['hits'], 3)
+        self.assertEqual(cache.get_stats()['misses'], 1)
+
+    def test_compiler_reuses_plans(self):
+        compiler = search_query.SearchQueryCompiler(8)
+        self.assertIs(compiler.compile('type:host'), compiler.compile('type:host'))
+
+
+if __name__ == '__main__':
+    unittest.main()